@@ -1,4 +1,3 @@
-import json
 import time
 
 import numpy as np
@@ -98,14 +97,18 @@ class TankDefault:
         self.display_stats = True
 
     def pack(self):
-        s = json.dumps({"pos": self.pos.tolist(), "rotation": self.rotation,
-                        "current_shooting_time": self.current_shooting_time, "shoot": self.shoot,
-                        "explode": self.explode})
+        """
+        :return: input message payload, encoded by Networking with the negotiated protocol
+        """
+
+        d = {"pos": self.pos.tolist(), "rotation": self.rotation,
+             "current_shooting_time": self.current_shooting_time, "shoot": self.shoot,
+             "explode": self.explode}
         if self.shoot:
             self.shoot = False
         if self.explode:
             self.explode = False
-        return s
+        return d
 
     def draw(self, surface):
         """
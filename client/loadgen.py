@@ -0,0 +1,265 @@
+"""
+Headless load generator: many scripted players in one asyncio process, no pygame.
+Every bot does the same handshake and sends the same input messages as Networking and TankDefault.pack() do:
+drives in circles, rotates the turret, shoots all the time and sets off a bomb now and then.
+
+    python loadgen.py [--uri ws://localhost:2022] [--bots 100] [--duration 30] [--ramp 25 --step-time 10]
+
+Reported: server tick rate and snapshot timing as seen by the clients, snapshot sizes, inbound bandwidth and
+connection failures. With --ramp bots are added in steps until the observed tick rate drops below --min-rate,
+which gives the player count the server loop can take.
+Needs the websockets package (same as the server)
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import struct
+import time
+
+import websockets
+
+import protocol
+
+input_interval = 0.02  # seconds between the inputs, same as Networking.sending_tank_data()
+max_speed = 200  # px/s, same as Processing in main.py
+full_shooting_time = 0.3  # TankDefault.time_to_shoot + reload_time
+
+
+def percentile(values, q):
+    if not values:
+        return 0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(len(s) * q))]
+
+
+class Stats:
+    """
+    Counters shared by all the bots, reset every report
+    """
+
+    def __init__(self):
+        self.connected = 0
+        self.failures = 0  # connections which couldn't be opened or were lost
+        # Connections closed cleanly by the server: the tank was killed (or the bot fell too far behind), it joins again
+        self.deaths = 0
+        self.reset()
+
+    def reset(self):
+        self.start = time.monotonic()
+        self.bytes_in = 0
+        self.messages_in = 0
+        self.sizes = {}  # message type -> [sizes]
+        self.intervals = []  # seconds between the snapshots of one bot
+        self.lateness = []  # seconds a snapshot came later than the least delayed one of the bot
+        self.tick_rates = []  # server ticks per second seen by the bots over the report period
+
+    def report(self, bots):
+        elapsed = time.monotonic() - self.start
+        lines = [f"bots {bots}  connected {self.connected}  failures {self.failures}  deaths {self.deaths}  "
+                 f"inbound {self.bytes_in / elapsed / 1024:.1f} KiB/s ({self.messages_in / elapsed:.0f} msg/s, "
+                 f"{self.bytes_in / elapsed / 1024 / max(1, self.connected):.1f} KiB/s per bot)",
+                 f"  server tick rate p50 {percentile(self.tick_rates, .5):.1f}/s "
+                 f"min {min(self.tick_rates, default=0):.1f}/s  "
+                 f"snapshot interval p50 {percentile(self.intervals, .5) * 1000:.1f} "
+                 f"p99 {percentile(self.intervals, .99) * 1000:.1f} ms  "
+                 f"lateness p50 {percentile(self.lateness, .5) * 1000:.1f} "
+                 f"p99 {percentile(self.lateness, .99) * 1000:.1f} ms"]
+        for type_, sizes in sorted(self.sizes.items()):
+            lines.append(f"  {type_:<15} {len(sizes) / elapsed:8.1f}/s  avg {sum(sizes) / len(sizes):8.0f} B  "
+                         f"p99 {percentile(sizes, .99):8.0f} B")
+        return "\n".join(lines)
+
+
+class Bot:
+    def __init__(self, uri, name, stats: Stats, bomb_interval):
+        """
+        :param bomb_interval: average seconds between the explode inputs, 0 -> no bombs
+        """
+
+        self.uri = uri
+        self.name = name
+        self.stats = stats
+
+        self.uuid = None
+        self.protocol = protocol.JSON
+        self.tick_time = 1 / 60
+        self.pos = None  # known after the first items message
+        self.rotation = 0
+        self.center = None
+        self.phase = random.uniform(0, 2 * math.pi)
+        self.radius = random.uniform(100, 400)
+        self.current_shooting_time = 0
+        self.bomb_interval = bomb_interval
+        self.next_bomb = time.monotonic() + random.uniform(0, 2 * bomb_interval) if bomb_interval else math.inf
+
+        self.min_offset = None  # least local time - server tick time seen so far
+        self.last_snapshot = None  # (local time, tick) of the previous snapshot
+        self.report_start = None  # (local time, tick) at the start of the report period
+
+    async def run(self, stop: asyncio.Event):
+        """
+        Plays until stopped, joining again when the tank is killed or the connection is lost
+        """
+
+        while not stop.is_set():
+            self.uuid = self.pos = self.center = self.last_snapshot = self.report_start = None
+            try:
+                async with websockets.connect(self.uri, max_size=None) as ws:
+                    await ws.send(json.dumps({"name": self.name, "protocols": list(protocol.SUPPORTED)}))
+                    self.stats.connected += 1
+                    try:
+                        await self.play(ws, stop)
+                    finally:
+                        self.stats.connected -= 1
+            except websockets.ConnectionClosedOK:
+                self.stats.deaths += 1
+            except Exception as e:
+                self.stats.failures += 1
+                print(f"[Bot.run] {self.name} connection failed:", repr(e))
+                await asyncio.sleep(1)
+
+    async def play(self, ws, stop):
+        sender = asyncio.ensure_future(self.send_inputs(ws))
+        receiver = asyncio.ensure_future(self.receive(ws))
+        stopped = asyncio.ensure_future(stop.wait())
+        done, _ = await asyncio.wait((sender, receiver, stopped), return_when=asyncio.FIRST_COMPLETED)
+        for task in (sender, receiver, stopped):
+            task.cancel()
+        for task in done:
+            if task is not stopped and task.exception() is not None:
+                raise task.exception()
+        if stopped not in done:
+            # Receiver is done when the server closes the connection cleanly
+            raise websockets.ConnectionClosedOK(None, None)
+
+    async def receive(self, ws):
+        async for message in ws:
+            t = time.monotonic()
+            self.stats.bytes_in += len(message)
+            self.stats.messages_in += 1
+            if type(message) == bytes:
+                type_ = protocol.MESSAGE_TYPES[message[0]]
+                # Only the header is needed, the snapshots aren't decoded
+                tick = struct.unpack_from("<I", message, 1)[0] if type_ in ("all_items", "delta") else None
+                j = protocol.decode(message) if type_ == "force_position" or self.pos is None else None
+            else:
+                j = protocol.decode_json(message)
+                type_, tick = j["type"], j.get("tick")
+            self.stats.sizes.setdefault(type_, []).append(len(message))
+
+            if type_ == "uuid_change":
+                self.uuid = j["payload"]["uuid"]
+                self.protocol = j["payload"].get("protocol", protocol.JSON)
+                self.tick_time = j["payload"].get("tick_time", self.tick_time)
+            elif type_ == "force_position":
+                self.pos = j["payload"]
+                self.center = None
+            elif self.pos is None and j is not None and type_ in ("items", "all_items"):
+                tank = j["payload"].get(self.uuid)
+                if tank is not None:
+                    self.pos = list(tank["pos"])
+            if tick is not None:
+                self.on_snapshot(t, tick)
+
+    def on_snapshot(self, t, tick):
+        offset = t - tick * self.tick_time
+        self.min_offset = offset if self.min_offset is None else min(self.min_offset, offset)
+        self.stats.lateness.append(offset - self.min_offset)
+        if self.last_snapshot is not None:
+            self.stats.intervals.append(t - self.last_snapshot[0])
+        self.last_snapshot = (t, tick)
+
+        if self.report_start is None or self.report_start[0] < self.stats.start:
+            self.report_start = (t, tick)
+        elif t - self.report_start[0] > 1:
+            self.stats.tick_rates.append((tick - self.report_start[1]) / (t - self.report_start[0]))
+            self.report_start = (t, tick)
+
+    async def send_inputs(self, ws):
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(input_interval)
+            t = time.monotonic()
+            dt, last = t - last, t
+            if self.pos is None:
+                continue
+            if self.center is None:
+                self.center = [self.pos[0] + self.radius * math.cos(self.phase),
+                               self.pos[1] - self.radius * math.sin(self.phase)]
+
+            # Circling around the center at max_speed, turret spinning
+            self.phase += max_speed * dt / self.radius
+            self.pos = [self.center[0] - self.radius * math.cos(self.phase),
+                        self.center[1] + self.radius * math.sin(self.phase)]
+            self.rotation = (self.rotation + 90 * dt) % 360
+
+            self.current_shooting_time += dt
+            shoot = self.current_shooting_time > full_shooting_time
+            if shoot:
+                self.current_shooting_time = 0
+            explode = t > self.next_bomb
+            if explode:
+                self.next_bomb = t + random.uniform(0, 2 * self.bomb_interval)
+
+            payload = {"pos": self.pos, "rotation": self.rotation,
+                       "current_shooting_time": self.current_shooting_time, "shoot": shoot, "explode": explode}
+            if self.protocol == protocol.BINARY_V3:
+                await ws.send(protocol.encode({"type": "input", "payload": payload}))
+            else:
+                await ws.send(json.dumps(payload))
+
+
+async def run(args):
+    stats = Stats()
+    stop = asyncio.Event()
+    tasks = []
+
+    async def add_bots(n):
+        for _ in range(n):
+            tasks.append(asyncio.ensure_future(Bot(args.uri, f"bot {len(tasks)}", stats, args.bomb_interval).run(stop)))
+            # Not all at once, the server spawns the tanks one by one
+            await asyncio.sleep(args.connect_interval)
+
+    if not args.ramp:
+        await add_bots(args.bots)
+        stats.reset()
+        await asyncio.sleep(args.duration)
+        print(stats.report(len(tasks)))
+    else:
+        while len(tasks) < args.bots:
+            await add_bots(min(args.ramp, args.bots - len(tasks)))
+            stats.reset()
+            await asyncio.sleep(args.step_time)
+            print(stats.report(len(tasks)), flush=True)
+            rate = percentile(stats.tick_rates, .5)
+            if rate < args.min_rate:
+                print(f"server tick rate {rate:.1f}/s is below {args.min_rate}/s with {len(tasks)} bots")
+                break
+
+    stop.set()
+    await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless load generator for the game server")
+    parser.add_argument("--uri", default="ws://localhost:2022")
+    parser.add_argument("--bots", type=int, default=100, help="bots to connect (the ramp limit with --ramp)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to measure, without --ramp")
+    parser.add_argument("--ramp", type=int, default=0, help="bots to add every step, 0 -> all at once")
+    parser.add_argument("--step-time", type=float, default=10, help="seconds every ramp step is measured for")
+    parser.add_argument("--min-rate", type=float, default=57, help="ramp stops below this server tick rate")
+    parser.add_argument("--bomb-interval", type=float, default=60,
+                        help="average seconds between the bombs of a bot, 0 -> no bombs")
+    parser.add_argument("--connect-interval", type=float, default=0.01, help="seconds between the connections")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -80,6 +80,11 @@ class Processing:
         tanks = self.game.tanks.copy()
         projectiles = self.game.projectiles.copy()
 
+        # Remote tanks are drawn a bit in the past, between the two snapshots around that time
+        render_tick, tick_time = self.game.get_render_tick(), self.game.server_clock.tick_time
+        tanks = {a: self.net.snapshots.interpolate(a, b, render_tick, tick_time) if a != self.game.our_tank_uuid else b
+                 for a, b in tanks.items()}
+
         # s = drawing.comic_sans_big.render(str(len(food) + len(tanks) + len(projectiles)), True, (255, 255, 0, 30))
         # self.game.w.blit(s, (0, 40))
 
@@ -10,6 +10,8 @@ import Food
 import Projectiles
 import Tanks
 import drawing
+import protocol
+import simulation
 
 our_uuid = ""
 
@@ -34,7 +36,9 @@ class GameDrawing:
 
         self.sync = asyncio.Lock()
         self.our_tank = Tanks.TankDefault(self)
-        self.our_tank_uuid = ""
+        self.our_tank_uuid = 0  # handle of our tank
+        self.server_clock = simulation.ServerClock()
+        self.our_tank_public_id = ""
         self.tanks = {}
         self.food = {}
         self.projectiles = {}
@@ -119,11 +123,19 @@ class GameDrawing:
 
             tank.draw(self.w)
 
+    def get_render_tick(self):
+        """
+        :return: server tick the remote items are drawn at, simulation.interpolation_delay behind the server time
+        """
+
+        return self.server_clock.get_tick() - simulation.interpolation_delay / self.server_clock.tick_time
+
     def draw_projectiles(self, projectiles: dict):
+        tick, tick_time = self.get_render_tick(), self.server_clock.tick_time
         for uuid, projectile in projectiles.items():
             p = Projectiles.ProjectileBullet()
             p.colors = np.array(projectile["colors"])
-            p.pos = np.array(projectile["pos"])
+            p.pos = np.array(simulation.get_pos(projectile, tick, tick_time))
             p.angle = projectile["angle"]
             p.speed = projectile["speed"]
             p.radius = projectile["radius"]
@@ -133,13 +145,14 @@ class GameDrawing:
             p.draw(self.w)
 
     def draw_food(self, food: dict):
+        tick, tick_time = self.get_render_tick(), self.server_clock.tick_time
         for uuid, food in food.items():
             i = Food.FoodSquare()
             i.basic_colors = np.array(food["colors"])
             i.colors = i.basic_colors.copy()
-            i.pos = np.array(food["pos"])
+            i.pos = np.array(simulation.get_pos(food, tick, tick_time))
             i.radius = food["radius"]
-            i.rotation = food["rotation"]
+            i.rotation = simulation.get_rotation(food, tick, tick_time)
 
             i.is_disappearing = food["is_disappearing"]
             i.is_hit = food["is_hit"]
@@ -268,12 +281,17 @@ class Networking:
         self.game = game
 
         self.ws_status = "WS_NOT_INITIALIZED"
+        self.protocol = protocol.JSON
+        self.server_tick = 0  # tick of the last snapshot received
+        self.snapshots = simulation.SnapshotBuffer()  # remote tanks poses, for the interpolation
+        self.archetypes = ()  # static fields of the items, sent with the handshake
         # websocket.enableTrace(True)
         self.ws: websocket.WebSocketApp = websocket.WebSocketApp("")
 
     def run_forever(self, uri, name):
         self.our_name = name
         self.ws_status = "WS_OPENING"
+        self.protocol = protocol.JSON
         self.ws = websocket.WebSocketApp(uri,
                                          on_open=self.on_open,
                                          on_message=self.on_message,
@@ -295,25 +313,45 @@ class Networking:
     def sending_tank_data(self):
         while True:
             if self.ws_status == "WS_OPENED" and self.send_tank_data and self.game.our_tank.is_active:
-                self.ws.send(self.game.our_tank.pack())
+                tank_data = self.game.our_tank.pack()
+                if self.protocol == protocol.BINARY_V3:
+                    self.ws.send(protocol.encode({"type": "input", "payload": tank_data}),
+                                 websocket.ABNF.OPCODE_BINARY)
+                else:
+                    self.ws.send(json.dumps(tank_data))
                 self.send_tank_data = False
             time.sleep(0.02)
 
     def on_message(self, ws, message):
-        j = json.loads(message)
+        j = protocol.decode(message) if type(message) == bytes else protocol.decode_json(message)
+        if "tick" in j:
+            self.server_tick = j["tick"]
+            self.game.server_clock.on_tick(self.server_tick)
+        self.expand_archetypes(j)
+        self.set_anchor_tick(j)
 
         if j["type"] == "uuid_change":
+            self.protocol = j["payload"].get("protocol", protocol.JSON)
+            self.archetypes = j["payload"].get("archetypes", ())
             self.game.our_tank_uuid = j["payload"]["uuid"]
+            self.game.our_tank_public_id = j["payload"].get("public_id", "")
+            # Items coming with the handshake are as of this tick
+            self.server_tick = j["payload"].get("tick", 0)
+            self.game.server_clock.on_tick(self.server_tick, j["payload"].get("tick_time"))
         elif j["type"] == "delete":
-            pass  # no need to handle as server sends us all items every server tick
-            # for uuid, a in j["payload"].items():
-            #     continue
-            #     if a["type"] == "tank":
-            #         del self.game.tanks[uuid]
-            #     elif a["type"] == "food":
-            #         del self.game.food[uuid]
-            #     elif a["type"] == "projectile":
-            #         del self.game.projectiles[uuid]
+            for uuid in j["payload"]:
+                self.remove_item(uuid)
+        elif j["type"] == "delta":
+            # Only the changes since the previous snapshot, full state comes with "all_items" keyframes
+            for uuid, item in j["payload"]["created"].items():
+                self.get_items(item["type"])[uuid] = item
+            for uuid, fields in j["payload"]["changed"].items():
+                for items in (self.game.tanks, self.game.food, self.game.projectiles):
+                    if uuid in items:
+                        items[uuid] = items[uuid] | fields
+                        break
+            for uuid in j["payload"]["removed"]:
+                self.remove_item(uuid)
         elif j["type"] == "items" or j["type"] == "all_items":
             tanks = {}
             food = {}
@@ -341,6 +379,54 @@ class Networking:
         elif j["type"] == "inventory":
             self.game.our_tank.inventory = j["payload"]
 
+        if j["type"] in ("items", "all_items", "delta", "delete"):
+            self.snapshots.add(self.server_tick, self.game.tanks)
+
+    def expand_archetypes(self, j):
+        """
+        Items come with their own fields and the archetype id only, the static fields are added from the archetype
+        """
+
+        if j["type"] == "items" or j["type"] == "all_items":
+            items = j["payload"]
+        elif j["type"] == "delta":
+            items = j["payload"]["created"]
+        else:
+            return
+        for uuid, item in items.items():
+            if "archetype" in item:
+                items[uuid] = self.archetypes[item["archetype"]] | item
+
+    def set_anchor_tick(self, j):
+        """
+        Marks the items positions received with the message as the ones at the current server tick,
+        simulation.get_pos() moves the items from there
+        """
+
+        if j["type"] == "items" or j["type"] == "all_items":
+            records = (j["payload"],)
+        elif j["type"] == "delta":
+            records = (j["payload"]["created"], j["payload"]["changed"])
+        else:
+            return
+        for items in records:
+            for item in items.values():
+                if "pos" in item:
+                    item["anchor_tick"] = self.server_tick
+
+    def get_items(self, type_):
+        if type_ == "tank":
+            return self.game.tanks
+        elif type_ == "food":
+            return self.game.food
+        return self.game.projectiles
+
+    def remove_item(self, uuid):
+        for items in (self.game.tanks, self.game.food, self.game.projectiles):
+            if uuid in items:
+                del items[uuid]
+                break
+
     def on_error(self, ws, error):
         self.ws_status = "WS_ERROR"
         print("on_error:", error)
@@ -350,4 +436,4 @@ class Networking:
 
     def on_open(self, ws):
         self.ws_status = "WS_OPENED"
-        self.send_message(json.dumps({"name": self.our_name}))
+        self.send_message(json.dumps({"name": self.our_name, "protocols": list(protocol.SUPPORTED)}))
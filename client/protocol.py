@@ -0,0 +1,359 @@
+"""
+Binary wire protocol, negotiated at the {"name": ..., "protocols": [...]} handshake. Version 0 is the JSON fallback.
+
+Items are keyed by their integer handles in both. Binary messages carry the same dicts as the JSON ones
+({"type": ..., "payload": ...}), but positions and angles are fixed-point and only the fields known to FIELDS are sent.
+Snapshots (all_items, delta) also carry the server "tick" they were taken at.
+Items carry only their own state and the "archetype" id, the static fields of the archetypes come with the handshake.
+This file is shared by the server and the client, keep server/protocol.py and client/protocol.py identical!
+"""
+
+import json
+import struct
+
+JSON = 0
+BINARY_V3 = 3  # v1 had no snapshot ticks, v2 no tank public_id
+SUPPORTED = (BINARY_V3, JSON)
+
+POS_SCALE = 16  # positions are sent in 1/16 px
+ANGLE_SCALE = 65536 / 360  # angles are sent as u16 fractions of the full turn
+PUBLIC_ID_SIZE = 36  # tank public_id (uuid4 string) is sent as fixed-width ASCII, padded with zeros
+
+MESSAGE_TYPES = ("input", "items", "all_items", "delta", "delete", "force_position", "inventory")
+ITEM_TYPES = ("tank", "food", "projectile")
+
+_u16 = struct.Struct("<H")
+_u32 = struct.Struct("<I")
+_i32 = struct.Struct("<i")
+_f32 = struct.Struct("<f")
+_pos = struct.Struct("<ii")
+_record_header = struct.Struct("<II")  # handle, fields mask
+_input = struct.Struct("<iiHfB")  # pos, rotation, current_shooting_time, flags
+
+
+def negotiate(protocols):
+    """
+    :param protocols: protocol versions offered by the client
+    :return: the best version supported by both sides
+    """
+
+    for version in SUPPORTED:
+        if version in protocols:
+            return version
+    return JSON
+
+
+def _encode_pos(buf, value):
+    buf += _pos.pack(int(round(value[0] * POS_SCALE)), int(round(value[1] * POS_SCALE)))
+
+
+def _decode_pos(data, offset):
+    x, y = _pos.unpack_from(data, offset)
+    return [x / POS_SCALE, y / POS_SCALE], offset + 8
+
+
+def _encode_angle(buf, value):
+    buf += _u16.pack(int(round(value % 360 * ANGLE_SCALE)) & 0xffff)
+
+
+def _decode_angle(data, offset):
+    return _u16.unpack_from(data, offset)[0] / ANGLE_SCALE, offset + 2
+
+
+def _encode_f32(buf, value):
+    buf += _f32.pack(value)
+
+
+def _decode_f32(data, offset):
+    return _f32.unpack_from(data, offset)[0], offset + 4
+
+
+def _encode_i32(buf, value):
+    buf += _i32.pack(int(value))
+
+
+def _decode_i32(data, offset):
+    return _i32.unpack_from(data, offset)[0], offset + 4
+
+
+def _encode_bool(buf, value):
+    buf.append(1 if value else 0)
+
+
+def _decode_bool(data, offset):
+    return data[offset] != 0, offset + 1
+
+
+def _encode_u8(buf, value):
+    buf.append(value)
+
+
+def _decode_u8(data, offset):
+    return data[offset], offset + 1
+
+
+def _encode_str(buf, value):
+    s = value.encode()[:255]
+    buf.append(len(s))
+    buf += s
+
+
+def _decode_str(data, offset):
+    length = data[offset]
+    return bytes(data[offset + 1:offset + 1 + length]).decode(errors="replace"), offset + 1 + length
+
+
+def _encode_colors(buf, value):
+    buf.append(len(value))
+    for color in value:
+        buf += bytes(int(a) for a in color)
+
+
+def _decode_colors(data, offset):
+    count = data[offset]
+    offset += 1
+    return [list(data[offset + i * 4:offset + i * 4 + 4]) for i in range(count)], offset + count * 4
+
+
+def _encode_inventory(buf, value):
+    buf.append(len(value))
+    for name, amount in value.items():
+        _encode_str(buf, name)
+        buf += _u16.pack(amount)
+
+
+def _decode_inventory(data, offset):
+    count = data[offset]
+    offset += 1
+    ret = {}
+    for _ in range(count):
+        name, offset = _decode_str(data, offset)
+        ret[name] = _u16.unpack_from(data, offset)[0]
+        offset += 2
+    return ret, offset
+
+
+def _encode_public_id(buf, value):
+    buf += value.encode()[:PUBLIC_ID_SIZE].ljust(PUBLIC_ID_SIZE, b"\0")
+
+
+def _decode_public_id(data, offset):
+    return bytes(data[offset:offset + PUBLIC_ID_SIZE]).rstrip(b"\0").decode(errors="replace"), offset + PUBLIC_ID_SIZE
+
+
+def _encode_handle(buf, value):
+    buf += _u32.pack(value)
+
+
+def _decode_handle(data, offset):
+    return _u32.unpack_from(data, offset)[0], offset + 4
+
+
+def _encode_item_type(buf, value):
+    buf.append(ITEM_TYPES.index(value))
+
+
+def _decode_item_type(data, offset):
+    return ITEM_TYPES[data[offset]], offset + 1
+
+
+_pos_codec = (_encode_pos, _decode_pos)
+_angle_codec = (_encode_angle, _decode_angle)
+_f32_codec = (_encode_f32, _decode_f32)
+_bool_codec = (_encode_bool, _decode_bool)
+_str_codec = (_encode_str, _decode_str)
+
+# Item fields sent to the clients, in the order of the bits of the record fields mask (max 32)
+FIELDS = (("type", (_encode_item_type, _decode_item_type)), ("pos", _pos_codec), ("rotation", _angle_codec),
+          ("angle", _angle_codec), ("speed", _f32_codec), ("rotation_speed", _f32_codec), ("radius", _f32_codec),
+          ("health", _f32_codec), ("max_health", _f32_codec), ("score", (_encode_i32, _decode_i32)),
+          ("lifetime", _f32_codec), ("disappearing_time", _f32_codec), ("animation_time", _f32_codec),
+          ("current_animation_time", _f32_codec), ("current_shooting_time", _f32_codec),
+          ("is_hit", _bool_codec), ("is_disappearing", _bool_codec), ("is_bomb", _bool_codec),
+          ("colors", (_encode_colors, _decode_colors)), ("name", _str_codec), ("class", _str_codec),
+          ("parent", (_encode_handle, _decode_handle)), ("inventory", (_encode_inventory, _decode_inventory)),
+          ("archetype", (_encode_u8, _decode_u8)), ("public_id", (_encode_public_id, _decode_public_id)))
+_fields_encode = tuple((name, 1 << i, codec[0]) for i, (name, codec) in enumerate(FIELDS))
+
+
+def _encode_record(buf, handle, item):
+    """
+    :return: False if none of the fields of the item are in FIELDS, nothing is written then
+    """
+
+    header = len(buf)
+    buf += _record_header.pack(0, 0)
+    mask = 0
+    for name, bit, encode_field in _fields_encode:
+        if name in item:
+            mask |= bit
+            encode_field(buf, item[name])
+    if not mask:
+        del buf[header:]
+        return False
+    _record_header.pack_into(buf, header, handle, mask)
+    return True
+
+
+def _decode_record(data, offset):
+    handle, mask = _record_header.unpack_from(data, offset)
+    offset += 8
+    item = {}
+    for i, (name, (_, decode_field)) in enumerate(FIELDS):
+        if mask & (1 << i):
+            item[name], offset = decode_field(data, offset)
+    return handle, item, offset
+
+
+def _encode_records(buf, items):
+    header = len(buf)
+    buf += _u32.pack(0)
+    count = 0
+    for handle, item in items.items():
+        count += _encode_record(buf, handle, item)
+    _u32.pack_into(buf, header, count)
+
+
+def _decode_records(data, offset):
+    count = _u32.unpack_from(data, offset)[0]
+    offset += 4
+    items = {}
+    for _ in range(count):
+        handle, item, offset = _decode_record(data, offset)
+        items[handle] = item
+    return items, offset
+
+
+def _encode_handles(buf, handles):
+    buf += struct.pack(f"<I{len(handles)}I", len(handles), *handles)
+
+
+def _decode_handles(data, offset):
+    count = _u32.unpack_from(data, offset)[0]
+    offset += 4
+    return list(struct.unpack_from(f"<{count}I", data, offset)), offset + count * 4
+
+
+def encode(message) -> bytes:
+    """
+    :param message: {"type": ..., "payload": ...} message, same as for JSON; snapshots take "tick" too
+    :return: binary message
+    """
+
+    type_ = message["type"]
+    payload = message["payload"]
+    buf = bytearray((MESSAGE_TYPES.index(type_),))
+    if type_ == "all_items" or type_ == "delta":
+        buf += _u32.pack(message.get("tick", 0))
+
+    if type_ == "input":
+        flags = (1 if payload["shoot"] else 0) | (2 if payload["explode"] else 0)
+        buf += _input.pack(int(round(payload["pos"][0] * POS_SCALE)), int(round(payload["pos"][1] * POS_SCALE)),
+                           int(round(payload["rotation"] % 360 * ANGLE_SCALE)) & 0xffff,
+                           payload["current_shooting_time"], flags)
+    elif type_ == "items" or type_ == "all_items":
+        _encode_records(buf, payload)
+    elif type_ == "delta":
+        _encode_records(buf, payload["created"])
+        _encode_records(buf, payload["changed"])
+        _encode_handles(buf, payload["removed"])
+    elif type_ == "delete":
+        buf += _u32.pack(len(payload))
+        for handle, item in payload.items():
+            buf += _u32.pack(handle)
+            buf.append(ITEM_TYPES.index(item["type"]))
+    elif type_ == "force_position":
+        _encode_pos(buf, payload)
+    elif type_ == "inventory":
+        _encode_inventory(buf, payload)
+    return bytes(buf)
+
+
+def encode_record(handle, item) -> bytes:
+    """
+    :return: item record, encoded once and shared by the messages built with encode_snapshot(); empty if none of
+        the fields of the item are in FIELDS
+    """
+
+    buf = bytearray()
+    _encode_record(buf, handle, item)
+    return bytes(buf)
+
+
+def encode_snapshot(type_, tick, records, changed=(), removed=()) -> bytes:
+    """
+    Same as encode() for the all_items and delta messages, but assembled from the records made by encode_record()
+    :param records: records of all_items payload or delta created items
+    :param changed: records of delta changed items
+    :param removed: handles of delta removed items
+    """
+
+    records = [a for a in records if a]
+    buf = bytearray((MESSAGE_TYPES.index(type_),))
+    buf += _u32.pack(tick)
+    buf += _u32.pack(len(records))
+    buf += b"".join(records)
+    if type_ == "delta":
+        changed = [a for a in changed if a]
+        buf += _u32.pack(len(changed))
+        buf += b"".join(changed)
+        _encode_handles(buf, removed)
+    return bytes(buf)
+
+
+def decode(data) -> dict:
+    """
+    :param data: binary message
+    :return: {"type": ..., "payload": ...} message (plus "tick" for snapshots), items are keyed by their handles
+    """
+
+    type_ = MESSAGE_TYPES[data[0]]
+    offset = 1
+    ret = {"type": type_}
+    if type_ == "all_items" or type_ == "delta":
+        ret["tick"] = _u32.unpack_from(data, offset)[0]
+        offset += 4
+
+    if type_ == "input":
+        x, y, rotation, current_shooting_time, flags = _input.unpack_from(data, offset)
+        payload = {"pos": [x / POS_SCALE, y / POS_SCALE], "rotation": rotation / ANGLE_SCALE,
+                   "current_shooting_time": current_shooting_time, "shoot": bool(flags & 1),
+                   "explode": bool(flags & 2)}
+    elif type_ == "items" or type_ == "all_items":
+        payload, offset = _decode_records(data, offset)
+    elif type_ == "delta":
+        created, offset = _decode_records(data, offset)
+        changed, offset = _decode_records(data, offset)
+        removed, offset = _decode_handles(data, offset)
+        payload = {"created": created, "changed": changed, "removed": removed}
+    elif type_ == "delete":
+        count = _u32.unpack_from(data, offset)[0]
+        offset += 4
+        payload = {}
+        for _ in range(count):
+            payload[_u32.unpack_from(data, offset)[0]] = {"type": ITEM_TYPES[data[offset + 4]]}
+            offset += 5
+    elif type_ == "force_position":
+        payload, offset = _decode_pos(data, offset)
+    else:
+        payload, offset = _decode_inventory(data, offset)
+    ret["payload"] = payload
+    return ret
+
+
+def decode_json(data) -> dict:
+    """
+    json.loads() for the JSON fallback: object keys are always strings in JSON, item handles are turned back into ints
+    :param data: JSON message
+    :return: {"type": ..., "payload": ...} message, items are keyed by their handles
+    """
+
+    message = json.loads(data)
+    type_ = message.get("type")
+    payload = message.get("payload")
+    if type_ in ("items", "all_items", "delete"):
+        message["payload"] = {int(a): b for a, b in payload.items()}
+    elif type_ == "delta":
+        payload["created"] = {int(a): b for a, b in payload["created"].items()}
+        payload["changed"] = {int(a): b for a, b in payload["changed"].items()}
+    return message
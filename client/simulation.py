@@ -0,0 +1,119 @@
+"""
+Client side simulation of the items which move on their own (projectiles, food): the server sends their pos only
+when they show up, as of the tick of that message ("anchor_tick"), the client moves them the same way
+Processing.move() on the server does
+"""
+
+import collections
+import math
+import time
+
+
+class ServerClock:
+    """
+    Estimate of the current server tick. Every snapshot gives a sample of the offset between the local clock and
+    the server ticks; the smallest recent one (the snapshot which was delayed the least) is used
+    """
+
+    def __init__(self, window=60):
+        self.tick_time = 1 / 60
+        self.samples = collections.deque(maxlen=window)
+        self.offset = None
+
+    def on_tick(self, tick, tick_time=None):
+        """
+        :param tick: server tick of the message just received
+        :param tick_time: seconds per server tick, if known
+        """
+
+        if tick_time:
+            self.tick_time = tick_time
+        self.samples.append(time.monotonic() - tick * self.tick_time)
+        self.offset = min(self.samples)
+
+    def get_tick(self) -> float:
+        if self.offset is None:
+            return 0
+        return (time.monotonic() - self.offset) / self.tick_time
+
+
+def get_pos(item, tick, tick_time):
+    """
+    :param tick: server tick to get the position at
+    :return: position of the item, extrapolated from the one it had at its anchor_tick
+    """
+
+    if "anchor_tick" not in item or not item.get("speed"):
+        return item["pos"]
+    t = (tick - item["anchor_tick"]) * tick_time
+    angle = item["angle"] / 180 * math.pi
+    return [item["pos"][0] - t * item["speed"] * math.sin(angle), item["pos"][1] - t * item["speed"] * math.cos(angle)]
+
+
+def get_rotation(item, tick, tick_time):
+    if "anchor_tick" not in item or not item.get("rotation_speed"):
+        return item["rotation"]
+    return item["rotation"] + item["rotation_speed"] * (tick - item["anchor_tick"]) * tick_time
+
+
+# Remote items are drawn this much (seconds) behind the estimated server time, so there is a snapshot after it
+# to interpolate to; when the snapshots are late, tanks are extrapolated for max_extrapolation at most
+interpolation_delay = 0.1
+max_extrapolation = 0.25
+
+
+class SnapshotBuffer:
+    """
+    Ring buffer of the last snapshots of the tanks poses: [(tick, {uuid: (pos, rotation)})], oldest first
+    """
+
+    def __init__(self, size=32):
+        self.snapshots = collections.deque(maxlen=size)
+
+    def add(self, tick, tanks):
+        poses = {uuid: (tuple(tank["pos"]), tank["rotation"]) for uuid, tank in tanks.items()}
+        if self.snapshots and self.snapshots[-1][0] >= tick:
+            # Several messages at the same tick, the latest state wins
+            self.snapshots[-1] = (self.snapshots[-1][0], poses)
+        else:
+            self.snapshots.append((tick, poses))
+
+    def interpolate(self, uuid, item, tick, tick_time):
+        """
+        :param item: the latest state of the tank
+        :param tick: server tick to draw the tank at, may be fractional
+        :return: item with pos and rotation interpolated between the snapshots around the tick
+        """
+
+        before = after = before2 = None  # (tick, pose)
+        for snapshot_tick, poses in reversed(self.snapshots):
+            pose = poses.get(uuid)
+            if pose is None:
+                continue
+            if snapshot_tick > tick:
+                after = (snapshot_tick, pose)
+            elif before is None:
+                before = (snapshot_tick, pose)
+            else:
+                before2 = (snapshot_tick, pose)
+                break
+
+        if before is None:
+            if after is None:
+                return item
+            return item | {"pos": list(after[1][0]), "rotation": after[1][1]}
+
+        if after is not None:
+            k = (tick - before[0]) / (after[0] - before[0])
+            (x0, y0), r0 = before[1]
+            (x1, y1), r1 = after[1]
+        elif before2 is not None:
+            # No newer snapshot yet: going on with the last velocity, for a limited time
+            k = min(tick - before[0], max_extrapolation / tick_time) / (before[0] - before2[0]) + 1
+            (x0, y0), r0 = before2[1]
+            (x1, y1), r1 = before[1]
+        else:
+            return item | {"pos": list(before[1][0]), "rotation": before[1][1]}
+
+        rotation = r0 + ((r1 - r0 + 180) % 360 - 180) * min(k, 1)
+        return item | {"pos": [x0 + (x1 - x0) * k, y0 + (y1 - y0) * k], "rotation": rotation}
@@ -0,0 +1,57 @@
+import functools
+
+import numpy as np
+
+tank_colors = ([255, 232, 105, 255], [191, 174, 78, 255], [153, 153, 153, 255], [114, 114, 114, 255],
+               [255, 255, 255, 255], [85, 85, 85, 255], [255, 255, 255, 255], [85, 85, 85, 255],
+               [133, 227, 125, 255], [85, 85, 85, 255])
+bullet_colors = ([0, 178, 225, 255], [0, 133, 168, 255])
+food_colors = ([255, 232, 105, 255], [191, 174, 78, 255])
+bomb_colors = ([255, 40, 40, 255], [191, 174, 78, 255])
+
+# Static fields shared by all the entities of one kind. Entities keep only their own state and the "archetype" id
+# (index in ARCHETYPES), the clients get the whole table with the handshake
+FOOD, BOMB, BULLET, DEFAULT_TANK = range(4)
+ARCHETYPES = (
+    {"type": "food", "class": "square", "is_bomb": False, "colors": food_colors, "score": 10,
+     "animation_time": .15, "lifetime": 10},
+    {"type": "food", "class": "square", "is_bomb": True, "colors": bomb_colors, "score": 10,
+     "animation_time": .15, "lifetime": 10},
+    {"type": "projectile", "class": "bullet", "colors": bullet_colors, "disappearing_time": .1},
+    {"type": "tank", "tank_type": "default", "colors": tank_colors, "regen_speed": 1,
+     "basic_max_health": 40, "health_increase_health": 0.0015,
+     "basic_bullet_damage": 2, "bullet_damage_increase_k": 0.001,
+     "basic_bullet_speed": 180, "bullet_speed_increase_k": 0.002,
+     "basic_bullet_radius": 10, "bullet_radius_increase_k": 0,
+     "animation_time": .2, "heal_after_damage_time": 10},
+)
+
+
+class Entity(dict):
+    """
+    Entity fields: its own state is stored in the dict (and that's what is iterated over and sent), other fields are
+    looked up in its archetype. "in" checks only the own fields, use get() for the archetype ones
+    """
+
+    __slots__ = ()
+
+    def __missing__(self, key):
+        archetype = dict.get(self, "archetype")
+        if archetype is None:
+            raise KeyError(key)
+        return ARCHETYPES[archetype][key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+@functools.lru_cache(maxsize=None)
+def column(field):
+    """
+    :return: numpy array of the field of all the archetypes (0 where it's absent), to index with archetype ids
+    """
+
+    return np.array([a.get(field, 0) for a in ARCHETYPES])
@@ -0,0 +1,220 @@
+"""
+In-process benchmarks of the simulation: seeded worlds driven through Processing directly, the clients are stubs
+which drop everything sent to them.
+Timed: whole ticks and their collision phases, explode(), a food refill (what auto_spawn_food() starts) and
+the notify_all() paths (snapshot filtering/encoding for all the clients and the "items" filtering).
+
+Usage: python benchmark.py [--scenarios small,medium] [--output results.json] [--compare baseline.json]
+With --compare, the results slower than the baseline by more than --threshold are listed and the exit code is 1
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+import archetypes
+import processing
+import settings
+
+# name -> (tanks, food, projectiles, map_dim)
+scenarios = {"small": (10, 300, 100, 2000), "medium": (50, 1000, 500, 4000), "large": (200, 3000, 2000, 8000)}
+
+
+class StubWebSocket:
+    """
+    Client connection which drops the messages
+    """
+
+    def __init__(self):
+        self.sent_bytes = 0
+
+    async def send(self, data):
+        self.sent_bytes += len(data)
+
+    async def close(self):
+        pass
+
+
+def summarize(samples):
+    """
+    :param samples: durations in seconds
+    :return: {"mean_ms": ..., "p50_ms": ..., "p90_ms": ..., "min_ms": ..., "samples": n}
+    """
+
+    a = np.array(samples) * 1000
+    return {"mean_ms": float(a.mean()), "p50_ms": float(np.percentile(a, 50)), "p90_ms": float(np.percentile(a, 90)),
+            "min_ms": float(a.min()), "samples": len(a)}
+
+
+async def build_world(tanks, food, projectiles, map_dim, seed, array_store=False):
+    """
+    :return: Processing with the tanks (all of them with a stub client), food and projectiles spread uniformly
+    """
+
+    random.seed(seed)
+    p = processing.Processing(settings.simulation_rate, food, map_dim, array_store, settings.network_rate, seed)
+    for i in range(tanks):
+        await p.spawn_tank(StubWebSocket(), f"bot {i}", [random.uniform(0, map_dim), random.uniform(0, map_dim)])
+    for _ in range(food):
+        await p.spawn_food([random.uniform(0, map_dim), random.uniform(0, map_dim)], random.randint(5, 10),
+                           settings.food_radius, 4, archetypes.BOMB if random.random() < 0.1 else archetypes.FOOD)
+    tank_uuids = list(p.tanks)
+    for _ in range(projectiles):
+        tank = p.tanks[random.choice(tank_uuids)]
+        await p.spawn_projectile([random.uniform(0, map_dim), random.uniform(0, map_dim)], random.uniform(-180, 180),
+                                 tank["bullet_speed"], tank["bullet_radius"], tank["bullet_damage"], tank["uuid"])
+    # Handshake items messages
+    await asyncio.sleep(0)
+    return p
+
+
+async def close_world(p):
+    for conn in p.net.connections.values():
+        conn.close()
+    # Writers are cancelled
+    await asyncio.sleep(0)
+
+
+async def bench_ticks(world, ticks, seed, array_store):
+    p = await build_world(*world, seed, array_store)
+    samples = []
+    for _ in range(ticks):
+        t = time.perf_counter()
+        await p.process_tick()
+        samples.append(time.perf_counter() - t)
+        # Client writers take the delete messages
+        await asyncio.sleep(0)
+    ret = {"tick": summarize(samples)}
+    for phase in ("movement", "projectile_collision", "tank_collision"):
+        ret[phase] = summarize(p.profiler.samples[phase])
+    await close_world(p)
+    return ret
+
+
+async def bench_explode(world, repeat, seed, array_store):
+    samples = []
+    for i in range(repeat):
+        p = await build_world(*world, seed + i, array_store)
+        tank = random.choice(list(p.tanks.values()))
+        t = time.perf_counter()
+        await p.explode([*tank["pos"]], tank)
+        samples.append(time.perf_counter() - t)
+        await close_world(p)
+    return {"explode": summarize(samples)}
+
+
+async def bench_food_refill(world, repeat, seed, array_store):
+    """
+    Refill of the food (from none) to the amount of the world, with no time budget per step
+    """
+
+    tanks, food, _, map_dim = world
+    samples = []
+    for i in range(repeat):
+        p = await build_world(tanks, 0, 0, map_dim, seed + i, array_store)
+        t = time.perf_counter()
+        p.food_spawner.refill(food)
+        while p.food_spawner.is_active:
+            await p.food_spawner.step(float("inf"))
+        samples.append(time.perf_counter() - t)
+        await close_world(p)
+    return {"food_refill": summarize(samples)}
+
+
+async def bench_notify(world, repeat, seed, array_store):
+    p = await build_world(*world, seed, array_store)
+    snapshots, items = [], []
+    for _ in range(repeat):
+        await p.process_tick()
+        # Snapshots are built lazily by the client writers, here they are built right away
+        t = time.perf_counter()
+        await p.net.notify_all({"type": "all_items", "payload": p.pack()})
+        for conn in p.net.connections.values():
+            build, conn.snapshot = conn.snapshot, None
+            if build is not None:
+                build()
+        snapshots.append(time.perf_counter() - t)
+
+        tank = random.choice(list(p.tanks))
+        t = time.perf_counter()
+        await p.net.notify_about_tank("items", tank)
+        items.append(time.perf_counter() - t)
+        await asyncio.sleep(0)
+    await close_world(p)
+    return {"notify_snapshot": summarize(snapshots), "notify_items": summarize(items)}
+
+
+async def run_scenario(world, args):
+    ret = {}
+    ret |= await bench_ticks(world, args.ticks, args.seed, args.array_store)
+    ret |= await bench_explode(world, args.repeat, args.seed, args.array_store)
+    ret |= await bench_food_refill(world, args.repeat, args.seed, args.array_store)
+    ret |= await bench_notify(world, args.ticks // 5, args.seed, args.array_store)
+    return ret
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: [(scenario, benchmark, baseline p50, p50)] of the benchmarks slower than the baseline by the threshold
+    """
+
+    regressions = []
+    for scenario, benchmarks in results["results"].items():
+        for name, a in benchmarks.items():
+            b = baseline["results"].get(scenario, {}).get(name)
+            if b is not None and a["p50_ms"] > b["p50_ms"] * (1 + threshold):
+                regressions.append((scenario, name, b["p50_ms"], a["p50_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulation benchmarks")
+    parser.add_argument("--scenarios", default="small,medium", help=f"comma separated, of {', '.join(scenarios)}")
+    parser.add_argument("--world", help="custom scenario: tanks,food,projectiles,map_dim")
+    parser.add_argument("--ticks", type=int, default=300, help="ticks to time per scenario")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of explode and food refill per scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--array-store", action="store_true", help="array-backed entities (EntityStore)")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="baseline JSON file to compare the results with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="p50 slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    worlds = {a: scenarios[a] for a in args.scenarios.split(",") if a}
+    if args.world:
+        worlds["custom"] = tuple(int(a) for a in args.world.split(","))
+
+    results = {"meta": {"time": time.time(), "python": platform.python_version(), "numpy": np.__version__,
+                        "machine": platform.machine(), "args": vars(args)},
+               "results": {}}
+    for name, world in worlds.items():
+        results["results"][name] = asyncio.run(run_scenario(world, args))
+        results["meta"].setdefault("worlds", {})[name] = world
+        print(f"{name}: {world[0]} tanks, {world[1]} food, {world[2]} projectiles, map {world[3]}")
+        for benchmark, a in results["results"][name].items():
+            print(f"  {benchmark:<22} p50 {a['p50_ms']:9.3f} ms  p90 {a['p90_ms']:9.3f} ms  "
+                  f"mean {a['mean_ms']:9.3f} ms  ({a['samples']} samples)", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for scenario, name, before, after in regressions:
+            print(f"REGRESSION {scenario}/{name}: p50 {before:.3f} -> {after:.3f} ms ({after / before - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {args.compare} (threshold {args.threshold:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import asyncio
+import collections
+import time
+import traceback
+
+import settings
+
+
+class Connection:
+    """
+    Outbound side of one client connection. The tick only hands messages off here, the writer task sends them,
+    so a slow client never delays the tick or the other clients.
+    Reliable messages (items, delete, inventory, ...) are sent in order; of the world snapshots only the latest one
+    is kept: it's built lazily by the writer right before sending, so a delta is always relative to what
+    the client has actually received
+    """
+
+    def __init__(self, ws, name="", stats=None):
+        """
+        :param stats: netstats.NetStats to count the sent messages in, None -> not counted
+        """
+
+        self.enable_traceback = False
+        self.ws = ws
+        self.name = name
+        self.stats = stats
+
+        self.reliable = collections.deque()
+        self.snapshot = None  # function building the latest snapshot (bytes/str or None)
+        self.busy_since = None  # time since the writer has unsent messages
+        self.closed = False
+
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.get_event_loop().create_task(self.writer())
+
+    def send(self, data):
+        """
+        Queues reliable message
+        """
+
+        if self.closed:
+            return
+        self.reliable.append(data)
+        self.on_queued()
+
+    def send_snapshot(self, build):
+        """
+        Replaces not sent yet snapshot with the newer one
+        :param build: function returning encoded snapshot, called by the writer right before sending
+        """
+
+        if self.closed:
+            return
+        self.snapshot = build
+        self.on_queued()
+
+    def on_queued(self):
+        t = time.monotonic()
+        if self.busy_since is None:
+            self.busy_since = t
+        if len(self.reliable) > settings.max_queued_messages or t - self.busy_since > settings.max_client_lag:
+            print(f"[Connection] client {self.name} is too far behind, disconnecting "
+                  f"({len(self.reliable)} messages queued, {t - self.busy_since:.1f}s)")
+            self.close()
+            return
+        self.wakeup.set()
+
+    async def writer(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+
+                while self.reliable or self.snapshot is not None:
+                    if self.reliable:
+                        data = self.reliable.popleft()
+                    else:
+                        build, self.snapshot = self.snapshot, None
+                        data = build()
+                        if data is None:
+                            continue
+                    t = time.perf_counter()
+                    await self.ws.send(data)
+                    if self.stats is not None:
+                        self.stats.on_sent(self.name, data, time.perf_counter() - t)
+                self.busy_since = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Connection.writer] client {self.name} exception:", e)
+            if self.enable_traceback:
+                print(traceback.format_exc())
+            self.close()
+
+    def close(self):
+        """
+        Stops the writer and closes the websocket, serve_connection() then removes the tank
+        """
+
+        if self.closed:
+            return
+        self.closed = True
+        self.reliable.clear()
+        self.snapshot = None
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+        asyncio.get_event_loop().create_task(self.ws.close())
@@ -0,0 +1,47 @@
+"""
+Live tick profiler stats of a running server: python dashboard.py [ws://localhost:2022] [poll interval, s]
+Must be run on the server machine, see settings.admin_hosts
+"""
+
+import asyncio
+import json
+import sys
+
+import websockets
+
+
+def render(stats):
+    lines = [f"tick {stats['tick']}  clients {stats['clients']}  "
+             + "  ".join(f"{a} {b}" for a, b in stats["entities"].items()),
+             f"ticks {stats['ticks']}  overruns {stats['overruns']}  "
+             f"scheduler overruns {stats['scheduler_overruns']}  skipped ticks {stats['skipped_ticks']}",
+             "",
+             f"{'phase':<22}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'count':>9}"]
+    for phase, a in stats["phases"].items():
+        count = "" if a["count"] is None else a["count"]
+        lines.append(f"{phase:<22}{a['p50']:>9.3f}{a['p90']:>9.3f}{a['p99']:>9.3f}{a['max']:>9.3f}{count:>9}")
+    return "\n".join(lines)
+
+
+async def poll(uri, interval):
+    async with websockets.connect(uri) as ws:
+        await ws.send(json.dumps({"type": "stats"}))
+        while True:
+            stats = json.loads(await ws.recv())["payload"]
+            # Clearing the terminal
+            print("\033[2J\033[H" + render(stats), flush=True)
+            await asyncio.sleep(interval)
+            await ws.send(json.dumps({"type": "stats"}))
+
+
+def main():
+    uri = sys.argv[1] if len(sys.argv) > 1 else "ws://localhost:2022"
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    try:
+        asyncio.run(poll(uri, interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+from collections.abc import MutableMapping
+
+import numpy as np
+
+import archetypes
+
+# Fields kept in the contiguous arrays: {field: (dtype, width)}. Everything else stays in a small per-entity dict,
+# static fields are looked up in the archetype of the entity
+projectile_columns = {"archetype": (int, 1), "pos": (float, 2), "angle": (float, 1), "speed": (float, 1),
+                      "radius": (float, 1), "health": (float, 1), "lifetime": (float, 1), "last_time": (float, 1)}
+food_columns = {"archetype": (int, 1), "pos": (float, 2), "angle": (float, 1), "speed": (float, 1),
+                "rotation": (float, 1), "rotation_speed": (float, 1), "radius": (float, 1), "health": (float, 1),
+                "current_animation_time": (float, 1), "last_time": (float, 1),
+                "is_hit": (bool, 1), "is_disappearing": (bool, 1)}
+tank_columns = {"archetype": (int, 1), "pos": (float, 2), "rotation": (float, 1), "radius": (float, 1),
+                "score": (int, 1), "health": (float, 1), "max_health": (float, 1), "bullet_damage": (float, 1),
+                "bullet_speed": (float, 1), "bullet_radius": (float, 1), "current_animation_time": (float, 1),
+                "last_time": (float, 1), "last_damage_time": (float, 1), "is_hit": (bool, 1),
+                "is_disappearing": (bool, 1)}
+
+
+class EntityStore:
+    """
+    Structure-of-arrays storage for entities of one type. Every entity occupies one slot (row) of the arrays,
+    slots of removed entities are reused by the next spawned ones.
+    """
+
+    def __init__(self, columns, capacity=64):
+        self.columns = columns
+        self.capacity = 0
+        self.arrays = {}
+        self.active = np.zeros(0, dtype=bool)
+        self.ids = []
+        self.extra = []
+        self.free = []
+
+        self._grow(capacity)
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+    def _grow(self, capacity):
+        for name, (dtype, width) in self.columns.items():
+            array = np.zeros((capacity, width) if width > 1 else capacity, dtype=dtype)
+            if name in self.arrays:
+                array[:self.capacity] = self.arrays[name]
+            self.arrays[name] = array
+        active = np.zeros(capacity, dtype=bool)
+        active[:self.capacity] = self.active
+        self.active = active
+
+        self.ids += [None] * (capacity - self.capacity)
+        self.extra += [None] * (capacity - self.capacity)
+        # Lowest slots are handed out first
+        self.free += range(capacity - 1, self.capacity - 1, -1)
+        self.capacity = capacity
+
+    def add(self, id_, fields: dict):
+        """
+        :param id_: entity id (key in the Processing.* dicts)
+        :param fields: entity fields, same as for the dict-based entities
+        :return: EntityView of the new entity
+        """
+
+        if not self.free:
+            self._grow(self.capacity * 2)
+        slot = self.free.pop()
+
+        extra = {}
+        for name in self.columns:
+            self.arrays[name][slot] = 0
+        for name, value in fields.items():
+            if name in self.columns:
+                self.arrays[name][slot] = value
+            else:
+                extra[name] = value
+
+        self.active[slot] = True
+        self.ids[slot] = id_
+        self.extra[slot] = extra
+        return EntityView(self, slot)
+
+    def remove(self, view):
+        slot = view.slot
+        self.active[slot] = False
+        self.ids[slot] = None
+        self.extra[slot] = None
+        self.free.append(slot)
+
+    def active_slots(self):
+        return np.flatnonzero(self.active)
+
+
+class EntityView(MutableMapping):
+    """
+    Dict-like view of one slot of the EntityStore, so hit(), on_kill() etc. work with the array-backed entities
+    the same way as with the plain dicts. Vector fields (pos) are returned as writable numpy rows
+    """
+
+    __slots__ = ("store", "slot")
+
+    def __init__(self, store: EntityStore, slot: int):
+        self.store = store
+        self.slot = slot
+
+    def __getitem__(self, key):
+        array = self.store.arrays.get(key)
+        if array is None:
+            extra = self.store.extra[self.slot]
+            if key in extra:
+                return extra[key]
+            return archetypes.ARCHETYPES[self.store.arrays["archetype"][self.slot]][key]
+        if array.ndim > 1:
+            return array[self.slot]
+        return array[self.slot].item()
+
+    def __setitem__(self, key, value):
+        array = self.store.arrays.get(key)
+        if array is None:
+            self.store.extra[self.slot][key] = value
+        else:
+            array[self.slot] = value
+
+    def __delitem__(self, key):
+        if key in self.store.columns:
+            raise KeyError(f"array-backed field '{key}' can't be deleted")
+        del self.store.extra[self.slot][key]
+
+    def __iter__(self):
+        yield from self.store.columns
+        yield from self.store.extra[self.slot]
+
+    def __len__(self):
+        return len(self.store.columns) + len(self.store.extra[self.slot])
+
+    def __contains__(self, key):
+        return key in self.store.columns or key in self.store.extra[self.slot]
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def move(store: EntityStore, t):
+    """
+    Moves all the entities along their angle (and rotates them if they have rotation_speed)
+    :return: moved slots
+    """
+
+    slots = store.active_slots()
+    a = store.arrays
+    time_dif = t - a["last_time"][slots]
+    angle = a["angle"][slots] / 180 * np.pi
+    step = time_dif * a["speed"][slots]
+    a["pos"][slots, 0] -= step * np.sin(angle)
+    a["pos"][slots, 1] -= step * np.cos(angle)
+    if "rotation_speed" in a:
+        a["rotation"][slots] += a["rotation_speed"][slots] * time_dif
+    a["last_time"][slots] = t
+    return slots
+
+
+def scale_tank_stats(store: EntityStore):
+    """
+    Gradually increasing max health level, bullet damage, speed and radius with the score
+    """
+
+    slots = store.active_slots()
+    a = store.arrays
+    score = a["score"][slots]
+    archetype = a["archetype"][slots]
+    c = archetypes.column
+    a["max_health"][slots] = c("basic_max_health")[archetype] + c("health_increase_health")[archetype] * score
+    a["bullet_damage"][slots] = c("basic_bullet_damage")[archetype] + c("bullet_damage_increase_k")[archetype] * score
+    a["bullet_speed"][slots] = c("basic_bullet_speed")[archetype] + c("bullet_speed_increase_k")[archetype] * score
+    a["bullet_radius"][slots] = c("basic_bullet_radius")[archetype] + c("bullet_radius_increase_k")[archetype] * score
+
+
+def regen_tanks(store: EntityStore, slots, time_dif):
+    """
+    Heals the tanks in the slots which aren't at full health yet
+    :return: slots of the ones at full health now
+    """
+
+    a = store.arrays
+    health = a["health"]
+    healing = slots[(health[slots] < a["max_health"][slots]) & (health[slots] != 0)]
+    health[healing] += archetypes.column("regen_speed")[a["archetype"][healing]] * time_dif
+    return slots[health[slots] >= a["max_health"][slots]]
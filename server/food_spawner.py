@@ -0,0 +1,107 @@
+import math
+import time
+
+import numpy as np
+
+import archetypes
+import recording
+import settings
+
+
+class FoodSpawner:
+    """
+    Jittered grid food placement spread over the ticks.
+    The map is covered with a grid of min_dist / sqrt(2) cells, so one cell can hold at most one food. A refill marks
+    the cells already taken by food and draws all the remaining free cells in a random order with one random point
+    inside of each one. Every tick step() takes the next candidates until the refill is done or the tick's time budget
+    is spent; each candidate is checked against the food and tanks around it right before spawning. When the free
+    cells run out the map is as dense as it can be, and the refill stops.
+    """
+
+    def __init__(self, p):
+        self.processing = p
+
+        # Food must not intersect other food (+4 px gap) and must keep 60 px away from the tanks
+        self.food_gap = 4
+        self.tank_gap = 60
+        self.min_dist = settings.food_radius * 2 + self.food_gap
+        self.cell_size = self.min_dist / math.sqrt(2)
+        self.cells_per_side = math.ceil(max(p.world_size) / self.cell_size)
+
+        # Part of the map to spawn in: top left, bottom right corner
+        self.area = (np.zeros(2), p.world_size)
+        self.free = np.ones((self.cells_per_side, self.cells_per_side), dtype=bool)
+        self.candidates = np.empty((0, 2))  # [x, y] positions to try, in the random order
+        self.next_candidate = 0
+        self.to_spawn = 0
+        self.spawned = 0
+        # Replay: tick -> candidates the recorded step tried, taken instead of the time budget; None -> live
+        self.replay_steps = None
+
+    def refill(self, to_spawn):
+        """
+        Starts spawning to_spawn food over the next ticks
+        """
+
+        rng = np.random.default_rng(self.processing.random.getrandbits(64))
+        self.free[:] = True
+        if self.processing.food:
+            positions = np.array([f["pos"] for f in self.processing.food.values()], dtype=float)
+            cells = np.floor(positions / self.cell_size).astype(int)
+            inside = np.all((cells >= 0) & (cells < self.cells_per_side), axis=1)
+            self.free[cells[inside, 0], cells[inside, 1]] = False
+
+        cells = rng.permutation(np.argwhere(self.free))
+        self.candidates = (cells + rng.random(cells.shape)) * self.cell_size
+        self.candidates = self.candidates[np.all((self.candidates >= self.area[0]) &
+                                                 (self.candidates <= self.area[1]), axis=1)]
+        self.next_candidate = 0
+        self.to_spawn = to_spawn
+        self.spawned = 0
+
+    @property
+    def is_active(self):
+        return self.spawned < self.to_spawn
+
+    async def step(self, budget=None, candidates=None):
+        """
+        Spawns the food of the current refill until the time budget (seconds) is spent
+        :param candidates: amount of candidates to try instead of the time budget
+        :return: amount of food spawned
+        """
+
+        p = self.processing
+        if self.replay_steps is not None:
+            candidates = self.replay_steps.pop(p.tick, 0)
+        if not self.is_active:
+            return 0
+        budget = settings.food_spawn_budget if budget is None else budget
+        deadline = time.perf_counter() + budget
+        spawned = self.spawned
+        first_candidate = self.next_candidate
+        last_candidate = len(self.candidates) if candidates is None else min(len(self.candidates),
+                                                                             first_candidate + candidates)
+        food_radius = settings.food_radius
+
+        while self.spawned < self.to_spawn and self.next_candidate < last_candidate:
+            pos = self.candidates[self.next_candidate].tolist()
+            self.next_candidate += 1
+            if not await self.processing.are_food_around([*pos, food_radius], self.food_gap) \
+                    and not await self.processing.are_tanks_around([*pos, food_radius], self.tank_gap):
+                is_bomb = p.random.random() < 0.1
+                await self.processing.spawn_food(pos, p.random.randint(5, 10),
+                                                 food_radius if not is_bomb else food_radius + 4,
+                                                 4 if not is_bomb else 20,
+                                                 archetypes.FOOD if not is_bomb else archetypes.BOMB)
+                self.spawned += 1
+            if candidates is None and time.perf_counter() > deadline:
+                break
+
+        # How far the time budget got is what makes the step unrepeatable
+        if p.recorder is not None and self.next_candidate > first_candidate:
+            p.recorder.record(recording.FOOD_STEP, self.next_candidate - first_candidate)
+
+        if self.spawned < self.to_spawn and self.next_candidate >= len(self.candidates):
+            # No free space left
+            self.to_spawn = self.spawned
+        return self.spawned - spawned
@@ -0,0 +1,96 @@
+import json
+
+import protocol
+import settings
+import tools
+
+
+class FragmentCache:
+    """
+    Pre-encoded parts of the snapshots of one tick, shared by all the clients. Every item is frozen once, and encoded
+    once per protocol and per set of the fields sent; the snapshot of a client is a concatenation of these fragments.
+    Clients with the same view (the same items created, changed and removed) get the very same message object.
+    Everything is dropped when the tick changes, since the items may have changed
+    """
+
+    def __init__(self, unsent_fields):
+        self.unsent_fields = unsent_fields  # item type -> fields left out of the frozen items
+        self.tick = None
+        self.frozen = {}  # uuid -> frozen item
+        self.records = {}  # (protocol, uuid, fields or None for the whole item) -> encoded item
+        self.messages = {}  # (protocol, type, item uuids...) -> encoded message
+
+    def update(self, tick):
+        if tick != self.tick:
+            self.tick = tick
+            self.frozen.clear()
+            self.records.clear()
+            self.messages.clear()
+
+    def freeze(self, id_, item):
+        frozen = self.frozen.get(id_)
+        if frozen is None:
+            unsent_fields = self.unsent_fields[item["type"]]
+            frozen = self.frozen[id_] = {a: tools.freeze(b) for a, b in item.items() if a not in unsent_fields}
+        return frozen
+
+    def record(self, version, id_, item, fields=None):
+        """
+        :param fields: tuple of the fields to send, None -> the whole item but settings.server_only_fields
+        :return: encoded item, the binary record or the JSON "uuid": {...} pair
+        """
+
+        key = (version, id_, fields)
+        record = self.records.get(key)
+        if record is None:
+            if fields is not None:
+                item = {a: item[a] for a in fields}
+            if version == protocol.BINARY_V3:
+                record = protocol.encode_record(id_, item)
+            else:
+                if fields is None:
+                    # The binary records leave them out with the rest of the fields not in protocol.FIELDS
+                    item = {a: b for a, b in item.items() if a not in settings.server_only_fields}
+                record = f'"{id_}": {json.dumps(item, default=tools.json_default)}'
+            self.records[key] = record
+        return record
+
+    def all_items(self, version, items):
+        """
+        :param items: {uuid: item}
+        :return: encoded all_items message
+        """
+
+        key = (version, "all_items", tuple(items))
+        message = self.messages.get(key)
+        if message is None:
+            records = [self.record(version, a, b) for a, b in items.items()]
+            if version == protocol.BINARY_V3:
+                message = protocol.encode_snapshot("all_items", self.tick, records)
+            else:
+                message = f'{{"type": "all_items", "tick": {self.tick}, "payload": {{{", ".join(records)}}}}}'
+            self.messages[key] = message
+        return message
+
+    def delta(self, version, items, created, changed, removed):
+        """
+        :param items: {uuid: item}
+        :param created: uuids of the items sent whole
+        :param changed: [(uuid, changed fields tuple)]
+        :param removed: uuids of the removed items
+        :return: encoded delta message
+        """
+
+        key = (version, "delta", tuple(created), tuple(changed), tuple(removed))
+        message = self.messages.get(key)
+        if message is None:
+            created_records = [self.record(version, a, items[a]) for a in created]
+            changed_records = [self.record(version, a, items[a], fields) for a, fields in changed]
+            if version == protocol.BINARY_V3:
+                message = protocol.encode_snapshot("delta", self.tick, created_records, changed_records, removed)
+            else:
+                message = (f'{{"type": "delta", "tick": {self.tick}, "payload": {{'
+                           f'"created": {{{", ".join(created_records)}}}, '
+                           f'"changed": {{{", ".join(changed_records)}}}, "removed": {json.dumps(removed)}}}}}')
+            self.messages[key] = message
+        return message
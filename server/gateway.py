@@ -0,0 +1,401 @@
+"""
+Gateway processes (settings.gateway_processes): the websocket connections, input decoding and the per-client snapshot
+encoding run in the gateways, the main process only runs the simulation. All the gateways listen on the same port
+(SO_REUSEPORT, the kernel spreads the connections between them), so they scale with the cores independently of
+the simulation.
+
+Gateways talk to the simulation over a Unix domain socket (settings.gateway_socket in socket_dir()). Both ways the
+messages go in batches: a frame is the u32 length of the batch and the events of the batch, each one the u32 length +
+the event packed by pack(). Nothing there can run code the way pickle could: only None, bools, numbers, strings,
+bytes, tuples, lists, dicts, Entities and numpy arrays of plain numbers or of physics.DTYPES records go through.
+The simulation sends the world (physics.DTYPES records) at the network rate, the deletes, inventory updates,
+kicked clients and stats; a gateway mirrors the world like PhysicsProxy does and sends the spawns, inputs and
+disconnects of its clients.
+
+More gateways can be started by hand: python gateway.py [index]
+"""
+
+import asyncio
+import multiprocessing
+import os
+import stat
+import struct
+import sys
+import tempfile
+import traceback
+
+import numpy as np
+import websockets
+
+import archetypes
+import physics
+import settings
+
+_length = struct.Struct("<I")
+_i64 = struct.Struct("<q")
+_f64 = struct.Struct("<d")
+_record_types = {b: a for a, b in physics.DTYPES.items()}
+
+
+def socket_dir():
+    """
+    :return: directory of the Unix sockets between the processes: settings.socket_dir, $XDG_RUNTIME_DIR/tanks or
+        /tmp/tanks-<uid>. It's created with no access for the other users; an existing one has to be a directory of
+        this user the others can't get into, so nobody else can put their socket in place of ours
+    """
+
+    path = settings.socket_dir
+    if path is None:
+        runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+        path = os.path.join(runtime_dir, "tanks") if runtime_dir else \
+            os.path.join(tempfile.gettempdir(), f"tanks-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{path} has to be a directory of this user with no access for the others")
+    return path
+
+
+def socket_path(name):
+    return os.path.join(socket_dir(), name)
+
+
+def _pack_str(buf, value):
+    buf += _length.pack(len(value))
+    buf += value
+
+
+def pack(buf, value):
+    """
+    Appends the value to buf: a type tag and its data, the items of the containers follow recursively
+    """
+
+    if value is None:
+        buf += b"N"
+    elif value is True or value is False or isinstance(value, np.bool_):
+        buf += b"T" if value else b"F"
+    elif isinstance(value, (int, np.integer)):
+        value = int(value)
+        if -1 << 63 <= value < 1 << 63:
+            buf += b"i"
+            buf += _i64.pack(value)
+        else:
+            buf += b"I"
+            _pack_str(buf, str(value).encode())
+    elif isinstance(value, (float, np.floating)):
+        buf += b"f"
+        buf += _f64.pack(value)
+    elif isinstance(value, str):
+        buf += b"s"
+        _pack_str(buf, value.encode())
+    elif isinstance(value, (bytes, bytearray)):
+        buf += b"b"
+        _pack_str(buf, value)
+    elif isinstance(value, dict):
+        buf += b"E" if isinstance(value, archetypes.Entity) else b"d"
+        buf += _length.pack(len(value))
+        for key, item in value.items():
+            pack(buf, key)
+            pack(buf, item)
+    elif isinstance(value, (tuple, list)):
+        buf += b"t" if isinstance(value, tuple) else b"l"
+        buf += _length.pack(len(value))
+        for item in value:
+            pack(buf, item)
+    elif isinstance(value, np.ndarray) and value.dtype in _record_types:
+        buf += b"r"
+        _pack_str(buf, _record_types[value.dtype].encode())
+        buf += _length.pack(len(value))
+        buf += value.tobytes()
+    elif isinstance(value, np.ndarray) and value.dtype.kind in "biuf":
+        buf += b"a"
+        _pack_str(buf, value.dtype.str.encode())
+        buf.append(value.ndim)
+        buf += struct.pack(f"<{value.ndim}I", *value.shape)
+        buf += value.tobytes()
+    else:
+        raise TypeError(f"{type(value).__name__} can't be sent to the other processes")
+
+
+def _unpack_str(data, offset):
+    length = _length.unpack_from(data, offset)[0]
+    offset += _length.size
+    return data[offset:offset + length], offset + length
+
+
+def unpack(data, offset=0):
+    """
+    :return: value packed by pack() at the offset, offset after it
+    """
+
+    tag = chr(data[offset])
+    offset += 1
+    if tag == "N":
+        return None, offset
+    if tag == "T" or tag == "F":
+        return tag == "T", offset
+    if tag == "i":
+        return _i64.unpack_from(data, offset)[0], offset + _i64.size
+    if tag == "f":
+        return _f64.unpack_from(data, offset)[0], offset + _f64.size
+    if tag == "I" or tag == "s" or tag == "b":
+        value, offset = _unpack_str(data, offset)
+        value = bytes(value)
+        return int(value) if tag == "I" else value.decode() if tag == "s" else value, offset
+    if tag == "d" or tag == "E":
+        count = _length.unpack_from(data, offset)[0]
+        offset += _length.size
+        ret = archetypes.Entity() if tag == "E" else {}
+        for _ in range(count):
+            key, offset = unpack(data, offset)
+            ret[key], offset = unpack(data, offset)
+        return ret, offset
+    if tag == "t" or tag == "l":
+        count = _length.unpack_from(data, offset)[0]
+        offset += _length.size
+        ret = []
+        for _ in range(count):
+            item, offset = unpack(data, offset)
+            ret.append(item)
+        return tuple(ret) if tag == "t" else ret, offset
+    if tag == "r":
+        name, offset = _unpack_str(data, offset)
+        dtype = physics.DTYPES.get(bytes(name).decode(errors="replace"))
+        if dtype is None:
+            raise ValueError(f"unknown record type {bytes(name)!r}")
+        count = _length.unpack_from(data, offset)[0]
+        offset += _length.size
+        return np.frombuffer(data, dtype, count, offset).copy(), offset + count * dtype.itemsize
+    if tag == "a":
+        name, offset = _unpack_str(data, offset)
+        dtype = np.dtype(bytes(name).decode(errors="replace"))
+        if dtype.kind not in "biuf":
+            raise ValueError(f"unexpected array type {dtype}")
+        ndim = data[offset]
+        shape = struct.unpack_from(f"<{ndim}I", data, offset + 1)
+        offset += 1 + 4 * ndim
+        count = int(np.prod(shape))
+        return np.frombuffer(data, dtype, count, offset).reshape(shape).copy(), offset + count * dtype.itemsize
+    raise ValueError(f"unknown type tag {tag!r}")
+
+
+def encode_event(event):
+    data = bytearray()
+    pack(data, event)
+    return _length.pack(len(data)) + data
+
+
+def write_batch(writer, events):
+    """
+    :param events: encoded events
+    """
+
+    writer.write(_length.pack(sum(len(a) for a in events)))
+    writer.writelines(events)
+
+
+async def open_connection(path):
+    """
+    :return: StreamReader, StreamWriter of the Unix socket, once the process serving it is up
+    """
+
+    while True:
+        try:
+            return await asyncio.open_unix_connection(path)
+        except (FileNotFoundError, ConnectionError):
+            await asyncio.sleep(0.1)
+
+
+async def read_batch(reader):
+    """
+    :return: list of the events
+    """
+
+    size = _length.unpack(await reader.readexactly(_length.size))[0]
+    data = memoryview(await reader.readexactly(size))
+    events = []
+    offset = 0
+    while offset < size:
+        length = _length.unpack_from(data, offset)[0]
+        offset += _length.size
+        event, end = unpack(data, offset)
+        if end != offset + length:
+            raise ValueError("malformed event")
+        events.append(event)
+        offset = end
+    return events
+
+
+class SimulationHub(physics.PhysicsNetworking):
+    """
+    Networking of the simulation process when the clients are in the gateways: the world is sent to all of them at
+    the network rate, the messages for a client go to the gateway it's connected to
+    """
+
+    # Events for one client: kind -> position of its tank uuid in the event
+    routed = {"send": 1, "forget": 1, "spawned": 2}
+    # Events after which the tank isn't in this simulation any more
+    leaving = {"forget"}
+
+    def __init__(self, p, path):
+        """
+        :param p: Processing with the array store
+        :param path: Unix socket to listen on
+        """
+
+        super().__init__(p, None, None)
+        self.path = path
+        self.gateways = {}  # StreamWriter -> index of the gateway
+        self.owners = {}  # tank uuid -> StreamWriter of the gateway of its client
+
+    def publish(self):
+        p = self.processing
+        self.announce_tanks()
+        self.outbox.append(("world", p.tick, physics.world_records(p)))
+        self.flush()
+
+    def flush(self):
+        if not self.outbox:
+            return
+        batches = {a: [] for a in self.gateways}
+        for event in self.outbox:
+            if event[0] in self.routed:
+                uuid_ = event[self.routed[event[0]]]
+                owner = self.owners.pop(uuid_, None) if event[0] in self.leaving else self.owners.get(uuid_)
+                if owner in batches:
+                    batches[owner].append(encode_event(event))
+            else:
+                # Encoded once for all the gateways
+                encoded = encode_event(event)
+                for batch in batches.values():
+                    batch.append(encoded)
+        self.outbox = []
+        for writer, batch in batches.items():
+            if batch:
+                write_batch(writer, batch)
+
+    async def execute(self, command, gateway=None):
+        if command[0] == "gateway":
+            # First command of a gateway
+            self.gateways[gateway] = command[1]
+            print(f"[SimulationHub.execute] gateway {command[1]} connected, {len(self.gateways)} in total")
+        elif command[0] == "spawn":
+            self.owners[await self.spawn(command[1], command[2])] = gateway
+        else:
+            await super().execute(command)
+
+    async def serve_gateway(self, reader, writer):
+        try:
+            while True:
+                for command in await read_batch(reader):
+                    try:
+                        await self.execute(command, writer)
+                    except Exception as e:
+                        print("[SimulationHub.serve_gateway] exception:", e)
+                        if self.enable_traceback:
+                            print(traceback.format_exc())
+                self.flush()
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            print("[SimulationHub.serve_gateway] gateway disconnected:", repr(e))
+        finally:
+            self.gateways.pop(writer, None)
+            # Its clients are gone with it
+            for uuid_ in [a for a, b in self.owners.items() if b is writer]:
+                del self.owners[uuid_]
+                if uuid_ in self.processing.tanks:
+                    await self.processing.delete_tank(uuid_, False)
+            writer.close()
+
+    async def listen(self):
+        if os.path.exists(self.path):
+            # Left by the previous run
+            os.unlink(self.path)
+        return await asyncio.start_unix_server(self.serve_gateway, self.path)
+
+    async def serve(self):
+        async with await self.listen() as server:
+            await server.serve_forever()
+
+    async def run(self):
+        p = self.processing
+        await asyncio.gather(p.start(), p.auto_spawn_food(), self.serve(), self.send_stats())
+
+
+class Gateway(physics.WorldMirror):
+    """
+    WorldMirror of the simulation process, fed over the Unix socket; serves its share of the clients
+    """
+
+    def __init__(self, path, index, processing_rate, map_dim=2000, network_rate=None):
+        """
+        :param index: number of the gateway, unique among the gateways of the simulation
+        """
+
+        super().__init__(processing_rate, map_dim, network_rate)
+        self.path = path
+        self.index = index
+        self.reader = self.writer = None
+
+    def send_commands(self, commands):
+        write_batch(self.writer, [encode_event(a) for a in commands])
+
+    async def connect(self):
+        self.reader, self.writer = await open_connection(self.path)
+        self.send_commands([("gateway", self.index)])
+
+    async def serve_events(self):
+        try:
+            while True:
+                await self.dispatch_all(await read_batch(self.reader))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            print("[Gateway.serve_events] simulation disconnected:", repr(e))
+
+    async def run(self, host="", port=2022, metrics_port=None):
+        """
+        Serves the clients until the simulation goes away
+        :param metrics_port: port of the netstats page, None -> not served
+        """
+
+        await self.connect()
+        tasks = [asyncio.ensure_future(self.serve_events())]
+        if metrics_port is not None:
+            tasks.append(asyncio.ensure_future(self.net.io_stats.serve(settings.metrics_host, metrics_port)))
+        async with websockets.serve(self.net.serve_connection, host, port, reuse_port=True):
+            await tasks[0]
+        for task in tasks[1:]:
+            task.cancel()
+
+
+def run_gateway(index):
+    """
+    Gateway process number index, its metrics are on settings.metrics_port + 1 + index
+    """
+
+    gateway = Gateway(socket_path(settings.gateway_socket), index, settings.simulation_rate, settings.map_dim,
+                      settings.network_rate)
+    try:
+        asyncio.run(gateway.run(metrics_port=settings.metrics_port + 1 + index))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_gateways(count, target=run_gateway, first=0):
+    """
+    Forks the gateway processes, before the event loop runs
+    :param target: function running gateway number i, of the indexes first, first + 1, ...
+    """
+
+    ctx = multiprocessing.get_context("fork")
+    processes = [ctx.Process(target=target, args=(i,), daemon=True, name=f"gateway {i}")
+                 for i in range(first, first + count)]
+    for process in processes:
+        process.start()
+    return processes
+
+
+if __name__ == "__main__":
+    run_gateway(int(sys.argv[1]) if len(sys.argv) > 1 else 0)
@@ -0,0 +1,50 @@
+import collections
+
+index_bits = 20
+index_mask = (1 << index_bits) - 1
+max_generation = (1 << (32 - index_bits)) - 1
+
+
+class HandleAllocator:
+    """
+    Entity handles: small integers used as the dict keys, the wire ids and the "parent" references.
+    A handle is the slot index in the low index_bits bits and the generation of the slot in the high ones (u32 total).
+    Freed slots are reused oldest first and with the next generation, so a stale handle never matches the new entity.
+    Handle 0 is never given out, it means "no item"
+    """
+
+    def __init__(self, first=0, count=index_mask + 1):
+        """
+        :param first: first slot index to give out, processes sharing the handle space get a range each
+        :param count: amount of the slot indexes
+        """
+
+        self.first = first
+        self.count = count
+        self.generations = []  # slot - first -> current generation, starting at 1
+        self.free = collections.deque()
+
+    def __len__(self):
+        return len(self.generations) - len(self.free)
+
+    def allocate(self) -> int:
+        if self.free:
+            index = self.free.popleft()
+        else:
+            index = len(self.generations)
+            if index >= self.count or self.first + index > index_mask:
+                raise OverflowError("out of entity handles")
+            self.generations.append(1)
+        return self.generations[index] << index_bits | self.first + index
+
+    def release(self, handle):
+        index = (handle & index_mask) - self.first
+        if not self.is_alive(handle):
+            raise KeyError(handle)
+        generation = self.generations[index] + 1
+        self.generations[index] = generation if generation <= max_generation else 1
+        self.free.append(index)
+
+    def is_alive(self, handle) -> bool:
+        index = (handle & index_mask) - self.first
+        return 0 <= index < len(self.generations) and self.generations[index] == handle >> index_bits
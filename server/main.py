@@ -1,21 +1,61 @@
 import asyncio
+import os
+import time
 import traceback
 import websockets
 import sys
 
+import gateway
+import physics
 import processing
+import recording
 import settings
+import shards
 
 if sys.version_info[1] < 9:
     print("Python 3.9+ required!")
     exit(1)
 
-processing = processing.Processing(60, settings.food_amount, settings.map_dim)
-start_server = websockets.serve(processing.net.serve_connection, "", 2022)
+if settings.shards:
+    # This process is the first gateway
+    shards.start_shards(settings.shards)
+    gateway.start_gateways(settings.gateway_processes, shards.run_gateway, 1)
+    processing = shards.ShardedGateway(shards.shard_paths(settings.shards), 0, settings.simulation_rate,
+                                       settings.map_dim, settings.network_rate)
+elif settings.gateway_processes:
+    processing = processing.Processing(settings.simulation_rate, settings.food_amount, settings.map_dim, True,
+                                       settings.network_rate, settings.random_seed)
+    processing.net = gateway.SimulationHub(processing, gateway.socket_path(settings.gateway_socket))
+elif settings.physics_worker:
+    processing = physics.PhysicsProxy(settings.simulation_rate, settings.food_amount, settings.map_dim,
+                                      settings.network_rate, settings.random_seed, settings.physics_buffer_capacity)
+else:
+    processing = processing.Processing(settings.simulation_rate, settings.food_amount, settings.map_dim,
+                                       settings.array_entity_store, settings.network_rate, settings.random_seed)
+if settings.record_dir is not None and (settings.physics_worker or settings.gateway_processes or settings.shards):
+    print("[__main__] inputs can't be recorded with settings.physics_worker, gateway_processes or shards")
+elif settings.record_dir is not None:
+    os.makedirs(settings.record_dir, exist_ok=True)
+    record_path = os.path.join(settings.record_dir, time.strftime("%Y%m%d-%H%M%S") + ".rec")
+    processing.recorder = recording.Recorder(record_path, processing, settings.record_checksum_interval)
+    print("[__main__] recording the inputs to", record_path)
+if settings.gateway_processes and not settings.shards:
+    gateway.start_gateways(settings.gateway_processes)
+elif not settings.shards:
+    start_server = websockets.serve(processing.net.serve_connection, "", 2022)
 
 
 async def multiple_tasks():
-    input_coroutines = [start_server, processing.start(), processing.auto_spawn_food()]
+    if settings.shards:
+        return await processing.run(metrics_port=settings.metrics_port)
+    if settings.gateway_processes:
+        # The gateways serve the clients and their metrics
+        return await processing.net.run()
+    input_coroutines = [start_server, processing.start(),
+                        processing.net.io_stats.serve(settings.metrics_host, settings.metrics_port)]
+    if not settings.physics_worker:
+        # The worker spawns the food otherwise
+        input_coroutines.append(processing.auto_spawn_food())
     res = await asyncio.gather(*input_coroutines, return_exceptions=False)
     return res
 
@@ -0,0 +1,137 @@
+import asyncio
+import bisect
+import time
+import traceback
+
+import protocol
+
+# Upper bounds (seconds) of the send latency histogram buckets, +Inf is implied
+latency_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+def message_type(data):
+    """
+    :param data: encoded message: binary (type index in the first byte) or JSON made of {"type": ..., ...}
+    :return: message type
+    """
+
+    if isinstance(data, (bytes, bytearray)):
+        return protocol.MESSAGE_TYPES[data[0]] if data and data[0] < len(protocol.MESSAGE_TYPES) else "unknown"
+    if data.startswith('{"type": "'):
+        return data[10:data.find('"', 10)]
+    return "unknown"
+
+
+class NetStats:
+    """
+    Network I/O counters: messages and bytes per message type in each direction, in total and per connected client,
+    and the histograms of the ws.send() durations per message type. Sizes of the text messages are in characters,
+    the JSON is ASCII. Served as a Prometheus text page by serve()
+    """
+
+    def __init__(self):
+        self.enable_traceback = False
+        self.sent = {}  # type -> [messages, bytes]
+        self.received = {}
+        self.client_sent = {}  # client -> {type: [messages, bytes]}, only for the connected clients
+        self.client_received = {}
+        self.latency = {}  # type -> [count per bucket (the last one is +Inf), sum of the durations]
+        self.start_time = time.time()
+
+    @staticmethod
+    def count(counters, type_, size):
+        counter = counters.get(type_)
+        if counter is None:
+            counter = counters[type_] = [0, 0]
+        counter[0] += 1
+        counter[1] += size
+
+    def on_sent(self, client, data, duration):
+        """
+        :param duration: seconds ws.send() took
+        """
+
+        type_ = message_type(data)
+        self.count(self.sent, type_, len(data))
+        self.count(self.client_sent.setdefault(client, {}), type_, len(data))
+
+        histogram = self.latency.get(type_)
+        if histogram is None:
+            histogram = self.latency[type_] = [[0] * (len(latency_buckets) + 1), 0.]
+        histogram[0][bisect.bisect_left(latency_buckets, duration)] += 1
+        histogram[1] += duration
+
+    def on_received(self, client, type_, size):
+        """
+        :param client: None -> counted only in total (handshakes)
+        """
+
+        self.count(self.received, type_, size)
+        if client is not None:
+            self.count(self.client_received.setdefault(client, {}), type_, size)
+
+    def forget_client(self, client):
+        self.client_sent.pop(client, None)
+        self.client_received.pop(client, None)
+
+    def format(self):
+        """
+        :return: Prometheus text exposition of the counters
+        """
+
+        lines = []
+
+        def counters(name, help_, values, index):
+            lines.append(f"# HELP {name} {help_}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, counter in values:
+                lines.append(f"{name}{{{labels}}} {counter[index]}")
+
+        for direction, total, per_client in (("sent", self.sent, self.client_sent),
+                                             ("received", self.received, self.client_received)):
+            totals = [(f'type="{a}"', b) for a, b in total.items()]
+            clients = [(f'client="{a}",type="{c}"', d) for a, b in per_client.items() for c, d in b.items()]
+            counters(f"net_{direction}_messages_total", f"Messages {direction}", totals, 0)
+            counters(f"net_{direction}_bytes_total", f"Bytes {direction}", totals, 1)
+            counters(f"net_client_{direction}_messages_total", f"Messages {direction}, per connected client",
+                     clients, 0)
+            counters(f"net_client_{direction}_bytes_total", f"Bytes {direction}, per connected client", clients, 1)
+
+        lines.append("# HELP net_send_seconds Duration of ws.send()")
+        lines.append("# TYPE net_send_seconds histogram")
+        for type_, (buckets, total) in self.latency.items():
+            cumulative = 0
+            for le, count in zip((*latency_buckets, "+Inf"), buckets):
+                cumulative += count
+                lines.append(f'net_send_seconds_bucket{{type="{type_}",le="{le}"}} {cumulative}')
+            lines.append(f'net_send_seconds_sum{{type="{type_}"}} {total}')
+            lines.append(f'net_send_seconds_count{{type="{type_}"}} {cumulative}')
+
+        lines.append("# HELP net_start_time_seconds Start time of the counters")
+        lines.append("# TYPE net_start_time_seconds gauge")
+        lines.append(f"net_start_time_seconds {self.start_time}")
+        return "\n".join(lines) + "\n"
+
+    async def handle_request(self, reader, writer):
+        try:
+            # Any path gets the metrics
+            await reader.readuntil(b"\r\n\r\n")
+            body = self.format().encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+            await writer.drain()
+        except Exception as e:
+            print("[NetStats.handle_request] exception:", e)
+            if self.enable_traceback:
+                print(traceback.format_exc())
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """
+        Serves the metrics page over HTTP
+        """
+
+        server = await asyncio.start_server(self.handle_request, host, port)
+        async with server:
+            await server.serve_forever()
@@ -1,9 +1,16 @@
+import functools
 import json
-import math
+import time
 import traceback
 
 import numpy as np
 
+import archetypes
+import connection
+import fragments
+import netstats
+import protocol
+import recording
 import tools
 import settings
 
@@ -12,81 +19,293 @@ class Networking:
     def __init__(self, p):
         self.enable_traceback = False
         self.processing = p
-        self.ws_conns = {}
+        self.connections = {}  # uuid -> connection.Connection
+        self.visible = {}  # uuid -> {uuid of the visible item: None}, in the drawing order
 
-    async def serve_connection(self, websocket, path):
-        j = json.loads(await websocket.recv())
+        # Delta snapshots: uuid -> {item uuid: frozen item fields} last sent to the client
+        self.sent_states = {}
+        self.last_keyframes = {}  # uuid -> snapshots_count of the last keyframe sent to the client
+        self.snapshots_count = 0
 
-        uuid_ = await self.processing.spawn_tank(websocket, j["name"], 40)
-        await websocket.send(json.dumps({"type": "uuid_change", "payload": {"uuid": uuid_}}))
-        await websocket.send(json.dumps({"type": "items", "payload": self.processing.pack()}))
-        tank = self.processing.tanks[uuid_]
+        self.protocols = {}  # uuid -> protocol version negotiated with the client
+        self.io_stats = netstats.NetStats()
+
+        # Item type -> fields left out of the delta snapshots
+        self.unsent_fields = {a: set(settings.server_only_fields) for a in protocol.ITEM_TYPES}
+        if settings.client_simulation:
+            for type_, fields in settings.simulated_fields.items():
+                self.unsent_fields[type_].update(fields)
+        self.fragments = fragments.FragmentCache(self.unsent_fields)
 
-        print("[serve_connection] new connection:", uuid_)
+    async def serve_connection(self, websocket, path):
+        message = await websocket.recv()
+        j = json.loads(message)
+        if j.get("type") == "stats":
+            await self.serve_stats(websocket)
+            return
+        self.io_stats.on_received(None, "handshake", len(message))
+
+        uuid_ = await self.add_client(websocket, j)
+        recorder = self.processing.recorder
+        if recorder is not None:
+            recorder.record(recording.CONNECT, uuid_, message)
         try:
             while True:
-                j = json.loads(await websocket.recv())
-                if np.linalg.norm(np.array(j["pos"]) - np.array(tank["pos"])) > 200:
-                    print(np.linalg.norm(np.array(j["pos"]) - np.array(tank["pos"])))
-                    await websocket.send(json.dumps({"type": "force_position", "payload": tank["pos"]}))
-                    j["pos"] = tank["pos"]
-
-                if not tools.collide(j["pos"], (0, 0), self.processing.world_size):
-                    await websocket.send(json.dumps({"type": "force_position", "payload": j["pos"]}))
-                    j["pos"] = np.clip(j["pos"], 0, settings.map_dim).tolist()
-
-                if j["shoot"]:
-                    bullet_pos = [*j["pos"]]
-                    bullet_pos[0] += math.sin(j["rotation"] * math.pi / 180) * -self.processing.tanks[uuid_]["radius"]
-                    bullet_pos[1] += math.cos(j["rotation"] * math.pi / 180) * -self.processing.tanks[uuid_]["radius"]
-
-                    await self.processing.spawn_projectile(
-                        bullet_pos, j["rotation"], tank["bullet_speed"], tank["bullet_radius"], tank["bullet_damage"],
-                        "projectile", "bullet", uuid_)
-
-                if j["explode"]:
-                    if self.processing.tanks[uuid_]["inventory"]["bombs"] > 0:
-                        self.processing.tanks[uuid_]["inventory"]["bombs"] -= 1
-                        await websocket.send(
-                            json.dumps({"type": "inventory", "payload": self.processing.tanks[uuid_]["inventory"]}))
-                        await self.processing.explode(self.processing.tanks[uuid_]["pos"], self.processing.tanks[uuid_])
-
-                await self.processing.update_tank(uuid_, j["pos"], j["rotation"], j["current_shooting_time"])
+                message = await websocket.recv()
+                self.io_stats.on_received(uuid_, "input", len(message))
+                if recorder is not None:
+                    recorder.record_input(uuid_, message)
+                self.handle_input(uuid_, message)
         except Exception as e:
             print("[serve_connection] client exception in main thread:", e)
             if self.enable_traceback:
                 print(traceback.format_exc())
         finally:
+            if recorder is not None:
+                recorder.record(recording.DISCONNECT, uuid_)
             try:
                 await self.processing.delete_tank(uuid_, False)
             except Exception:
                 pass
 
+    async def add_client(self, websocket, handshake):
+        """
+        Spawns the tank of the new client and sends it the handshake reply and the items around
+        :param handshake: {"name": ..., "protocols": [...]}
+        :return: tank uuid
+        """
+
+        version = protocol.negotiate(handshake.get("protocols", ()))
+        uuid_ = await self.processing.spawn_tank(websocket, handshake["name"])
+        self.protocols[uuid_] = version
+        tank = self.processing.tanks[uuid_]
+        # Handshake reply is always JSON
+        self.connections[uuid_].send(json.dumps({"type": "uuid_change", "payload": {
+            "uuid": uuid_, "public_id": tank["public_id"], "protocol": version,
+            "tick": self.processing.tick, "tick_time": self.processing.processing_time,
+            "archetypes": archetypes.ARCHETYPES}}))
+        self.send(uuid_, {"type": "items", "payload": self.get_visible_items(uuid_, self.processing.pack())})
+
+        print("[serve_connection] new connection:", tank["public_id"], "handle:", uuid_, "protocol:", version)
+        return uuid_
+
+    def handle_input(self, uuid_, message):
+        """
+        Checks the input message of the client and queues it for the next tick
+        :param message: encoded input message, JSON or binary
+        """
+
+        j = protocol.decode(message)["payload"] if type(message) == bytes else json.loads(message)
+        tank = self.processing.tanks.get(uuid_)
+        if tank is None:
+            # Killed, the connection is being closed
+            return
+        if np.linalg.norm(np.array(j["pos"]) - np.array(tank["pos"])) > 200:
+            print(np.linalg.norm(np.array(j["pos"]) - np.array(tank["pos"])))
+            self.send(uuid_, {"type": "force_position", "payload": tank["pos"]})
+            j["pos"] = tank["pos"]
+
+        if not tools.collide(j["pos"], (0, 0), self.processing.world_size):
+            self.send(uuid_, {"type": "force_position", "payload": j["pos"]})
+            j["pos"] = np.clip(j["pos"], 0, settings.map_dim).tolist()
+
+        # Applied at the start of the next tick
+        self.processing.queue_input(uuid_, j)
+
+    async def serve_stats(self, websocket):
+        """
+        Admin connection: every message received is answered with {"type": "stats", "payload": Processing.get_stats()}
+        """
+
+        if websocket.remote_address[0] not in settings.admin_hosts:
+            print("[serve_stats] stats request from not allowed host:", websocket.remote_address[0])
+            return
+        try:
+            while True:
+                await websocket.send(json.dumps({"type": "stats", "payload": self.processing.get_stats()}))
+                await websocket.recv()
+        except Exception as e:
+            print("[serve_stats] admin connection closed:", e)
+            if self.enable_traceback:
+                print(traceback.format_exc())
+
+    def add_connection(self, uuid_, ws):
+        self.connections[uuid_] = connection.Connection(ws, uuid_, self.io_stats)
+
+    def send(self, uuid_, message):
+        """
+        Queues the message for the client, never waits for the network
+        """
+
+        self.connections[uuid_].send(self.encode(uuid_, message))
+
+    def encode(self, uuid_, message):
+        """
+        :return: message encoded with the protocol negotiated with the client
+        """
+
+        if self.protocols.get(uuid_, protocol.JSON) == protocol.BINARY_V3:
+            return protocol.encode(message)
+        if message["type"] == "items" or message["type"] == "all_items":
+            # The binary records leave them out with the rest of the fields not in protocol.FIELDS
+            message = {**message, "payload": {a: {c: d for c, d in b.items() if c not in settings.server_only_fields}
+                                              for a, b in message["payload"].items()}}
+        return json.dumps(message, default=tools.json_default)
+
     async def notify_all(self, notification, *exclude_ids):
-        notification_str = None
-        if type(notification) == dict:
-            if notification["type"] != "items" and notification["type"] != "all_items":
-                notification_str = json.dumps(notification)
+        shared = notification["type"] != "items" and notification["type"] != "all_items"
+        encoded = {}  # protocol version (and visible items) -> shared message
+        if notification["type"] == "all_items":
+            self.snapshots_count += 1
 
-        for uuid_, ws in self.ws_conns.items():
+        # Messages are only queued here, Connection writers send them
+        for uuid_, conn in self.connections.items():
             if uuid_ not in exclude_ids:
                 try:
-                    if notification_str is None:
-                        notification_ = notification.copy()
-                        items = {}
-                        for a, b in notification_["payload"].items():
-                            item_pos_to_tank = np.array(b["pos"]) - np.array(self.processing.tanks[uuid_]["pos"])
-                            if tools.collide(item_pos_to_tank, -settings.display_window_size_half,
-                                             settings.display_window_size_half):
-                                items[a] = b
-                        notification_["payload"] = items
-                        await ws.send(json.dumps(notification_))
+                    if not shared:
+                        if notification["type"] == "all_items":
+                            conn.send_snapshot(functools.partial(self.build_snapshot, uuid_, notification["payload"]))
+                            continue
+                        items = self.filter_visible_items(uuid_, notification["payload"])
+                        if not items:
+                            continue
+                        self.update_sent_state(uuid_, items)
+                        key = (self.protocols.get(uuid_, protocol.JSON), *items)
+                        if key not in encoded:
+                            encoded[key] = self.encode(uuid_, {"type": notification["type"], "payload": items})
+                        conn.send(encoded[key])
                     else:
-                        await ws.send(notification_str)
+                        if notification["type"] == "delete":
+                            self.forget_items(uuid_, notification["payload"])
+                        version = self.protocols.get(uuid_, protocol.JSON)
+                        if version not in encoded:
+                            encoded[version] = self.encode(uuid_, notification)
+                        conn.send(encoded[version])
                 except Exception as e:
                     print("[notify_all] client exception:", uuid_, ": ", e)
                     if self.enable_traceback:
                         print(traceback.format_exc())
+                    # The client state is unknown now, next snapshot will be a keyframe
+                    self.sent_states.pop(uuid_, None)
+
+    def build_snapshot(self, uuid_, items):
+        """
+        Called by the Connection writer right before sending
+        :return: encoded snapshot or None if the tank is already gone
+        """
+
+        if uuid_ not in self.processing.tanks:
+            return None
+        t = time.perf_counter()
+        snapshot = self.get_snapshot(uuid_, items)
+        self.processing.profiler.add("snapshot_build", time.perf_counter() - t, len(self.visible.get(uuid_, ())))
+        return snapshot
+
+    def get_snapshot(self, uuid_, items):
+        """
+        World snapshot for the client: items created, changed (only the changed fields) and removed since the last
+        snapshot sent to this client; or full all_items keyframe every settings.keyframe_interval snapshots.
+        With settings.client_simulation the positions of projectiles and food are sent only in the keyframes and
+        for the created items, the clients move them on their own.
+        The message is assembled from the items encoded once per tick for all the clients, see FragmentCache
+        :param items: {uuid: item}, the whole world
+        :return: encoded message
+        """
+
+        cache = self.fragments
+        cache.update(self.processing.tick)
+        version = self.protocols.get(uuid_, protocol.JSON)
+        visible_items = self.get_visible_items(uuid_, items)
+        state = self.sent_states.get(uuid_)
+        new_state = {id_: cache.freeze(id_, item) for id_, item in visible_items.items()}
+        self.sent_states[uuid_] = new_state
+
+        if state is None or self.snapshots_count - self.last_keyframes.get(uuid_, 0) >= settings.keyframe_interval:
+            self.last_keyframes[uuid_] = self.snapshots_count
+            return cache.all_items(version, visible_items)
+
+        created, changed = [], []
+        for id_, frozen in new_state.items():
+            old = state.get(id_)
+            if old is None:
+                created.append(id_)
+                continue
+            fields = tuple(a for a, b in frozen.items() if a not in old or old[a] != b)
+            if fields:
+                changed.append((id_, fields))
+        removed = [id_ for id_ in state if id_ not in new_state]
+
+        return cache.delta(version, visible_items, created, changed, removed)
+
+    def update_sent_state(self, uuid_, items):
+        state = self.sent_states.get(uuid_)
+        if state is not None:
+            for id_, item in items.items():
+                # Items sent between the ticks have to be frozen again, they may have changed since the broadcast
+                unsent_fields = self.unsent_fields[item["type"]]
+                state[id_] = {a: tools.freeze(b) for a, b in item.items() if a not in unsent_fields}
+
+    def forget_items(self, uuid_, items):
+        state = self.sent_states.get(uuid_)
+        visible = self.visible.get(uuid_)
+        for id_ in items:
+            if state is not None:
+                state.pop(id_, None)
+            if visible is not None:
+                visible.pop(id_, None)
+
+    def forget_client(self, uuid_):
+        conn = self.connections.pop(uuid_, None)
+        if conn is not None:
+            conn.close()
+        self.protocols.pop(uuid_, None)
+        self.visible.pop(uuid_, None)
+        self.sent_states.pop(uuid_, None)
+        self.last_keyframes.pop(uuid_, None)
+        self.io_stats.forget_client(uuid_)
+
+    def get_visible_items(self, uuid_, items):
+        """
+        Area of interest of the tank: items inside of its display window, plus the items which were visible before
+        and haven't left the window for more than settings.display_window_margin yet
+        :param uuid_: tank uuid
+        :param items: {uuid: item} to pick from, usually the whole world
+        :return: {uuid: item} visible for the tank
+        """
+
+        pos = self.processing.tanks[uuid_]["pos"]
+        half = settings.display_window_size_half
+        outer_half = half + settings.display_window_margin
+        top_left, bottom_right = (pos[0] - half[0], pos[1] - half[1]), (pos[0] + half[0], pos[1] + half[1])
+        outer_top_left = (pos[0] - outer_half[0], pos[1] - outer_half[1])
+        outer_bottom_right = (pos[0] + outer_half[0], pos[1] + outer_half[1])
+
+        previous = self.visible.get(uuid_, {})
+        visible = {}
+        for index in (self.processing.projectiles_index, self.processing.tanks_index, self.processing.food_index):
+            inside = set(index.query_rect(top_left, bottom_right))
+            for id_ in index.query_rect(outer_top_left, outer_bottom_right):
+                if id_ in inside or id_ in previous:
+                    visible[id_] = None
+        self.visible[uuid_] = visible
+
+        return {id_: items[id_] for id_ in visible if id_ in items}
+
+    def filter_visible_items(self, uuid_, items):
+        """
+        Area of interest check for the few items sent between the ticks (new projectiles, tanks, ...)
+        :return: {uuid: item} visible for the tank
+        """
+
+        pos = self.processing.tanks[uuid_]["pos"]
+        half = settings.display_window_size_half
+        visible = self.visible.setdefault(uuid_, {})
+        ret = {}
+        for id_, item in items.items():
+            if id_ in visible or abs(item["pos"][0] - pos[0]) < half[0] and abs(item["pos"][1] - pos[1]) < half[1]:
+                visible[id_] = None
+                ret[id_] = item
+        return ret
 
     async def notify_about_tank(self, type_, uuid_, notify_this=True):
         # must use None instead of False
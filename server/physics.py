@@ -0,0 +1,550 @@
+"""
+Simulation in a worker process (settings.physics_worker). The worker runs the usual Processing, movement, collisions,
+hits, timers and the food spawner, with PhysicsNetworking in place of Networking; the main process only serves
+the clients: PhysicsProxy stands in for Processing there, so Networking works unchanged.
+
+The world goes from the worker to the main process through WorldBuffer, a triple buffer in shared memory: after
+every tick the worker copies the array store into a copy the main process isn't reading and makes it the front
+one, the main process copies the latest one out at the network rate. The simulation itself runs on the worker's
+own arrays, the shared memory only holds these per-tick copies.
+Everything else is messages over a pipe: inputs, spawns and disconnects to the worker, deletes, inventory updates,
+kicked clients and the profiler stats back.
+"""
+
+import abc
+import asyncio
+import atexit
+import copy
+import itertools
+import multiprocessing
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import archetypes
+import entity_store
+import networking
+import processing
+import profiler
+import settings
+import spatial
+
+# Shared buffer fields of every entity type: the EntityStore columns plus the fields the entities keep outside of them
+LAYOUTS = {
+    "tank": entity_store.tank_columns | {"uuid": (int, 1), "current_shooting_time": (float, 1), "bombs": (int, 1)},
+    "food": entity_store.food_columns | {"uuid": (int, 1)},
+    "projectile": entity_store.projectile_columns | {"uuid": (int, 1), "parent": (int, 1),
+                                                     "is_disappearing": (bool, 1)},
+}
+DTYPES = {type_: np.dtype([(a, b) if c == 1 else (a, b, (c,)) for a, (b, c) in layout.items()])
+          for type_, layout in LAYOUTS.items()}
+
+FRONT, READER, TICK = range(3)  # header slots
+COPIES = 3
+
+
+class WorldBuffer:
+    """
+    Three copies of the world in shared memory: a header (front copy, copy being read or -1, tick of the front copy),
+    the entity counts, and an array of DTYPES records of every entity type per copy.
+    One writer (the worker) and one reader (the main process): the writer never touches the front copy or the one
+    being read, so with three copies there is always one left for it and it never waits for the reader.
+    Every write() is a copy of the whole world, the simulation doesn't run on the shared arrays
+    """
+
+    def __init__(self, capacity, lock, name=None):
+        """
+        :param capacity: entities of every type the buffer has room for
+        :param name: name of the shared memory to attach to, None -> new one
+        """
+
+        self.capacity = capacity
+        self.lock = lock
+        header_size = 8 * (3 + COPIES * len(DTYPES))
+        size = header_size + COPIES * capacity * sum(a.itemsize for a in DTYPES.values())
+        self.shm = shared_memory.SharedMemory(name, create=name is None, size=size)
+        self.header = np.ndarray(3, np.int64, self.shm.buf)
+        self.counts = np.ndarray((COPIES, len(DTYPES)), np.int64, self.shm.buf, 24)
+        self.arrays = []  # copy -> {type: records}
+        offset = header_size
+        for _ in range(COPIES):
+            arrays = {}
+            for type_, dtype in DTYPES.items():
+                arrays[type_] = np.ndarray(capacity, dtype, self.shm.buf, offset)
+                offset += capacity * dtype.itemsize
+            self.arrays.append(arrays)
+        if name is None:
+            self.header[:] = (0, -1, -1)
+            self.counts[:] = 0
+        self.overflow_reported = False
+
+    def write(self, tick, stores):
+        """
+        Publishes the world as of the tick
+        :param stores: {type: EntityStore}
+        """
+
+        with self.lock:
+            back = next(a for a in range(COPIES) if a != self.header[FRONT] and a != self.header[READER])
+
+        for i, (type_, store) in enumerate(stores.items()):
+            slots = store.active_slots()
+            if len(slots) > self.capacity:
+                if not self.overflow_reported:
+                    print(f"[WorldBuffer.write] {len(slots)} {type_} entities, only {self.capacity} fit in the buffer")
+                    self.overflow_reported = True
+                slots = slots[:self.capacity]
+            fill_records(self.arrays[back][type_][:len(slots)], store, slots)
+            self.counts[back, i] = len(slots)
+
+        with self.lock:
+            self.header[FRONT] = back
+            self.header[TICK] = tick
+
+    def read(self):
+        """
+        :return: tick of the latest copy (-1 before the first one), {type: copy of its records}
+        """
+
+        with self.lock:
+            front = int(self.header[FRONT])
+            self.header[READER] = front
+            tick = int(self.header[TICK])
+        try:
+            return tick, {a: self.arrays[front][a][:self.counts[front, i]].copy() for i, a in enumerate(DTYPES)}
+        finally:
+            with self.lock:
+                self.header[READER] = -1
+
+    def close(self, unlink=False):
+        self.header = self.counts = self.arrays = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def fill_records(records, store, slots):
+    """
+    Copies the entities in the slots of the EntityStore to the DTYPES records
+    """
+
+    for name in store.columns:
+        records[name] = store.arrays[name][slots]
+    extra = store.extra
+    for name in records.dtype.names:
+        if name in store.columns:
+            continue
+        if name == "uuid":
+            records[name] = [store.ids[a] for a in slots]
+        elif name == "bombs":
+            records[name] = [extra[a]["inventory"]["bombs"] for a in slots]
+        else:
+            records[name] = [extra[a].get(name, 0) for a in slots]
+
+
+def world_records(p):
+    """
+    :param p: Processing with the array store
+    :return: {type: DTYPES records of all the entities}
+    """
+
+    ret = {}
+    for type_, store in (("tank", p.tanks_store), ("food", p.food_store), ("projectile", p.projectiles_store)):
+        slots = store.active_slots()
+        ret[type_] = np.empty(len(slots), DTYPES[type_])
+        fill_records(ret[type_], store, slots)
+    return ret
+
+
+def detach(item):
+    """
+    :return: Entity with the own fields of the item, sharing nothing mutable with it, to be sent to the other process
+    """
+
+    fields = {}
+    for name, value in item.items():
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        elif isinstance(value, (list, dict)):
+            value = value.copy()
+        fields[name] = value
+    return archetypes.Entity(fields)
+
+
+def to_items(records):
+    """
+    :return: {uuid: Entity} made of the WorldBuffer records
+    """
+
+    names = records.dtype.names
+    items = {}
+    for values in zip(*(records[a].tolist() for a in names)):
+        item = archetypes.Entity(zip(names, values))
+        items[item["uuid"]] = item
+    return items
+
+
+def sync_index(index: spatial.SpatialHash, items, records):
+    """
+    Makes the index hold exactly the items, at the positions of the records
+    """
+
+    for id_ in [a for a in index.entries if a not in items]:
+        index.remove(id_)
+    ids = records["uuid"].tolist()
+    known = np.array([a in index for a in ids], dtype=bool)
+    for i in np.flatnonzero(~known).tolist():
+        index.insert(ids[i], records["pos"][i].tolist(), float(records["radius"][i]))
+    if known.any():
+        index.update_many([a for a, b in zip(ids, known) if b], records["pos"][known], records["radius"][known])
+
+
+class PhysicsNetworking:
+    """
+    Networking of the worker's Processing: the snapshot "broadcast" publishes the tick to the WorldBuffer, the other
+    messages for the clients are passed to the main process, once per tick
+    """
+
+    def __init__(self, p, buffer: WorldBuffer, conn):
+        self.enable_traceback = False
+        self.processing = p
+        self.buffer = buffer
+        self.conn = conn
+        self.connections = {}  # the clients are in the main process
+        self.outbox = []
+        self.announced = set()  # tanks the main process got the name and public_id of
+
+    async def notify_all(self, notification, *exclude_ids):
+        if notification["type"] == "all_items":
+            self.publish()
+            return
+        if notification["type"] == "items":
+            notification = {"type": "items", "payload": {a: detach(b) for a, b in notification["payload"].items()}}
+        self.outbox.append(("notify", notification, exclude_ids))
+
+    def send(self, uuid_, message):
+        self.outbox.append(("send", uuid_, copy.deepcopy(message)))
+
+    def forget_client(self, uuid_):
+        self.announced.discard(uuid_)
+        self.outbox.append(("forget", uuid_))
+
+    def publish(self):
+        p = self.processing
+        self.buffer.write(p.tick, {"tank": p.tanks_store, "food": p.food_store, "projectile": p.projectiles_store})
+        self.announce_tanks()
+        self.flush()
+
+    def announce_tanks(self):
+        """
+        Passes on the names and public_ids of the new tanks, the world records have only the numbers
+        """
+
+        p = self.processing
+        new = p.tanks.keys() - self.announced
+        if new:
+            self.announced |= new
+            self.outbox.append(("tanks", {a: {"name": p.tanks[a]["name"], "public_id": p.tanks[a]["public_id"]}
+                                          for a in new}))
+
+    def flush(self):
+        if self.outbox:
+            self.conn.send(self.outbox)
+            self.outbox = []
+
+    async def execute(self, command):
+        p = self.processing
+        if command[0] == "inputs":
+            for uuid_, j in command[1]:
+                p.queue_input(uuid_, j)
+        elif command[0] == "spawn":
+            await self.spawn(command[1], command[2])
+        elif command[0] == "delete":
+            _, uuid_, notify = command
+            if uuid_ in p.tanks:
+                await p.delete_tank(uuid_, notify)
+
+    async def spawn(self, request_id, name):
+        p = self.processing
+        uuid_ = await p.spawn_tank(None, name)
+        self.announced.add(uuid_)
+        self.outbox.append(("spawned", request_id, uuid_, detach(p.tanks[uuid_]), p.tick))
+        return uuid_
+
+    async def serve_commands(self):
+        ready = asyncio.Event()
+        asyncio.get_running_loop().add_reader(self.conn.fileno(), ready.set)
+        while True:
+            await ready.wait()
+            ready.clear()
+            while self.conn.poll():
+                for command in self.conn.recv():
+                    try:
+                        await self.execute(command)
+                    except Exception as e:
+                        print("[PhysicsNetworking.serve_commands] exception:", e)
+                        if self.enable_traceback:
+                            print(traceback.format_exc())
+            self.flush()
+
+    async def send_stats(self):
+        while True:
+            self.outbox.append(("stats", self.processing.get_stats()))
+            await asyncio.sleep(1)
+
+    async def run(self):
+        p = self.processing
+        await asyncio.gather(p.start(), p.auto_spawn_food(), self.serve_commands(), self.send_stats())
+
+
+def run_worker(config, buffer, conn, main_conn):
+    """
+    Worker process
+    :param main_conn: main process end of the pipe, closed here so the worker sees the main process exit
+    """
+
+    main_conn.close()
+    p = processing.Processing(config["processing_rate"], config["food_amount"], config["map_dim"], True, None,
+                              config["seed"])
+    p.net = PhysicsNetworking(p, buffer, conn)
+    try:
+        asyncio.run(p.net.run())
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        buffer.close()
+
+
+class WorldMirror(abc.ABC):
+    """
+    Stand-in for Processing where the clients are served but the simulation runs in another process: mirrors
+    the world published by the simulation (tanks, food, projectiles and their spatial indexes) and broadcasts it to
+    the clients, forwards the spawns, inputs and disconnects. Subclasses pass the commands on with send_commands()
+    and the events of the simulation to dispatch()
+    """
+
+    def __init__(self, processing_rate, map_dim=2000, network_rate=None):
+        self.enable_traceback = False
+        self.processing_time = 1 / processing_rate
+        self.network_time = 1 / network_rate if network_rate else self.processing_time
+        self.tick = -1
+        self.world_size = np.array([map_dim, map_dim])
+        self.recorder = None
+        self.profiler = profiler.TickProfiler(self.network_time)
+        self.simulation_stats = {"ticks": 0, "overruns": 0, "phases": {}, "scheduler_overruns": 0,
+                                 "skipped_ticks": 0}
+
+        self.tanks = {}
+        self.food = {}
+        self.projectiles = {}
+        cell_size = max(settings.spatial_cell_size_min, map_dim / settings.spatial_cells_per_side)
+        self.tanks_index = spatial.SpatialHash(cell_size)
+        self.food_index = spatial.SpatialHash(cell_size)
+        self.projectiles_index = spatial.SpatialHash(cell_size)
+
+        self.tank_info = {}  # uuid -> {"name": ..., "public_id": ...}
+        self.spawned = {}  # uuid -> simulation tick of the spawn, for the tanks not in the mirrored world yet
+        self.requests = {}  # spawn request id -> future
+        self.request_ids = itertools.count()
+        self.inputs = []  # (uuid, input) not sent to the simulation yet
+
+        self.net = networking.Networking(self)
+
+    @abc.abstractmethod
+    def send_commands(self, commands):
+        """
+        :param commands: list of the commands for the simulation, in order
+        """
+
+    def pack(self):
+        return self.tanks | self.food | self.projectiles
+
+    async def spawn_tank(self, ws, name):
+        request_id = next(self.request_ids)
+        future = self.requests[request_id] = asyncio.get_running_loop().create_future()
+        self.send_commands([("spawn", request_id, name)])
+        uuid_, tank, tick = await future
+
+        self.spawned[uuid_] = tick
+        self.tank_info[uuid_] = {"name": tank["name"], "public_id": tank["public_id"]}
+        self.tanks[uuid_] = tank
+        self.tanks_index.insert(uuid_, tank["pos"], tank["radius"])
+        self.net.add_connection(uuid_, ws)
+        await self.net.notify_about_tank("items", uuid_)
+        return uuid_
+
+    async def delete_tank(self, uuid_, notify=False):
+        self.tanks.pop(uuid_, None)
+        self.tanks_index.remove(uuid_)
+        self.spawned.pop(uuid_, None)
+        self.net.forget_client(uuid_)
+        self.send_commands([("delete", uuid_, notify)])
+
+    def queue_input(self, uuid_, j):
+        """
+        Inputs are sent to the simulation in batches, all the ones received in one event loop iteration together
+        """
+
+        if not self.inputs:
+            asyncio.get_running_loop().call_soon(self.send_inputs)
+        self.inputs.append((uuid_, j))
+
+    def send_inputs(self):
+        inputs, self.inputs = self.inputs, []
+        self.send_commands([("inputs", inputs)])
+
+    def mirror(self, tick, records):
+        """
+        :param records: {type: DTYPES records} of the world as of the tick
+        :return: False if it isn't newer than the mirrored one
+        """
+
+        if tick <= self.tick:
+            return False
+        self.tick = tick
+
+        tanks = to_items(records["tank"])
+        for uuid_, tank in tanks.items():
+            tank["inventory"] = {"bombs": tank.pop("bombs")}
+            tank |= self.tank_info.get(uuid_, {"name": "", "public_id": ""})
+            self.spawned.pop(uuid_, None)
+        # Spawned after this tick was published
+        for uuid_, spawn_tick in list(self.spawned.items()):
+            if spawn_tick < tick:
+                del self.spawned[uuid_]
+            elif uuid_ in self.tanks:
+                tanks[uuid_] = self.tanks[uuid_]
+        self.tanks = tanks
+        self.food = to_items(records["food"])
+        self.projectiles = to_items(records["projectile"])
+
+        sync_index(self.tanks_index, self.tanks, records["tank"])
+        for uuid_ in self.spawned:
+            self.tanks_index.insert(uuid_, self.tanks[uuid_]["pos"], self.tanks[uuid_]["radius"])
+        sync_index(self.food_index, self.food, records["food"])
+        sync_index(self.projectiles_index, self.projectiles, records["projectile"])
+        return True
+
+    async def broadcast(self, tick, records):
+        """
+        Mirrors the world and sends the snapshots to the clients, the profiler has to be started before
+        """
+
+        if not self.mirror(tick, records):
+            return
+        self.profiler.lap("sync", len(self.tanks) + len(self.food) + len(self.projectiles))
+        await self.net.notify_all({"type": "all_items", "payload": self.projectiles | self.tanks | self.food})
+        self.profiler.lap("broadcast", len(self.net.connections))
+
+        if self.profiler.is_report_due(settings.profiler_log_interval):
+            print(f"[profiler] {type(self).__name__}:", self.profiler.format().split(" | ", 1)[-1])
+
+    async def dispatch(self, event):
+        if event[0] == "world":
+            self.profiler.start()
+            await self.broadcast(event[1], event[2])
+        elif event[0] == "notify":
+            await self.net.notify_all(event[1], *event[2])
+        elif event[0] == "send":
+            if event[1] in self.net.connections:
+                self.net.send(event[1], event[2])
+        elif event[0] == "forget":
+            # Gone from the simulation, the tank isn't in the mirrored world any more either
+            self.tank_info.pop(event[1], None)
+            self.tanks.pop(event[1], None)
+            self.tanks_index.remove(event[1])
+            self.spawned.pop(event[1], None)
+            self.net.forget_client(event[1])
+        elif event[0] == "tanks":
+            self.tank_info |= event[1]
+        elif event[0] == "spawned":
+            _, request_id, uuid_, tank, tick = event
+            self.requests.pop(request_id).set_result((uuid_, tank, tick))
+        elif event[0] == "stats":
+            self.simulation_stats = event[1]
+
+    async def dispatch_all(self, events):
+        for event in events:
+            try:
+                await self.dispatch(event)
+            except Exception as e:
+                print(f"[{type(self).__name__}.dispatch] exception:", e)
+                if self.enable_traceback:
+                    print(traceback.format_exc())
+
+    def get_stats(self):
+        """
+        :return: Processing.get_stats() of the simulation, with the phases of this process added
+        """
+
+        stats = self.simulation_stats | {"tick": self.tick, "clients": len(self.net.connections),
+                                         "entities": {"tanks": len(self.tanks), "food": len(self.food),
+                                                      "projectiles": len(self.projectiles)}}
+        phases = dict(stats["phases"])
+        # Simulation's "broadcast" is publishing the world
+        if "broadcast" in phases:
+            phases["publish"] = phases.pop("broadcast")
+        stats["phases"] = phases | self.profiler.get_stats()["phases"]
+        return stats
+
+
+class PhysicsProxy(WorldMirror):
+    """
+    WorldMirror of the worker process: the world is copied out of the WorldBuffer at the network rate.
+    Has to be created before the event loop runs, the worker is forked
+    """
+
+    def __init__(self, processing_rate, food_amount=300, map_dim=2000, network_rate=None, seed=None,
+                 capacity=16384):
+        super().__init__(processing_rate, map_dim, network_rate)
+        ctx = multiprocessing.get_context("fork")
+        self.buffer = WorldBuffer(capacity, ctx.Lock())
+        self.conn, worker_conn = ctx.Pipe()
+        config = {"processing_rate": processing_rate, "food_amount": food_amount, "map_dim": map_dim, "seed": seed}
+        self.process = ctx.Process(target=run_worker, args=(config, self.buffer, worker_conn, self.conn), daemon=True,
+                                   name="physics")
+        self.process.start()
+        worker_conn.close()
+        atexit.register(self.close)
+
+    def send_commands(self, commands):
+        self.conn.send(commands)
+
+    async def serve_events(self):
+        ready = asyncio.Event()
+        asyncio.get_running_loop().add_reader(self.conn.fileno(), ready.set)
+        while True:
+            await ready.wait()
+            ready.clear()
+            while self.conn.poll():
+                await self.dispatch_all(self.conn.recv())
+
+    async def read_world(self):
+        next_time = time.monotonic()
+        while True:
+            next_time += self.network_time
+            await asyncio.sleep(max(0, next_time - time.monotonic()))
+            next_time = max(next_time, time.monotonic() - self.network_time)
+
+            self.profiler.start()
+            await self.broadcast(*self.buffer.read())
+
+    async def start(self):
+        try:
+            await asyncio.gather(self.serve_events(), self.read_world())
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stops the worker and frees the shared memory
+        """
+
+        if self.buffer is None:
+            return
+        self.process.terminate()
+        self.process.join()
+        self.buffer.close(unlink=True)
+        self.buffer = None
@@ -8,29 +8,75 @@ import uuid
 import numpy as np
 import numpy.linalg
 
+import archetypes
+import entity_store
+import food_spawner
+import handles
 import networking
+import profiler
+import recording
+import spatial
+import timers
 import tools
 import settings
 
-tank_colors = ([255, 232, 105, 255], [191, 174, 78, 255], [153, 153, 153, 255], [114, 114, 114, 255],
-               [255, 255, 255, 255], [85, 85, 85, 255], [255, 255, 255, 255], [85, 85, 85, 255],
-               [133, 227, 125, 255], [85, 85, 85, 255])
-bullet_colors = ([0, 178, 225, 255], [0, 133, 168, 255])
-food_colors = ([255, 232, 105, 255], [191, 174, 78, 255])
-bomb_colors = ([255, 40, 40, 255], [191, 174, 78, 255])
-
 
 class Processing:
-    def __init__(self, processing_rate, food_amount=300, map_dim=2000):
+    def __init__(self, processing_rate, food_amount=300, map_dim=2000, array_store=False, network_rate=None,
+                 seed=None):
+        """
+        :param processing_rate: simulation ticks per second, every tick advances the world by exactly 1 / rate
+        :param network_rate: snapshots broadcast per second, None -> every tick
+        :param seed: seed of the simulation random generator, None -> random
+        """
+
         self.enable_traceback = False
 
         self.processing_time = 1 / processing_rate
+        self.ticks_per_snapshot = max(1, round(processing_rate / network_rate)) if network_rate else 1
+        self.tick = 0
+        # Simulation clock: advanced by processing_time every tick, all the "last_time"s are measured with it
+        self.time = time.monotonic()
+        self.overruns = 0  # ticks which didn't fit into their time slot
+        self.skipped_ticks = 0  # ticks dropped by the catch-up policy
+        self.profiler = profiler.TickProfiler(self.processing_time)
+        # All the randomness of the simulation comes from here (not the random module, the libraries use it too),
+        # so a recorded session can be replayed exactly
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.random = random.Random(self.seed)
+        self.recorder = None  # recording.Recorder of the inputs, None -> not recorded
         self.tanks = {}
         self.food = {}
         self.projectiles = {}
 
         self.world_size = np.array([map_dim, map_dim])
         self.food_amount = food_amount
+        # Entity handles shared by tanks, food and projectiles (they are merged into one dict for the clients)
+        self.handles = handles.HandleAllocator()
+
+        # Client inputs received since the last tick, applied at its start: uuid -> {"pos": ..., "rotation": ...,
+        # "current_shooting_time": ..., "shots": [(pos, rotation)], "explosions": n}
+        self.commands = {}
+
+        cell_size = max(settings.spatial_cell_size_min, map_dim / settings.spatial_cells_per_side)
+        self.tanks_index = spatial.SpatialHash(cell_size)
+        self.food_index = spatial.SpatialHash(cell_size)
+        self.projectiles_index = spatial.SpatialHash(cell_size)
+        self.food_spawner = food_spawner.FoodSpawner(self)
+
+        # Timed events (lifetimes, animations, heal delays); only the entities with something going on are touched
+        # every tick: uuid -> entity
+        self.timers = timers.TimerQueue()
+        self.animating = {}  # hit / disappearing animation running
+        self.regenerating = {}  # tanks which may heal
+
+        # Optional structure-of-arrays storage, entities in the dicts above are EntityViews then
+        if array_store:
+            self.tanks_store = entity_store.EntityStore(entity_store.tank_columns)
+            self.food_store = entity_store.EntityStore(entity_store.food_columns)
+            self.projectiles_store = entity_store.EntityStore(entity_store.projectile_columns)
+        else:
+            self.tanks_store = self.food_store = self.projectiles_store = None
 
         self.net = networking.Networking(self)
 
@@ -38,189 +84,412 @@ class Processing:
         return self.tanks | self.food | self.projectiles
 
     async def explode(self, pos, parent):
-        for _, food in self.food.items():
-            if numpy.linalg.norm(numpy.array(pos) - food["pos"]) <= 1000:
+        radius = settings.explosion_radius
+        for f_uuid_ in self.food_index.query(pos, radius):
+            food = self.food[f_uuid_]
+            if numpy.linalg.norm(numpy.array(pos) - food["pos"]) <= radius:
                 await self.on_kill(food, parent)
-        for _, tank in self.tanks.items():
+        for t_uuid_ in self.tanks_index.query(pos, radius):
+            tank = self.tanks[t_uuid_]
             if tank["uuid"] != parent["uuid"]:
-                if numpy.linalg.norm(numpy.array(pos) - tank["pos"]) <= 1000:
+                if numpy.linalg.norm(numpy.array(pos) - tank["pos"]) <= radius:
                     await self.on_kill(tank, parent)
 
-    async def spawn_food(self, pos, speed, radius, health, type_, class_, is_bomb):
-        uuid_ = str(uuid.uuid4())
-        self.food[uuid_] = {"uuid": uuid_, "type": type_, "class": class_, "pos": pos,
-                            "angle": random.randint(1, 360), "is_bomb": is_bomb,
-                            "speed": speed, "rotation_speed": random.randint(5, 15) * random.choice([1, -1]),
-                            "radius": radius, "health": health, "rotation": 0, "score": 10,
-                            "colors": food_colors if not is_bomb else bomb_colors, "is_hit": False,
-                            "is_disappearing": False, "animation_time": .15,
-                            "current_animation_time": 0, "lifetime": 10, "last_time": time.time()}
-
-    async def spawn_projectile(self, pos, angle, speed, radius, health, type_, class_, parent):
-        uuid_ = str(uuid.uuid4())
-        self.projectiles[uuid_] = {"uuid": uuid_, "type": type_, "class": class_, "pos": pos, "angle": angle,
-                                   "speed": speed,
-                                   "radius": radius, "health": health, "colors": bullet_colors, "parent": parent,
-                                   "is_disappearing": False, "disappearing_time": .1,
-                                   "lifetime": settings.projectile_lifetime, "last_time": time.time()}
-        await self.net.notify_all({"type": "items", "payload": {uuid_: self.projectiles[uuid_]}})
-
-    async def spawn_tank(self, ws, name, health, pos=None):
-        uuid_ = str(uuid.uuid4())
-        self.tanks[uuid_] = {"uuid": uuid_, "type": "tank", "pos": pos or [random.randint(0, self.world_size[0]),
-                                                                           random.randint(0, self.world_size[1])],
-                             "colors": tank_colors, "rotation": 0, "current_shooting_time": 0, "score": 1000,
-
-                             "health": health // 2, "regen_speed": 1, "name": name,
-                             "max_health": health, "basic_max_health": health, "health_increase_health": 0.0015,
-
-                             "bullet_damage": 2, "basic_bullet_damage": 2, "bullet_damage_increase_k": 0.001,
-                             "bullet_speed": 180, "basic_bullet_speed": 180, "bullet_speed_increase_k": 0.002,
-                             "bullet_radius": 10, "basic_bullet_radius": 10, "bullet_radius_increase_k": 0,
-
-                             "tank_type": "default", "radius": 30, "is_hit": False, "is_disappearing": False,
-                             "animation_time": .2, "current_animation_time": 0, "last_time": time.time(),
-                             "last_damage_time": 0, "heal_after_damage_time": 10, "inventory": {"bombs": 1}}
+    async def spawn_food(self, pos, speed, radius, health, archetype=archetypes.FOOD):
+        uuid_ = self.handles.allocate()
+        food = archetypes.Entity({"uuid": uuid_, "archetype": archetype, "pos": pos,
+                                  "angle": self.random.randint(1, 360),
+                                  "speed": speed,
+                                  "rotation_speed": self.random.randint(5, 15) * self.random.choice([1, -1]),
+                                  "radius": radius, "health": health, "rotation": 0, "is_hit": False,
+                                  "is_disappearing": False, "current_animation_time": 0, "last_time": self.time})
+        self.food[uuid_] = food if self.food_store is None else self.food_store.add(uuid_, food)
+        self.food_index.insert(uuid_, pos, radius)
+
+    async def spawn_projectile(self, pos, angle, speed, radius, health, parent, archetype=archetypes.BULLET):
+        uuid_ = self.handles.allocate()
+        projectile = archetypes.Entity({"uuid": uuid_, "archetype": archetype, "pos": pos, "angle": angle,
+                                        "speed": speed, "radius": radius, "health": health, "parent": parent,
+                                        "is_disappearing": False, "lifetime": settings.projectile_lifetime,
+                                        "last_time": self.time})
+        self.projectiles[uuid_] = projectile if self.projectiles_store is None else \
+            self.projectiles_store.add(uuid_, projectile)
+        self.projectiles_index.insert(uuid_, pos, radius)
+        self.timers.schedule(self.time + projectile["lifetime"], uuid_, "expire")
+
+    async def spawn_tank(self, ws, name, pos=None, archetype=archetypes.DEFAULT_TANK):
+        uuid_ = self.handles.allocate()
+        static = archetypes.ARCHETYPES[archetype]
+        tank = archetypes.Entity({"uuid": uuid_, "archetype": archetype,
+                                  "pos": pos or [self.random.randint(0, self.world_size[0]),
+                                                 self.random.randint(0, self.world_size[1])],
+                                  # Handles get reused, public_id stays unique for the whole life of the server
+                                  "public_id": str(uuid.uuid4()),
+                                  "rotation": 0, "current_shooting_time": 0, "score": 1000, "name": name,
+                                  "health": static["basic_max_health"] // 2, "max_health": static["basic_max_health"],
+                                  "bullet_damage": static["basic_bullet_damage"],
+                                  "bullet_speed": static["basic_bullet_speed"],
+                                  "bullet_radius": static["basic_bullet_radius"],
+                                  "radius": 30, "is_hit": False, "is_disappearing": False,
+                                  "current_animation_time": 0, "last_time": self.time, "last_damage_time": 0,
+                                  "inventory": {"bombs": 1}})
+        self.tanks[uuid_] = tank if self.tanks_store is None else self.tanks_store.add(uuid_, tank)
+        self.tanks_index.insert(uuid_, self.tanks[uuid_]["pos"], self.tanks[uuid_]["radius"])
+        self.regenerating[uuid_] = self.tanks[uuid_]
         await self.remove_food_around([*self.tanks[uuid_]["pos"], self.tanks[uuid_]["radius"] + 10])
 
         if ws is not None:
-            self.net.ws_conns[uuid_] = ws
+            self.net.add_connection(uuid_, ws)
             await self.net.notify_about_tank("items", uuid_)
         return uuid_
 
-    async def update_tank(self, uuid_, pos, rotation, notify_this=None):
-        # notify_this: True -> this uuid will receive the notification; None -> this uuid will not receive it
-
+    async def update_tank(self, uuid_, pos, rotation, current_shooting_time=None):
         self.tanks[uuid_]["pos"] = pos
         self.tanks[uuid_]["rotation"] = rotation
+        if current_shooting_time is not None:
+            self.tanks[uuid_]["current_shooting_time"] = current_shooting_time
+        self.tanks_index.update(uuid_, pos, self.tanks[uuid_]["radius"])
 
-        await self.net.notify_about_tank("items", uuid_, notify_this)
+    def queue_input(self, uuid_, j):
+        """
+        Buffers the client input until the next tick: only the latest movement is kept, shots and explosions add up
+        :param j: {"pos": ..., "rotation": ..., "current_shooting_time": ..., "shoot": bool, "explode": bool}
+        """
+
+        command = self.commands.get(uuid_)
+        if command is None:
+            command = self.commands[uuid_] = {"shots": [], "explosions": 0}
+        command["pos"] = j["pos"]
+        command["rotation"] = j["rotation"]
+        command["current_shooting_time"] = j["current_shooting_time"]
+        if j["shoot"]:
+            command["shots"].append(([*j["pos"]], j["rotation"]))
+        if j["explode"]:
+            command["explosions"] += 1
+
+    async def apply_commands(self):
+        """
+        Applies all the inputs buffered since the last tick in one batch
+        """
+
+        commands, self.commands = self.commands, {}
+        for uuid_, command in commands.items():
+            tank = self.tanks.get(uuid_)
+            if tank is None or tank["is_disappearing"]:
+                continue
+            await self.update_tank(uuid_, command["pos"], command["rotation"], command["current_shooting_time"])
+
+            for pos, rotation in command["shots"]:
+                pos[0] += math.sin(rotation * math.pi / 180) * -tank["radius"]
+                pos[1] += math.cos(rotation * math.pi / 180) * -tank["radius"]
+                await self.spawn_projectile(pos, rotation, tank["bullet_speed"], tank["bullet_radius"],
+                                            tank["bullet_damage"], uuid_)
+
+            for _ in range(command["explosions"]):
+                if tank["inventory"]["bombs"] <= 0:
+                    break
+                tank["inventory"]["bombs"] -= 1
+                self.net.send(uuid_, {"type": "inventory", "payload": tank["inventory"]})
+                await self.explode(tank["pos"], tank)
 
     async def delete_tank(self, uuid_, notify=False):
+        if self.tanks_store is not None:
+            self.tanks_store.remove(self.tanks[uuid_])
         del self.tanks[uuid_]
-        del self.net.ws_conns[uuid_]
+        self.tanks_index.remove(uuid_)
+        self.commands.pop(uuid_, None)
+        self.forget_timers(uuid_)
+        self.handles.release(uuid_)
+        self.net.forget_client(uuid_)
         if notify:
             await self.net.notify_all({"type": "delete", "payload": {uuid_: {"type": "tank"}}})
 
     async def process_items(self):
+        """
+        Fixed timestep loop: ticks are scheduled on a monotonic clock grid, so the processing time doesn't add up to
+        the period. When the loop falls behind, settings.tick_catch_up decides what to do with the missed ticks:
+        "substep" runs up to settings.max_catch_up_steps of them back to back, "skip" drops all but one
+        """
+
+        next_tick = time.monotonic() + self.processing_time
+        last_snapshot_tick = self.tick
         while True:
-            await asyncio.sleep(self.processing_time)
-            t = time.time()
-
-            items_to_remove = []
-
-            # Movement
-            for _, obj in self.projectiles.items():
-                await self.move(obj, t - obj["last_time"])
-            for _, obj in self.food.items():
-                a = t - obj["last_time"]
-                await self.move(obj, a)
-                obj["rotation"] += obj["rotation_speed"] * a
-
-            # Healing, updating tanks limits
-            for t_uuid_, tank in self.tanks.items():
-                # Gradually increasing max health level, bullet damage
-                tank["max_health"] = tank["basic_max_health"] + tank["health_increase_health"] * tank["score"]
-                tank["bullet_damage"] = tank["basic_bullet_damage"] + tank["bullet_damage_increase_k"] * tank["score"]
-                tank["bullet_speed"] = tank["basic_bullet_speed"] + tank["bullet_speed_increase_k"] * tank["score"]
-                tank["bullet_radius"] = tank["basic_bullet_radius"] + tank["bullet_radius_increase_k"] * tank["score"]
-
-                if tank["is_disappearing"] or tank["health"] >= tank["max_health"] or tank["health"] == 0 or \
-                        t - tank["last_damage_time"] < tank["heal_after_damage_time"]:
+            # Sleeping even when behind, the connections have to get their time too
+            await asyncio.sleep(max(0, next_tick - time.monotonic()))
+
+            due = int((time.monotonic() - next_tick) / self.processing_time) + 1
+            steps = min(due, settings.max_catch_up_steps) if settings.tick_catch_up == "substep" else 1
+            if due > 1:
+                self.overruns += 1
+                self.skipped_ticks += due - steps
+            next_tick += due * self.processing_time
+
+            for _ in range(steps):
+                await self.process_tick()
+
+            if self.tick - last_snapshot_tick >= self.ticks_per_snapshot:
+                last_snapshot_tick = self.tick
+                self.profiler.start()
+                await self.net.notify_all({"type": "all_items", "payload": self.projectiles | self.tanks | self.food})
+                self.profiler.lap("broadcast", len(self.net.connections))
+                if self.recorder is not None:
+                    self.recorder.checkpoint()
+
+            if self.profiler.is_report_due(settings.profiler_log_interval):
+                print("[profiler]", self.profiler.format())
+
+    async def process_tick(self):
+        """
+        Advances the world by one fixed step
+        """
+
+        self.tick += 1
+        self.time += self.processing_time
+        t = self.time
+        prof = self.profiler
+        prof.start()
+
+        # Client inputs
+        commands = len(self.commands)
+        await self.apply_commands()
+        prof.lap("commands", commands)
+        # Positions at the start of the step, for the swept hit detection of the moving entities
+        p_start = self.get_positions(self.projectiles)
+        f_start = self.get_positions(self.food)
+
+        # Movement, updating tanks limits
+        if self.tanks_store is None:
+            await self.process_dicts(t)
+        else:
+            self.process_arrays(t)
+        prof.lap("movement", len(self.projectiles) + len(self.food) + len(self.tanks))
+
+        # Healing, animation, lifetimes
+        self.regen_tanks()
+        prof.lap("regen", len(self.regenerating))
+        self.animate()
+        prof.lap("animation", len(self.animating))
+        items_to_remove = await self.process_timers(t)
+        prof.lap("timers", len(self.timers))
+
+        # Preventing food from 'leaving' game scene:
+        for _, food in self.food.items():
+            if food["pos"][0] < -20 or food["pos"][0] > self.world_size[0] + 20 or \
+                    food["pos"][1] < -20 or food["pos"][1] > self.world_size[1] + 20:
+                await self.on_kill(food)
+
+        # Hit detection: all the intersecting pairs of a kind are found in one go, then resolved in the same order as
+        # the nested loops did it (i2 > i for the pairs inside of one group).
+        # Projectiles are tested along their whole path during the step (earliest impact first), so the fast ones
+        # don't tunnel through the others at low tick rates
+        projectiles, food, tanks, p_start, f_start = self.get_colliders(p_start, f_start)
+        p_uuids, p_circles = self.get_circles(projectiles)
+        f_uuids, f_circles = self.get_circles(food)
+        t_uuids, t_circles = self.get_circles(tanks)
+        projectiles_hits = tools.group_pairs(*tools.get_swept_pairs(p_start, p_circles)[:2])
+        projectiles_food_hits = tools.group_pairs(*tools.get_swept_pairs(p_start, p_circles, f_start, f_circles)[:2])
+        projectiles_tanks_hits = tools.group_pairs(*tools.get_swept_pairs(p_start, p_circles, None, t_circles)[:2])
+
+        # Projectiles hit detection
+        for i in sorted(projectiles_hits.keys() | projectiles_food_hits.keys() | projectiles_tanks_hits.keys()):
+            projectile = projectiles[p_uuids[i]]
+            # Preventing already disappearing projectile from being processed again
+            if projectile["lifetime"] <= 0 or projectile["health"] == 0:
+                continue
+            processed = False
+
+            for i2 in projectiles_hits.get(i, ()):
+                projectile2 = projectiles[p_uuids[i2]]
+                if projectile["parent"] != projectile2["parent"] and projectile2["health"] != 0 and \
+                        self.resolves(projectile, projectile2):
+                    await self.hit(projectile, projectile2, t)
+                    processed = True
+            if processed:
+                continue
+
+            for i2 in projectiles_food_hits.get(i, ()):
+                obj = food[f_uuids[i2]]
+                if obj["is_disappearing"] or not self.resolves(projectile, obj):
                     continue
-                tank["health"] += tank["regen_speed"] * self.processing_time
-
-            # Animation
-            for uuid_, obj in (self.tanks | self.food).items():
-                if obj["is_disappearing"]:
-                    if obj["current_animation_time"] > obj["animation_time"]:
-                        items_to_remove.append({"type": obj["type"], "uuid": uuid_})
-                    else:
-                        obj["current_animation_time"] += t - obj["last_time"]
-                elif obj["is_hit"]:
-                    if obj["current_animation_time"] > obj["animation_time"]:
-                        obj["is_hit"] = False
-                        obj["current_animation_time"] = 0
-                    else:
-                        obj["current_animation_time"] += t - obj["last_time"]
-                obj["last_time"] = t
-            for p_uuid_, projectile in self.projectiles.items():
-                projectile["lifetime"] -= t - projectile["last_time"]
-                projectile["last_time"] = t
-                if projectile["lifetime"] < -projectile["disappearing_time"]:
-                    items_to_remove.append({"type": "projectile", "uuid": p_uuid_})
-
-            # Preventing food from 'leaving' game scene:
-            for _, food in self.food.items():
-                if food["pos"][0] < -20 or food["pos"][0] > self.world_size[0] + 20 or \
-                        food["pos"][1] < -20 or food["pos"][1] > self.world_size[1] + 20:
-                    await self.on_kill(food)
-
-            # Projectiles hit detection
-            p_keys = list(self.projectiles.keys())
-            for i, p_uuid_ in enumerate(self.projectiles):
-                projectile = self.projectiles[p_uuid_]
-                # Preventing already disappearing projectile from being processed again
-                if projectile["lifetime"] <= 0 or projectile["health"] == 0:
+                await self.hit(projectile, obj, t)
+                processed = True
+            if processed:
+                continue
+
+            for i2 in projectiles_tanks_hits.get(i, ()):
+                tank = tanks[t_uuids[i2]]
+                if tank["is_disappearing"] or t_uuids[i2] == projectile["parent"] or tank["health"] == 0 or \
+                        not self.resolves(projectile, tank):
                     continue
-                c1 = (*projectile["pos"], projectile["radius"])
-                processed = False
-
-                for i2 in range(i + 1, len(p_keys)):
-                    projectile2 = self.projectiles[p_keys[i2]]
-                    if projectile["parent"] != projectile2["parent"] and projectile2["health"] != 0:
-                        if tools.are_intersecting(c1, (*projectile2["pos"], projectile["radius"])):
-                            await self.hit(projectile, projectile2, t)
-                            processed = True
-                if processed:
+                await self.hit(projectile, tank, t)
+        prof.lap("projectile_collision", len(p_uuids))
+
+        # Tanks hit detection, hits don't move anything, so the pairs are the same as before the projectile hits
+        tanks_hits = tools.group_pairs(*tools.get_intersecting_pairs(t_circles))
+        tanks_food_hits = tools.group_pairs(*tools.get_intersecting_pairs(t_circles, f_circles))
+        for i in sorted(tanks_hits.keys() | tanks_food_hits.keys()):
+            tank = tanks[t_uuids[i]]
+            processed = False
+            for i2 in tanks_hits.get(i, ()):
+                if not self.resolves(tank, tanks[t_uuids[i2]]):
                     continue
-
-                for f_uuid_, obj in self.food.items():
-                    if obj["is_disappearing"]:
-                        continue
-                    if tools.are_intersecting(c1, (*obj["pos"], obj["radius"])):
-                        await self.hit(projectile, obj, t)
-                        processed = True
-                if processed:
+                await self.hit(tank, tanks[t_uuids[i2]], t)
+                processed = True
+            if processed:
+                break
+
+            for i2 in tanks_food_hits.get(i, ()):
+                obj = food[f_uuids[i2]]
+                if obj["is_disappearing"] or not self.resolves(tank, obj):
                     continue
+                await self.hit(tank, obj, t)
+        prof.lap("tank_collision", len(t_uuids))
+
+        # Removing items
+        await self.remove_obj(items_to_remove)
+        # await self.disappear_obj(items_to_disappear)
+        prof.lap("removal", len(items_to_remove))
+
+        # Spawning food, a bit every tick
+        spawned = await self.food_spawner.step()
+        prof.lap("food_spawn", spawned)
+        prof.end_tick()
+
+    async def process_dicts(self, t):
+        # Movement
+        for p_uuid_, obj in self.projectiles.items():
+            await self.move(obj, t - obj["last_time"])
+            obj["last_time"] = t
+            self.projectiles_index.update(p_uuid_, obj["pos"], obj["radius"])
+        for f_uuid_, obj in self.food.items():
+            a = t - obj["last_time"]
+            await self.move(obj, a)
+            obj["rotation"] += obj["rotation_speed"] * a
+            obj["last_time"] = t
+            self.food_index.update(f_uuid_, obj["pos"], obj["radius"])
+
+        # Gradually increasing max health level, bullet damage
+        for t_uuid_, tank in self.tanks.items():
+            tank["max_health"] = tank["basic_max_health"] + tank["health_increase_health"] * tank["score"]
+            tank["bullet_damage"] = tank["basic_bullet_damage"] + tank["bullet_damage_increase_k"] * tank["score"]
+            tank["bullet_speed"] = tank["basic_bullet_speed"] + tank["bullet_speed_increase_k"] * tank["score"]
+            tank["bullet_radius"] = tank["basic_bullet_radius"] + tank["bullet_radius_increase_k"] * tank["score"]
+
+    def process_arrays(self, t):
+        """
+        Same as process_dicts(), but with one vectorized pass per step over the array-backed entities
+        """
 
-                for t_uuid_, tank in self.tanks.items():
-                    if tank["is_disappearing"] or t_uuid_ == projectile["parent"] or tank["health"] == 0:
-                        continue
+        # Movement
+        slots = entity_store.move(self.projectiles_store, t)
+        self.projectiles_index.update_many([self.projectiles_store.ids[i] for i in slots],
+                                           self.projectiles_store.arrays["pos"][slots],
+                                           self.projectiles_store.arrays["radius"][slots])
+        slots = entity_store.move(self.food_store, t)
+        self.food_index.update_many([self.food_store.ids[i] for i in slots], self.food_store.arrays["pos"][slots],
+                                    self.food_store.arrays["radius"][slots])
 
-                    if tools.are_intersecting(c1, (*tank["pos"], tank["radius"])):
-                        await self.hit(projectile, tank, t)
-                        processed = True
-                if processed:
-                    continue
+        # Updating tanks limits
+        entity_store.scale_tank_stats(self.tanks_store)
 
-            # Tanks hit detection
-            t_keys = list(self.tanks.keys())
-            for i, t_uuid_ in enumerate(self.tanks):
-                tank = self.tanks[t_uuid_]
-                processed = False
-                for i2 in range(i + 1, len(t_keys)):
-                    tank2 = self.tanks[t_keys[i2]]
-                    if tools.are_intersecting((*tank["pos"], tank["radius"]), (*tank2["pos"], tank2["radius"])):
-                        await self.hit(tank, tank2, t)
-                        processed = True
-                if processed:
-                    break
+    def regen_tanks(self):
+        """
+        Heals the tanks out of their heal delay, the healed ones are dropped until they are hurt or outgrow their
+        max health
+        """
 
-                for f_uuid_, obj in self.food.items():
-                    if obj["is_disappearing"]:
-                        continue
-                    if tools.are_intersecting((*tank["pos"], tank["radius"]), (*obj["pos"], obj["radius"])):
-                        await self.hit(tank, obj, t)
-                        processed = True
-                if processed:
-                    continue
+        if not self.regenerating:
+            return
+        if self.tanks_store is None:
+            healed = []
+            for uuid_, tank in self.regenerating.items():
+                if tank["health"] < tank["max_health"] and tank["health"] != 0:
+                    tank["health"] += tank["regen_speed"] * self.processing_time
+                if tank["health"] >= tank["max_health"]:
+                    healed.append(uuid_)
+        else:
+            slots = np.fromiter((a.slot for a in self.regenerating.values()), int, len(self.regenerating))
+            healed = [self.tanks_store.ids[i] for i in
+                      entity_store.regen_tanks(self.tanks_store, slots, self.processing_time)]
+        for uuid_ in healed:
+            del self.regenerating[uuid_]
+
+    def animate(self):
+        for obj in self.animating.values():
+            if obj["type"] == "projectile":
+                obj["lifetime"] -= self.processing_time
+            else:
+                obj["current_animation_time"] += self.processing_time
+
+    async def process_timers(self, t):
+        """
+        Fires the timed events due by the time t
+        :return: items to remove
+        """
 
-            # Removing items
-            await self.remove_obj(items_to_remove)
-            # await self.disappear_obj(items_to_disappear)
+        items_to_remove = []
+        for uuid_, kind in self.timers.pop_due(t):
+            obj = self.get_item(uuid_)
+            if obj is None:
+                continue
+            if kind == "expire":
+                await self.disappear_obj(obj)
+            elif kind == "hit_end":
+                obj["is_hit"] = False
+                obj["current_animation_time"] = 0
+                self.animating.pop(uuid_, None)
+            elif kind == "regen":
+                self.regenerating[uuid_] = obj
+            elif kind == "remove":
+                self.animating.pop(uuid_, None)
+                items_to_remove.append({"type": obj["type"], "uuid": uuid_})
+        return items_to_remove
+
+    def get_colliders(self, p_start, f_start):
+        """
+        Entities the hit detection of the tick runs on
+        :param p_start: positions of the projectiles at the start of the tick
+        :param f_start: positions of the food at the start of the tick
+        :return: projectiles, food, tanks, positions of the projectiles and the food at the start of the tick
+        """
 
-            await self.net.notify_all({"type": "all_items", "payload": self.projectiles | self.tanks | self.food})
+        return self.projectiles, self.food, self.tanks, p_start, f_start
+
+    def resolves(self, obj1, obj2):
+        """
+        :return: whether the hit of obj1 on obj2 is resolved by this Processing (always, unless the world is sharded)
+        """
+
+        return True
+
+    def get_item(self, uuid_):
+        for items in (self.projectiles, self.food, self.tanks):
+            obj = items.get(uuid_)
+            if obj is not None:
+                return obj
+        return None
+
+    def forget_timers(self, uuid_):
+        self.timers.cancel(uuid_)
+        self.animating.pop(uuid_, None)
+        self.regenerating.pop(uuid_, None)
+
+    @staticmethod
+    def get_positions(entities):
+        """
+        :return: numpy array (n, 2) of the entities positions (a copy)
+        """
+
+        return np.array([e["pos"] for e in entities.values()], dtype=float).reshape(-1, 2)
+
+    @staticmethod
+    def get_circles(entities):
+        """
+        :return: ids of the entities, numpy array (n, 3) of their [x, y, radius] circles in the same order
+        """
+
+        return list(entities), np.array([(*e["pos"], e["radius"]) for e in entities.values()],
+                                        dtype=float).reshape(-1, 3)
 
     async def move(self, obj, time_dif):
         obj["pos"][0] -= time_dif * obj["speed"] * math.sin(obj["angle"] / 180 * math.pi)
@@ -228,21 +497,40 @@ class Processing:
 
     async def disappear_obj(self, *items_to_disappear):
         for item in items_to_disappear:
+            uuid_ = item["uuid"]
             if item["type"] == "projectile":
-                item["lifetime"] = 0 if item["lifetime"] > 0 else item["lifetime"]
-            elif item["type"] == "food":
-                if item["uuid"] in self.food:
-                    item["is_disappearing"] = True
-            elif item["type"] == "tank":
-                if item["uuid"] in self.tanks:
+                if item["lifetime"] > 0:
+                    item["lifetime"] = 0
+                    self.timers.cancel(uuid_, "expire")
+                    self.animating[uuid_] = item
+                    self.timers.schedule(self.time + item["disappearing_time"], uuid_, "remove")
+            elif item["type"] == "food" and uuid_ in self.food or item["type"] == "tank" and uuid_ in self.tanks:
+                if not item["is_disappearing"]:
                     item["is_disappearing"] = True
+                    # Disappearing animation goes on from where the hit animation is
+                    self.timers.cancel(uuid_, "hit_end")
+                    self.timers.cancel(uuid_, "regen")
+                    self.animating[uuid_] = item
+                    self.timers.schedule(self.time + max(0, item["animation_time"] - item["current_animation_time"]),
+                                         uuid_, "remove")
+                    self.regenerating.pop(uuid_, None)
 
     async def remove_obj(self, items_to_remove):
         for item in items_to_remove:
             if item["type"] == "projectile":
+                if self.projectiles_store is not None:
+                    self.projectiles_store.remove(self.projectiles[item["uuid"]])
                 del self.projectiles[item["uuid"]]
+                self.projectiles_index.remove(item["uuid"])
+                self.forget_timers(item["uuid"])
+                self.handles.release(item["uuid"])
             elif item["type"] == "food":
+                if self.food_store is not None:
+                    self.food_store.remove(self.food[item["uuid"]])
                 del self.food[item["uuid"]]
+                self.food_index.remove(item["uuid"])
+                self.forget_timers(item["uuid"])
+                self.handles.release(item["uuid"])
             elif item["type"] == "tank":
                 await self.delete_tank(item["uuid"])
         if len(items_to_remove) > 0:
@@ -272,26 +560,51 @@ class Processing:
                 obj_killer = obj2
                 obj_killed = obj1
 
-            obj_killer["health"] -= obj_killed["health"]
-            obj_killer["current_animation_time"] = 0
-            obj_killer["last_damage_time"] = t
-            obj_killer["is_hit"] = True
+            self.damage(obj_killer, obj_killed["health"], t)
             await self.on_kill(obj_killed, obj_killer)
 
+    def damage(self, obj, amount, t):
+        """
+        Takes the health off the object which survived the hit and starts its hit animation
+        """
+
+        obj["health"] -= amount
+        obj["current_animation_time"] = 0
+        obj["last_damage_time"] = t
+        obj["is_hit"] = True
+        if obj["type"] != "projectile":
+            self.animating[obj["uuid"]] = obj
+            self.timers.schedule(t + obj["animation_time"], obj["uuid"], "hit_end")
+        if obj["type"] == "tank":
+            self.regenerating.pop(obj["uuid"], None)
+            self.timers.schedule(t + obj["heal_after_damage_time"], obj["uuid"], "regen")
+
     async def on_kill(self, obj_killed, obj_killer=None):
-        if obj_killer is not None and "score" in obj_killed:
+        if obj_killer is not None and obj_killed.get("score") is not None:
             if "parent" in obj_killer:
                 t_uuid_ = obj_killer["parent"]
             elif obj_killer["type"] == "tank":
                 t_uuid_ = obj_killer["uuid"]
             else:
                 t_uuid_ = None
-            if t_uuid_ is not None and t_uuid_ in self.tanks:
-                self.tanks[t_uuid_]["score"] += obj_killed["score"]
-            if "is_bomb" in obj_killed and obj_killed["is_bomb"] and t_uuid_ is not None:
-                self.tanks[t_uuid_]["inventory"]["bombs"] += 1
+            if t_uuid_ is not None:
+                self.reward(t_uuid_, obj_killed["score"], obj_killed.get("is_bomb"))
         await self.disappear_obj(obj_killed)
 
+    def reward(self, t_uuid_, score, is_bomb):
+        """
+        Score (and the bomb, if it was one) for the tank which killed something
+        """
+
+        if t_uuid_ in self.tanks:
+            tank = self.tanks[t_uuid_]
+            tank["score"] += score
+            if not tank["is_disappearing"] and not self.timers.is_scheduled(t_uuid_, "regen"):
+                # Its max health grows with the score
+                self.regenerating[t_uuid_] = tank
+            if is_bomb:
+                self.tanks[t_uuid_]["inventory"]["bombs"] += 1
+
     async def are_tanks_around(self, c2, radius_around):
         """
         :param radius_around: radius around the tank
@@ -299,10 +612,7 @@ class Processing:
         :return:
         """
 
-        for _, tank in self.tanks.items():
-            if tools.are_intersecting((*tank["pos"], tank["radius"] + radius_around), c2):
-                return True
-        return False
+        return len(self.tanks_index.query(c2[:2], c2[2] + radius_around)) > 0
 
     async def are_food_around(self, c2, radius_around):
         """
@@ -311,10 +621,7 @@ class Processing:
         :return:
         """
 
-        for _, food in self.food.items():
-            if tools.are_intersecting((*food["pos"], food["radius"] + radius_around), c2):
-                return True
-        return False
+        return len(self.food_index.query(c2[:2], c2[2] + radius_around)) > 0
 
     async def remove_food_around(self, c1):
         """
@@ -322,40 +629,56 @@ class Processing:
         :return:
         """
 
-        for _, food in self.food.items():
-            if tools.are_intersecting((*food["pos"], food["radius"]), c1):
-                print("removing food to spawn:", food)
-                await self.on_kill(food)
+        for f_uuid_ in self.food_index.query(c1[:2], c1[2]):
+            food = self.food[f_uuid_]
+            print("removing food to spawn:", food)
+            await self.on_kill(food)
 
-    async def auto_spawn_food(self):
-        food_radius = settings.food_radius
+    def get_stats(self):
+        """
+        :return: tick profiler stats plus the scheduler counters and the world size, for the admin "stats" message
+        """
 
+        return self.profiler.get_stats() | {
+            "tick": self.tick, "scheduler_overruns": self.overruns, "skipped_ticks": self.skipped_ticks,
+            "clients": len(self.net.connections),
+            "entities": {"tanks": len(self.tanks), "food": len(self.food), "projectiles": len(self.projectiles)}}
+
+    def get_food_amount(self):
+        """
+        :return: amount of food to keep on the map: food_amount scaled with the map area,
+            plus settings.food_per_player for every tank
+        """
+
+        area_k = self.world_size[0] * self.world_size[1] / settings.food_amount_map_dim ** 2
+        return int(self.food_amount * area_k) + settings.food_per_player * len(self.tanks)
+
+    async def auto_spawn_food(self):
         while True:
             try:
-                to_spawn = self.food_amount - len(self.food)
-                if len(self.food) == 0 or to_spawn / len(self.food) > 0.05:
+                to_spawn = self.get_food_amount() - len(self.food)
+                if not self.food_spawner.is_active and to_spawn > 0 and \
+                        (len(self.food) == 0 or to_spawn / len(self.food) > 0.05):
                     print("[auto_spawn_food] Spawning food...")
-                    for i in range(to_spawn):
-                        success = False
-                        while not success:
-                            pos = [random.randint(0, self.world_size[0]), random.randint(0, self.world_size[1])]
-                            if not await self.are_food_around([*pos, food_radius], 4) \
-                                    and not await self.are_tanks_around([*pos, food_radius], 60):
-                                is_bomb = random.random() < 0.1
-                                await self.spawn_food(pos, random.randint(5, 10),
-                                                      food_radius if not is_bomb else food_radius + 4,
-                                                      4 if not is_bomb else 20,
-                                                      "food", "square", is_bomb)
-                                success = True
-                    print("[auto_spawn_food] Spawn food complete")
+                    # Spawned by process_tick(), under the per-tick time budget
+                    self.food_spawner.refill(to_spawn)
+                    if self.recorder is not None:
+                        self.recorder.record(recording.REFILL, to_spawn)
             except Exception as e:
                 print("[auto_spawn_food] error while spawning food:", e)
                 if self.enable_traceback:
                     print(traceback.format_exc())
             await asyncio.sleep(5)
 
+    async def init_world(self):
+        """
+        World the server starts with, before any client
+        """
+
+        await self.spawn_tank(None, "test", [20, 20])
+
     async def start(self):
-        await self.spawn_tank(None, "test", 20, [20, 20])
+        await self.init_world()
         while True:
             try:
                 await self.process_items()
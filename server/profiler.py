@@ -0,0 +1,80 @@
+import collections
+import time
+
+
+class TickProfiler:
+    """
+    Durations of the tick phases over the last window samples of every phase, and the amount of entities every phase
+    went through the last time. Phases are timed one after another with lap(): the time since the previous lap
+    (or start()) goes to the phase
+    """
+
+    def __init__(self, tick_time, window=600):
+        self.tick_time = tick_time
+        self.window = window
+        self.samples = {}  # phase -> deque of the durations (seconds)
+        self.counts = {}  # phase -> entities processed the last time
+        self.ticks = 0
+        self.overruns = 0  # ticks which took longer than tick_time
+        self.tick_start = self.last = time.perf_counter()
+        self.last_report = time.monotonic()
+
+    def start(self):
+        self.tick_start = self.last = time.perf_counter()
+
+    def lap(self, phase, count=None):
+        t = time.perf_counter()
+        self.add(phase, t - self.last, count)
+        self.last = t
+
+    def end_tick(self):
+        duration = time.perf_counter() - self.tick_start
+        self.add("tick", duration)
+        self.ticks += 1
+        if duration > self.tick_time:
+            self.overruns += 1
+
+    def add(self, phase, duration, count=None):
+        samples = self.samples.get(phase)
+        if samples is None:
+            samples = self.samples[phase] = collections.deque(maxlen=self.window)
+        samples.append(duration)
+        if count is not None:
+            self.counts[phase] = count
+
+    def get_stats(self):
+        """
+        :return: {"ticks": n, "overruns": n, "phases": {phase: {"p50": ms, "p90": ms, "p99": ms, "max": ms,
+            "count": entities}}}
+        """
+
+        phases = {}
+        for phase, samples in self.samples.items():
+            s = sorted(samples)
+            phases[phase] = {"p50": s[len(s) // 2] * 1000, "p90": s[int(len(s) * .9)] * 1000,
+                             "p99": s[int(len(s) * .99)] * 1000, "max": s[-1] * 1000,
+                             "count": self.counts.get(phase)}
+        return {"ticks": self.ticks, "overruns": self.overruns, "phases": phases}
+
+    def is_report_due(self, interval):
+        """
+        :return: True once every interval seconds (never if interval is 0)
+        """
+
+        t = time.monotonic()
+        if not interval or t - self.last_report < interval:
+            return False
+        self.last_report = t
+        return True
+
+    def format(self):
+        """
+        :return: one line summary: p50/p99 of every phase in ms, entity counts in brackets
+        """
+
+        stats = self.get_stats()
+        parts = [f"{stats['ticks']} ticks, {stats['overruns']} overruns"]
+        for phase, a in stats["phases"].items():
+            count = f" [{a['count']}]" if a["count"] is not None else ""
+            parts.append(f"{phase} {a['p50']:.2f}/{a['p99']:.2f}{count}")
+        return " | ".join(parts)
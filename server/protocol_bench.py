@@ -0,0 +1,76 @@
+"""
+Size/speed comparison of the binary protocol against JSON, the round-trip checks are in test_protocol.py.
+Usage: python protocol_bench.py [tanks] [food] [projectiles]
+"""
+
+import asyncio
+import json
+import random
+import sys
+import time
+
+import archetypes
+import processing
+import protocol
+import tools
+
+def measure(function, repeat):
+    t = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - t) / repeat
+
+
+async def build_world(tanks, food, projectiles, seed=0):
+    random.seed(seed)
+    p = processing.Processing(60, food, 4000, seed=seed)
+    for i in range(tanks):
+        await p.spawn_tank(None, f"player {i}")
+    for _ in range(food):
+        await p.spawn_food([random.uniform(0, 4000), random.uniform(0, 4000)], random.randint(5, 10), 20, 4,
+                           archetypes.BOMB if random.random() < 0.1 else archetypes.FOOD)
+    tank_uuids = list(p.tanks)
+    for _ in range(projectiles):
+        tank = p.tanks[random.choice(tank_uuids)]
+        await p.spawn_projectile([*tank["pos"]], random.uniform(-180, 180), tank["bullet_speed"],
+                                 tank["bullet_radius"], tank["bullet_damage"], tank["uuid"])
+    return p
+
+
+def main():
+    args = [int(a) for a in sys.argv[1:4]]
+    tanks, food, projectiles = args + [20, 300, 200][len(args):]
+    p = asyncio.run(build_world(tanks, food, projectiles))
+
+    world = p.pack()
+    some_uuids = list(world)[:len(world) // 3]
+    changed = {a: {"pos": [*world[a]["pos"]], "health": world[a]["health"]} for a in some_uuids}
+    messages = {
+        "input": {"type": "input", "payload": {"pos": [1234.56, 78.9], "rotation": -93.7,
+                                               "current_shooting_time": 0.15, "shoot": True, "explode": False}},
+        "items": {"type": "items", "payload": {some_uuids[0]: world[some_uuids[0]]}},
+        "all_items": {"type": "all_items", "tick": 123456, "payload": world},
+        "delta": {"type": "delta", "tick": 123457,
+                  "payload": {"created": {some_uuids[1]: world[some_uuids[1]]}, "changed": changed,
+                              "removed": some_uuids[2:10]}},
+        "delete": {"type": "delete", "payload": {a: {"type": world[a]["type"]} for a in some_uuids[:10]}},
+        "force_position": {"type": "force_position", "payload": [1000.25, 20.5]},
+        "inventory": {"type": "inventory", "payload": {"bombs": 3}},
+    }
+
+    print(f"world: {tanks} tanks, {food} food, {projectiles} projectiles")
+    print(f"{'message':<16}{'json B':>10}{'binary B':>10}{'json enc us':>13}{'bin enc us':>12}"
+          f"{'json dec us':>13}{'bin dec us':>12}")
+    for name, message in messages.items():
+        json_data = json.dumps(message, default=tools.json_default)
+        binary_data = protocol.encode(message)
+        repeat = 10 if name == "all_items" else 1000
+        print(f"{name:<16}{len(json_data):>10}{len(binary_data):>10}"
+              f"{measure(lambda: json.dumps(message, default=tools.json_default), repeat) * 1e6:>13.1f}"
+              f"{measure(lambda: protocol.encode(message), repeat) * 1e6:>12.1f}"
+              f"{measure(lambda: json.loads(json_data), repeat) * 1e6:>13.1f}"
+              f"{measure(lambda: protocol.decode(binary_data), repeat) * 1e6:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import json
+import struct
+import time
+import zlib
+
+# File: magic line, JSON line with the session (seed, clock, world parameters), then the records appended as they
+# happen: header (tick, kind, client, data length) + data. The tick is Processing.tick when the event came, so it's
+# applied after that tick and before the next one
+MAGIC = b"TANKREC1\n"
+RECORD = struct.Struct("<IBII")
+
+CONNECT = 0  # client: tank handle, data: handshake message
+INPUT_TEXT = 1  # client: tank handle, data: JSON input message
+INPUT_BINARY = 2  # client: tank handle, data: binary input message
+DISCONNECT = 3  # client: tank handle
+REFILL = 4  # client: amount of food to spawn (FoodSpawner.refill())
+FOOD_STEP = 5  # client: candidates tried by FoodSpawner.step() during the tick
+CHECKPOINT = 6  # client: world_checksum() or 0 when not computed this time
+
+
+def world_checksum(p):
+    """
+    :return: CRC32 of the handles, positions and health of all the entities, in the dict order
+    """
+
+    crc = 0
+    for items in (p.tanks, p.food, p.projectiles):
+        for id_, item in items.items():
+            crc = zlib.crc32(struct.pack("<Iddd", id_, *item["pos"], item["health"]), crc)
+    return crc
+
+
+class Recorder:
+    """
+    Append-only recording of everything the simulation can't reproduce on its own: client connections and their
+    input messages, food refills and how far the time-budgeted food steps got. With the seed of the random generator
+    and the simulation clock it's enough to replay the session tick by tick, see replay.py
+    """
+
+    def __init__(self, path, p, checksum_interval=0):
+        """
+        :param p: Processing, before anything happened in it
+        :param checksum_interval: ticks between the world checksums in the checkpoints, 0 -> none
+        """
+
+        self.processing = p
+        self.checksum_interval = checksum_interval
+        self.last_checksum_tick = p.tick
+        # Never over an older recording
+        self.file = open(path, "xb")
+        self.file.write(MAGIC)
+        self.file.write(json.dumps({"seed": p.seed, "time": p.time, "tick": p.tick,
+                                    "processing_rate": 1 / p.processing_time,
+                                    "ticks_per_snapshot": p.ticks_per_snapshot, "map_dim": int(p.world_size[0]),
+                                    "food_amount": p.food_amount, "array_store": p.tanks_store is not None,
+                                    "created": time.time()}).encode() + b"\n")
+        self.file.flush()
+
+    def record(self, kind, client=0, data=b""):
+        if type(data) == str:
+            data = data.encode()
+        self.file.write(RECORD.pack(self.processing.tick, kind, client, len(data)))
+        self.file.write(data)
+
+    def record_input(self, uuid_, message):
+        self.record(INPUT_BINARY if type(message) == bytes else INPUT_TEXT, uuid_, message)
+
+    def checkpoint(self):
+        """
+        Marks the tick as recorded and writes the buffered records to the file
+        """
+
+        checksum = 0
+        p = self.processing
+        if self.checksum_interval and p.tick - self.last_checksum_tick >= self.checksum_interval:
+            self.last_checksum_tick = p.tick
+            checksum = world_checksum(p)
+        self.record(CHECKPOINT, checksum)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read(path):
+    """
+    :return: session dict, generator of the records (tick, kind, client, data); a record cut off at the end of
+        the file (the server was killed while writing it) is dropped
+    """
+
+    f = open(path, "rb")
+    if f.readline() != MAGIC:
+        f.close()
+        raise ValueError(f"{path} is not a recording")
+    session = json.loads(f.readline())
+
+    def records():
+        with f:
+            while True:
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    return
+                tick, kind, client, length = RECORD.unpack(header)
+                data = f.read(length)
+                if len(data) < length:
+                    return
+                yield tick, kind, client, data
+
+    return session, records()
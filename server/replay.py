@@ -0,0 +1,172 @@
+"""
+Replays an input recording (settings.record_dir, recording.py) through Processing as fast as possible: the same
+seed, clock and inputs at the same ticks give the same world, the clients are stubs which drop everything sent to
+them. The world checksums in the recording are checked on the way.
+Timed like benchmark.py, so a busy recorded session is a repeatable workload for before/after comparisons.
+
+Usage: python replay.py recording.rec [--store dict|array] [--output results.json] [--compare baseline.json]
+The exit code is 1 if the replay diverged from the recording or, with --compare, something got slower than
+the baseline by more than --threshold
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import benchmark
+import processing
+import profiler
+import recording
+
+
+class Replay:
+    def __init__(self, path, array_store=None):
+        """
+        :param array_store: entity storage to replay with, None -> the recorded one
+        """
+
+        self.enable_traceback = False
+        self.session, self.records = recording.read(path)
+        s = self.session
+        self.processing = processing.Processing(s["processing_rate"], s["food_amount"], s["map_dim"],
+                                                s["array_store"] if array_store is None else array_store,
+                                                s["processing_rate"] / s["ticks_per_snapshot"], s["seed"])
+        p = self.processing
+        p.time = s["time"]
+        p.tick = s["tick"]
+        # All the ticks are kept, not only the latest ones
+        p.profiler = profiler.TickProfiler(p.processing_time, None)
+        p.food_spawner.replay_steps = {}
+
+        self.clients = {}  # recorded tank handle -> handle in the replay
+        self.last_snapshot_tick = p.tick
+        self.samples = []  # process_tick() durations
+        self.records_count = 0
+        self.input_errors = 0
+        self.checksums = 0  # checked
+        self.mismatches = []  # ticks where the world checksum differs from the recorded one
+
+    async def run(self):
+        p = self.processing
+        await p.init_world()
+        for tick, kind, client, data in self.records:
+            self.records_count += 1
+            if kind == recording.FOOD_STEP:
+                # Recorded during the tick, needed before it
+                await self.advance(tick - 1)
+                p.food_spawner.replay_steps[tick] = client
+                continue
+            await self.advance(tick)
+            await self.apply(kind, client, data)
+
+        for uuid_ in self.clients.values():
+            if uuid_ in p.net.connections:
+                p.net.connections[uuid_].close()
+        await asyncio.sleep(0)
+
+    async def advance(self, tick):
+        """
+        Runs the ticks up to the tick, with the snapshot broadcasts as process_items() does them
+        """
+
+        p = self.processing
+        while p.tick < tick:
+            t = time.perf_counter()
+            await p.process_tick()
+            self.samples.append(time.perf_counter() - t)
+
+            if p.tick - self.last_snapshot_tick >= p.ticks_per_snapshot:
+                self.last_snapshot_tick = p.tick
+                p.profiler.start()
+                await p.net.notify_all({"type": "all_items", "payload": p.projectiles | p.tanks | p.food})
+                p.profiler.lap("broadcast", len(p.net.connections))
+            # Client writers build and "send" the messages
+            await asyncio.sleep(0)
+
+    async def apply(self, kind, client, data):
+        p = self.processing
+        if kind == recording.CONNECT:
+            self.clients[client] = await p.net.add_client(benchmark.StubWebSocket(), json.loads(data))
+        elif kind == recording.INPUT_TEXT or kind == recording.INPUT_BINARY:
+            try:
+                p.net.handle_input(self.clients[client], data.decode() if kind == recording.INPUT_TEXT else data)
+            except Exception as e:
+                # The server dropped the client, its disconnect comes next
+                self.input_errors += 1
+                if self.enable_traceback:
+                    print("[Replay.apply] input exception:", e)
+        elif kind == recording.DISCONNECT:
+            uuid_ = self.clients.pop(client, None)
+            if uuid_ in p.tanks:
+                await p.delete_tank(uuid_, False)
+        elif kind == recording.REFILL:
+            p.food_spawner.refill(client)
+        elif kind == recording.CHECKPOINT and client:
+            self.checksums += 1
+            if recording.world_checksum(p) != client:
+                if not self.mismatches:
+                    print(f"[Replay.apply] world differs from the recording at tick {p.tick}")
+                self.mismatches.append(p.tick)
+
+    def get_results(self):
+        ret = {"tick": benchmark.summarize(self.samples)}
+        for phase, samples in self.processing.profiler.samples.items():
+            if phase != "tick":
+                ret[phase] = benchmark.summarize(samples)
+        return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays an input recording as fast as possible")
+    parser.add_argument("recording")
+    parser.add_argument("--store", choices=("dict", "array"), help="entity storage, the recorded one by default")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="baseline JSON file (of replay.py or benchmark.py) to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="p50 slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    replay = Replay(args.recording, None if args.store is None else args.store == "array")
+    t = time.perf_counter()
+    asyncio.run(replay.run())
+    elapsed = time.perf_counter() - t
+
+    p = replay.processing
+    ticks = len(replay.samples)
+    print(f"{args.recording}: {replay.records_count} records, {ticks} ticks in {elapsed:.2f} s "
+          f"({ticks / max(elapsed, 1e-9):.0f} ticks/s, {ticks * p.processing_time / max(elapsed, 1e-9):.1f}x "
+          f"real time), {replay.input_errors} bad inputs")
+    print(f"world checksums: {replay.checksums - len(replay.mismatches)} of {replay.checksums} match")
+    results = {"meta": {"time": time.time(), "python": platform.python_version(), "numpy": np.__version__,
+                        "machine": platform.machine(), "recording": args.recording, "session": replay.session,
+                        "array_store": p.tanks_store is not None, "elapsed": elapsed,
+                        "mismatches": replay.mismatches},
+               "results": {"replay": replay.get_results()}}
+    for benchmark_, a in results["results"]["replay"].items():
+        print(f"  {benchmark_:<22} p50 {a['p50_ms']:9.3f} ms  p90 {a['p90_ms']:9.3f} ms  "
+              f"mean {a['mean_ms']:9.3f} ms  ({a['samples']} samples)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    failed = bool(replay.mismatches)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = benchmark.compare(results, baseline, args.threshold)
+        for scenario, name, before, after in regressions:
+            print(f"REGRESSION {scenario}/{name}: p50 {before:.3f} -> {after:.3f} ms ({after / before - 1:+.0%})")
+        if not regressions:
+            print(f"no regressions against {args.compare} (threshold {args.threshold:.0%})")
+        failed = failed or bool(regressions)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
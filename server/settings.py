@@ -4,5 +4,72 @@ import numpy as np
 display_window_size_half = np.array([2560 // 2 + 10, 1440 // 2 + 10])
 map_dim = 2000
 food_amount = 40
+# food_amount is for a food_amount_map_dim x food_amount_map_dim map, it's scaled with the map area;
+# every player adds food_per_player more
+food_amount_map_dim = 2000
+food_per_player = 2
+# Seconds of every tick the food spawner may use
+food_spawn_budget = 0.002
 food_radius = 20
 projectile_lifetime = 10
+# Bombs kill the food and the tanks within this distance
+explosion_radius = 1000
+# Spatial index: cell side is map_dim / spatial_cells_per_side, but never less than a couple of tank diameters
+spatial_cells_per_side = 64
+spatial_cell_size_min = 120
+# Keep entities in NumPy arrays (entity_store.py) and process them with vectorized passes
+array_entity_store = False
+# Entities stay visible until they are this far outside of the display window, so they don't flicker at the edge
+display_window_margin = 100
+# Full all_items snapshot is sent every keyframe_interval broadcasts, deltas in between
+keyframe_interval = 60
+# Item fields which are never sent to the clients
+server_only_fields = ("last_time",)
+# Clients simulate the movement of projectiles and food themselves (from the pos they had at the snapshot tick),
+# so these fields are sent only when the item shows up, not with every change
+client_simulation = True
+simulated_fields = {"projectile": ("pos",), "food": ("pos", "rotation")}
+# Client is disconnected if it has more queued messages or hasn't caught up for longer than that (seconds)
+max_queued_messages = 1000
+max_client_lag = 5
+# Simulation ticks and snapshot broadcasts per second
+simulation_rate = 60
+network_rate = 20
+# What to do with the ticks missed when the loop falls behind: "substep" - run up to max_catch_up_steps of them
+# back to back, "skip" - drop them, the game slows down instead
+tick_catch_up = "substep"
+max_catch_up_steps = 5
+# Seconds between the tick profiler log lines, 0 -> no log
+profiler_log_interval = 30
+# Hosts allowed to ask the server for the {"type": "stats"} admin message
+admin_hosts = ("127.0.0.1", "::1")
+# Prometheus text page with the network I/O counters (netstats.py), served on this local address
+metrics_host = "127.0.0.1"
+metrics_port = 9022
+# Seed of the simulation random generator, None -> random
+random_seed = None
+# Directory to record the inputs of every server run to (recording.py, replayed by replay.py), None -> no recording
+record_dir = None
+# Ticks between the world checksums in the recording, the replay checks them; 0 -> no checksums
+record_checksum_interval = 600
+# Run the simulation in a worker process (physics.py), the main process only serves the clients; the world is copied
+# into a triple buffer in shared memory every tick. Needs fork (Linux, macOS), the inputs aren't recorded in this mode
+physics_worker = False
+# Entities of every type the shared world buffer has room for
+physics_buffer_capacity = 16384
+# Serve the clients from this many gateway processes (gateway.py, all of them on port 2022 with SO_REUSEPORT), the main
+# process only runs the simulation; 0 -> the main process does everything. Needs fork, the inputs aren't recorded
+gateway_processes = 0
+# Directory of the Unix domain sockets between the processes, None -> $XDG_RUNTIME_DIR/tanks or /tmp/tanks-<uid>.
+# Only this user may have access to it (gateway.socket_dir() checks it), the processes trust each other's messages
+socket_dir = None
+# Unix domain socket between the gateways and the simulation process, in socket_dir
+gateway_socket = "simulation.sock"
+# Split the map into this many vertical strips, each one simulated by its own process (shards.py); the main process
+# and the gateway processes route the clients to them. 0 -> no sharding. Needs fork, the inputs aren't recorded
+shards = 0
+# Unix domain socket of every shard in socket_dir, formatted with its index
+shard_socket = "shard-{}.sock"
+# Entities this close to a strip border are copied to the neighbouring shard for its hit detection, it has to cover
+# the biggest radii plus how far things move during the couple of ticks the copies lag behind
+shard_ghost_margin = 100
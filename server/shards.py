@@ -0,0 +1,661 @@
+"""
+Spatially sharded world (settings.shards): the map is cut into vertical strips of the same width, every strip is
+simulated by its own process (ShardProcessing), so the world and the player count aren't capped by one core.
+
+- A shard owns the entities inside of its strip. An entity which crossed the border is handed off to the shard it's
+  in now with all its state (timers included) and keeps its handle: the handle slots are split between the shards,
+  a handle goes back to the shard it came from when its entity is removed.
+- The entities within settings.shard_ghost_margin of a border are copied to the neighbour every tick (ghosts).
+  The ghosts take part in the hit detection there, a hit between an own entity and a ghost is resolved by one of
+  the two shards only, see ShardProcessing.resolves(). What happens to the ghost (damage, kill, score of its tank)
+  is sent to its owner; explosions reaching over a border are set off in the shards there too.
+- Shards talk to each other over their Unix sockets, in the batches of gateway.py, once per tick. Everything they
+  get is applied at the start of their next tick, the events about the entities which have just been handed off
+  are forwarded to the new owner.
+
+Gateways (ShardedGateway) are the coordinators: connected to all the shards, they merge the worlds of the shards for
+their clients and send the commands of every client to the shard which owns its tank at the moment.
+
+All of it runs on one box: python main.py with settings.shards > 0, or by hand, every shard and then the gateways:
+python shards.py shard index, python shards.py gateway index
+"""
+
+import asyncio
+import itertools
+import multiprocessing
+import sys
+import time
+import traceback
+
+import numpy as np
+
+import archetypes
+import gateway
+import handles
+import physics
+import processing
+import settings
+import spatial
+
+# Events only the shards send to each other
+PEER_EVENTS = {"ghosts", "adopt", "damage", "disappear", "reward", "explode", "release"}
+
+
+def strip_of(x, map_dim, count):
+    """
+    :return: index of the shard owning the x coordinate, the ones outside of the map belong to the border strips
+    """
+
+    return min(count - 1, max(0, int(x * count // map_dim)))
+
+
+def shard_paths(count):
+    return [gateway.socket_path(settings.shard_socket.format(a)) for a in range(count)]
+
+
+class ShardHandles(handles.HandleAllocator):
+    """
+    Handle slots of one shard. The handles of the other shards are released by giving them back where they came from
+    """
+
+    def __init__(self, index, count):
+        per_shard = (handles.index_mask + 1) // count
+        super().__init__(index * per_shard, per_shard)
+        self.given_back = []  # handles of the other shards, to be released there
+
+    def origin(self, handle):
+        """
+        :return: index of the shard the handle is from
+        """
+
+        return (handle & handles.index_mask) // self.count
+
+    def release(self, handle):
+        if self.first <= handle & handles.index_mask < self.first + self.count:
+            super().release(handle)
+        else:
+            self.given_back.append(handle)
+
+
+class ShardProcessing(processing.Processing):
+    """
+    Processing of one strip of the map, with the array store
+    """
+
+    def __init__(self, index, count, processing_rate, food_amount=300, map_dim=2000, network_rate=None, seed=None):
+        """
+        :param index: number of the strip, from the left
+        :param count: amount of the strips
+        """
+
+        super().__init__(processing_rate, food_amount, map_dim, True, network_rate, seed)
+        self.index = index
+        self.count = count
+        self.x_range = (map_dim * index / count, map_dim * (index + 1) / count)
+        self.handles = ShardHandles(index, count)
+        self.food_spawner.area = (np.array([self.x_range[0], 0]), np.array([self.x_range[1], map_dim]))
+        self.collections = {"tank": (self.tanks, self.tanks_store, self.tanks_index),
+                            "food": (self.food, self.food_store, self.food_index),
+                            "projectile": (self.projectiles, self.projectiles_store, self.projectiles_index)}
+
+        self.neighbours = [a for a in (index - 1, index + 1) if 0 <= a < count]
+        self.ghost_records = {}  # neighbour -> {type: DTYPES records} of its ghosts, as of its last tick
+        self.ghost_tanks = {}
+        self.ghost_food = {}
+        self.ghost_projectiles = {}
+        self.ghost_owners = {}  # ghost uuid -> shard
+        # Ghost tanks and food by position, for the spawn checks
+        self.ghost_tanks_index = spatial.SpatialHash(self.tanks_index.cell_size)
+        self.ghost_food_index = spatial.SpatialHash(self.food_index.cell_size)
+        self.incoming = []  # events of the other shards, applied at the start of the next tick
+        self.outgoing = {a: [] for a in range(count) if a != index}  # shard -> events for it
+        self.handed_off = {}  # uuid -> (shard, tick) of the entities handed off lately, for the late events
+        self.handed_off_ticks = round(processing_rate)
+
+    async def process_tick(self):
+        await self.apply_incoming()
+        await super().process_tick()
+
+        t = time.perf_counter()
+        handed_off = self.hand_off()
+        self.export_ghosts()
+        for handle in self.handles.given_back:
+            self.outgoing[self.handles.origin(handle)].append(("release", handle))
+        self.handles.given_back = []
+        for uuid_ in [a for a, (_, b) in self.handed_off.items() if self.tick - b > self.handed_off_ticks]:
+            del self.handed_off[uuid_]
+        self.net.send_peers()
+        self.profiler.add("shard_exchange", time.perf_counter() - t, handed_off)
+
+    def forward(self, uuid_, event):
+        """
+        Passes the event on to the shard the entity was handed off to
+        :return: False if it wasn't handed off lately
+        """
+
+        moved = self.handed_off.get(uuid_)
+        if moved is None:
+            return False
+        self.outgoing[moved[0]].append(event)
+        return True
+
+    def hand_off(self):
+        """
+        Passes the entities which left the strip to the shards they are in now
+        :return: amount of them
+        """
+
+        ret = 0
+        for type_, (items, store, _) in self.collections.items():
+            slots = store.active_slots()
+            x = store.arrays["pos"][slots, 0]
+            leaving = slots[(x < self.x_range[0]) & (self.index > 0) |
+                            (x >= self.x_range[1]) & (self.index < self.count - 1)]
+            if not len(leaving):
+                continue
+            # Gateways keep showing them until the new shards publish them
+            records = np.empty(len(leaving), physics.DTYPES[type_])
+            physics.fill_records(records, store, leaving)
+            self.net.outbox.append(("transit", type_, records))
+
+            for uuid_, x in zip([store.ids[a] for a in leaving], store.arrays["pos"][leaving, 0].tolist()):
+                shard = strip_of(x, self.world_size[0], self.count)
+                client = self.net.hand_off(uuid_, shard) if type_ == "tank" else None
+                self.outgoing[shard].append(("adopt", type_, *self.detach_entity(type_, uuid_), client))
+                self.handed_off[uuid_] = (shard, self.tick)
+            ret += len(leaving)
+        return ret
+
+    def detach_entity(self, type_, uuid_):
+        """
+        Removes the entity from this shard, without telling the clients
+        :return: its fields, {timer kind: time from now}, whether it's animating and regenerating
+        """
+
+        items, store, index = self.collections[type_]
+        obj = items.pop(uuid_)
+        fields = physics.detach(obj)
+        # Times are relative on the way, the shards' clocks aren't the same
+        for name in ("last_time", "last_damage_time"):
+            if fields.get(name):
+                fields[name] -= self.time
+        timers = {kind: at - self.time for kind, at in self.timers.scheduled(uuid_).items()}
+        state = uuid_ in self.animating, uuid_ in self.regenerating
+
+        store.remove(obj)
+        index.remove(uuid_)
+        self.forget_timers(uuid_)
+        self.commands.pop(uuid_, None)
+        return fields, timers, *state
+
+    def adopt(self, type_, fields, timers, animating, regenerating, client):
+        """
+        Takes over the entity handed off by another shard
+        :param client: index of the gateway of the tank's client, None -> no client
+        """
+
+        uuid_ = fields["uuid"]
+        for name in ("last_time", "last_damage_time"):
+            if fields.get(name):
+                fields[name] += self.time
+        items, store, index = self.collections[type_]
+        obj = items[uuid_] = store.add(uuid_, fields)
+        index.insert(uuid_, obj["pos"], obj["radius"])
+        for kind, at in timers.items():
+            self.timers.schedule(self.time + at, uuid_, kind)
+        if animating:
+            self.animating[uuid_] = obj
+        if regenerating:
+            self.regenerating[uuid_] = obj
+        if type_ == "tank":
+            self.net.adopt(uuid_, client)
+        self.handed_off.pop(uuid_, None)
+        # Its ghost from the previous owner stays until the next update_ghosts() otherwise
+        self.ghost_owners.pop(uuid_, None)
+        ghosts, ghosts_index = self.get_ghosts(type_)
+        ghosts.pop(uuid_, None)
+        if ghosts_index is not None:
+            ghosts_index.remove(uuid_)
+
+    def get_ghosts(self, type_):
+        """
+        :return: ghosts of the type, their SpatialHash (None for the projectiles)
+        """
+
+        if type_ == "tank":
+            return self.ghost_tanks, self.ghost_tanks_index
+        if type_ == "food":
+            return self.ghost_food, self.ghost_food_index
+        return self.ghost_projectiles, None
+
+    def export_ghosts(self):
+        margin = settings.shard_ghost_margin
+        for shard in self.neighbours:
+            records = {}
+            for type_, (_, store, _) in self.collections.items():
+                slots = store.active_slots()
+                x = store.arrays["pos"][slots, 0]
+                near = slots[x < self.x_range[0] + margin] if shard < self.index else \
+                    slots[x >= self.x_range[1] - margin]
+                records[type_] = np.empty(len(near), physics.DTYPES[type_])
+                physics.fill_records(records[type_], store, near)
+            self.outgoing[shard].append(("ghosts", self.index, records))
+
+    def update_ghosts(self):
+        """
+        Rebuilds the ghosts out of the latest copies of the neighbours; the entities just adopted aren't ghosts
+        """
+
+        ghosts = {"tank": {}, "food": {}, "projectile": {}}
+        indexes = {"tank": spatial.SpatialHash(self.tanks_index.cell_size),
+                   "food": spatial.SpatialHash(self.food_index.cell_size)}
+        self.ghost_owners = {}
+        for shard, records in self.ghost_records.items():
+            for type_, a in records.items():
+                own = self.collections[type_][0]
+                index = indexes.get(type_)
+                for uuid_, item in physics.to_items(a).items():
+                    if uuid_ not in own:
+                        ghosts[type_][uuid_] = item
+                        self.ghost_owners[uuid_] = shard
+                        if index is not None:
+                            index.insert(uuid_, item["pos"], item["radius"])
+        self.ghost_tanks, self.ghost_food, self.ghost_projectiles = \
+            ghosts["tank"], ghosts["food"], ghosts["projectile"]
+        self.ghost_tanks_index, self.ghost_food_index = indexes["tank"], indexes["food"]
+
+    async def apply_incoming(self):
+        incoming, self.incoming = self.incoming, []
+        ghosts = False
+        for event in incoming:
+            try:
+                if event[0] == "ghosts":
+                    self.ghost_records[event[1]] = event[2]
+                    ghosts = True
+                else:
+                    await self.apply(event)
+            except Exception as e:
+                print("[ShardProcessing.apply_incoming] exception:", e)
+                if self.enable_traceback:
+                    print(traceback.format_exc())
+        if ghosts:
+            self.update_ghosts()
+
+    async def apply(self, event):
+        """
+        Applies the event of another shard (or the command of a gateway it forwarded)
+        """
+
+        kind = event[0]
+        if kind == "adopt":
+            self.adopt(*event[1:])
+        elif kind == "damage":
+            obj = self.get_item(event[1])
+            if obj is None:
+                self.forward(event[1], event)
+            elif obj["health"] <= event[2]:
+                # Hurt here in the meantime
+                await self.disappear_obj(obj)
+            elif not obj["is_disappearing"]:
+                self.damage(obj, event[2], self.time)
+        elif kind == "disappear":
+            obj = self.get_item(event[1])
+            if obj is not None:
+                await self.disappear_obj(obj)
+            else:
+                self.forward(event[1], event)
+        elif kind == "reward":
+            if event[1] in self.tanks:
+                super().reward(*event[1:4])
+            elif not event[4]:
+                # The broadcast copies reach the owner anyway
+                self.forward(event[1], event)
+        elif kind == "explode":
+            _, pos, parent = event
+            parent = self.tanks.get(parent) or self.ghost_tanks.get(parent) or \
+                archetypes.Entity({"uuid": parent, "archetype": archetypes.DEFAULT_TANK})
+            await self.explode(pos, parent, False)
+        elif kind == "release":
+            if self.handles.is_alive(event[1]):
+                self.handles.release(event[1])
+        elif kind == "inputs":
+            for uuid_, j in event[1]:
+                self.queue_input(uuid_, j)
+        elif kind == "delete":
+            if event[1] in self.tanks:
+                await self.delete_tank(event[1], event[2])
+            else:
+                self.forward(event[1], event)
+
+    def queue_input(self, uuid_, j):
+        if uuid_ in self.tanks:
+            super().queue_input(uuid_, j)
+        else:
+            self.forward(uuid_, ("inputs", [(uuid_, j)]))
+
+    def get_colliders(self, p_start, f_start):
+        # Ghosts don't move here, they start where they are
+        return (self.projectiles | self.ghost_projectiles, self.food | self.ghost_food, self.tanks | self.ghost_tanks,
+                np.concatenate((p_start, self.get_positions(self.ghost_projectiles))),
+                np.concatenate((f_start, self.get_positions(self.ghost_food))))
+
+    def resolves(self, obj1, obj2):
+        """
+        Ghosts don't hit anything here, their owners do it. A hit of an own entity on a ghost of the same type is
+        resolved by the owner of the lower handle (the other shard sees the same pair the other way around)
+        """
+
+        if obj1["uuid"] in self.ghost_owners:
+            return False
+        if obj2["uuid"] in self.ghost_owners and obj1["type"] == obj2["type"]:
+            return obj1["uuid"] < obj2["uuid"]
+        return True
+
+    def damage(self, obj, amount, t):
+        owner = self.ghost_owners.get(obj["uuid"])
+        if owner is None:
+            super().damage(obj, amount, t)
+            return
+        # For the rest of the tick here, the owner does the rest
+        obj["health"] -= amount
+        self.outgoing[owner].append(("damage", obj["uuid"], amount))
+
+    async def disappear_obj(self, *items_to_disappear):
+        own = []
+        for item in items_to_disappear:
+            owner = self.ghost_owners.get(item["uuid"])
+            if owner is None:
+                own.append(item)
+            elif item["type"] == "projectile" and item["lifetime"] > 0:
+                item["lifetime"] = 0
+                self.outgoing[owner].append(("disappear", item["uuid"]))
+            elif item["type"] != "projectile" and not item["is_disappearing"]:
+                item["is_disappearing"] = True
+                self.outgoing[owner].append(("disappear", item["uuid"]))
+        await super().disappear_obj(*own)
+
+    def reward(self, t_uuid_, score, is_bomb):
+        """
+        The reward events are ("reward", tank uuid, score, is_bomb, broadcast), only the owner of the tank applies
+        a broadcast one
+        """
+
+        if t_uuid_ in self.tanks:
+            super().reward(t_uuid_, score, is_bomb)
+        elif not self.forward(t_uuid_, ("reward", t_uuid_, score, is_bomb, False)):
+            # Wherever the tank is
+            for events in self.outgoing.values():
+                events.append(("reward", t_uuid_, score, is_bomb, True))
+
+    async def explode(self, pos, parent, spread=True):
+        """
+        :param spread: set it off in the other shards within reach too
+        """
+
+        await super().explode(pos, parent)
+        if spread:
+            radius = settings.explosion_radius
+            for shard in range(strip_of(pos[0] - radius, self.world_size[0], self.count),
+                               strip_of(pos[0] + radius, self.world_size[0], self.count) + 1):
+                if shard != self.index:
+                    self.outgoing[shard].append(("explode", [float(a) for a in pos], parent["uuid"]))
+
+    def is_ghost_around(self, ghosts_index, c2, radius_around):
+        margin = settings.shard_ghost_margin
+        if self.x_range[0] + margin <= c2[0] < self.x_range[1] - margin:
+            return False
+        return len(ghosts_index.query(c2[:2], c2[2] + radius_around)) > 0
+
+    async def are_tanks_around(self, c2, radius_around):
+        return await super().are_tanks_around(c2, radius_around) or \
+            self.is_ghost_around(self.ghost_tanks_index, c2, radius_around)
+
+    async def are_food_around(self, c2, radius_around):
+        return await super().are_food_around(c2, radius_around) or \
+            self.is_ghost_around(self.ghost_food_index, c2, radius_around)
+
+    async def spawn_tank(self, ws, name, pos=None, archetype=archetypes.DEFAULT_TANK):
+        if pos is None:
+            pos = [self.random.randint(int(self.x_range[0]), int(self.x_range[1]) - 1),
+                   self.random.randint(0, self.world_size[1])]
+        return await super().spawn_tank(ws, name, pos, archetype)
+
+    def get_food_amount(self):
+        """
+        :return: share of the strip in Processing.get_food_amount()
+        """
+
+        area_k = self.world_size[0] * self.world_size[1] / settings.food_amount_map_dim ** 2 / self.count
+        return int(self.food_amount * area_k) + settings.food_per_player * len(self.tanks)
+
+    async def start(self):
+        # The shards tick on the same grid, so their worlds come to the gateways together
+        await asyncio.sleep(-time.monotonic() % (self.ticks_per_snapshot * self.processing_time))
+        await super().start()
+
+    async def init_world(self):
+        # The test tank is in the top left corner
+        if self.index == 0:
+            await super().init_world()
+
+    def get_stats(self):
+        return super().get_stats() | {"shard": self.index, "x_range": self.x_range, "ghosts": len(self.ghost_owners),
+                                      "handed_off": len(self.handed_off)}
+
+
+class ShardHub(gateway.SimulationHub):
+    """
+    SimulationHub of a shard, exchanges the hand-offs, ghosts and effects with the other shards as well
+    """
+
+    routed = gateway.SimulationHub.routed | {"moved": 1}
+    leaving = gateway.SimulationHub.leaving | {"moved"}
+
+    def __init__(self, p, path, peer_paths):
+        """
+        :param peer_paths: {shard: Unix socket} of the other shards
+        """
+
+        super().__init__(p, path)
+        self.peer_paths = peer_paths
+        self.peers = {}  # shard -> StreamWriter
+
+    def hand_off(self, uuid_, shard):
+        """
+        The gateway of the tank's client is told about the new shard
+        :return: index of the gateway, None if the tank has no client
+        """
+
+        self.announced.discard(uuid_)
+        self.outbox.append(("moved", uuid_, shard))
+        return self.gateways.get(self.owners.get(uuid_))
+
+    def adopt(self, uuid_, client):
+        for writer, index in self.gateways.items():
+            if index == client:
+                self.owners[uuid_] = writer
+
+    async def execute(self, command, gateway=None):
+        p = self.processing
+        if command[0] in PEER_EVENTS:
+            p.incoming.append(command)
+        elif command[0] == "delete" and command[1] not in p.tanks:
+            p.forward(command[1], command)
+        else:
+            await super().execute(command, gateway)
+
+    def send_peers(self):
+        for shard, events in self.processing.outgoing.items():
+            if events and shard in self.peers:
+                gateway.write_batch(self.peers[shard], [gateway.encode_event(a) for a in events])
+                events.clear()
+
+    async def run(self):
+        p = self.processing
+        async with await self.listen() as server:
+            # The shards wait for each other before the first tick
+            for shard, path in self.peer_paths.items():
+                _, self.peers[shard] = await gateway.open_connection(path)
+            print(f"[ShardHub.run] shard {p.index}: connected to {len(self.peers)} other shards")
+            await asyncio.gather(p.start(), p.auto_spawn_food(), self.send_stats(), server.serve_forever())
+
+
+class ShardedGateway(gateway.Gateway):
+    """
+    Gateway of the sharded world: mirrors the worlds of all the shards merged together and routes the commands of
+    every client to the shard which owns its tank
+    """
+
+    def __init__(self, paths, index, processing_rate, map_dim=2000, network_rate=None):
+        """
+        :param paths: Unix sockets of the shards
+        """
+
+        super().__init__(None, index, processing_rate, map_dim, network_rate)
+        self.paths = paths
+        self.readers = []
+        self.writers = []
+        self.routes = {}  # tank uuid -> shard
+        self.worlds = [None] * len(paths)  # shard -> (tick, records) not broadcast yet
+        self.shard_tanks = [0] * len(paths)  # tanks in every shard, to spread the new ones
+        self.shard_stats = [None] * len(paths)
+        self.transit = {}  # uuid -> [type, record, broadcasts to keep it for] of the entities being handed off
+
+    async def connect(self):
+        for path in self.paths:
+            reader, writer = await gateway.open_connection(path)
+            self.readers.append(reader)
+            self.writers.append(writer)
+        self.send_commands([("gateway", self.index)])
+
+    def send_commands(self, commands):
+        batches = [[] for _ in self.writers]
+        for command in commands:
+            if command[0] == "spawn":
+                shard = min(range(len(self.writers)), key=self.shard_tanks.__getitem__)
+                self.shard_tanks[shard] += 1
+                batches[shard].append(command)
+            elif command[0] == "inputs":
+                inputs = {}
+                for uuid_, j in command[1]:
+                    shard = self.routes.get(uuid_)
+                    if shard is not None:
+                        inputs.setdefault(shard, []).append((uuid_, j))
+                for shard, a in inputs.items():
+                    batches[shard].append(("inputs", a))
+            elif command[0] == "delete":
+                shard = self.routes.pop(command[1], None)
+                if shard is not None:
+                    batches[shard].append(command)
+            else:
+                for batch in batches:
+                    batch.append(command)
+        for writer, batch in zip(self.writers, batches):
+            if batch:
+                gateway.write_batch(writer, [gateway.encode_event(a) for a in batch])
+
+    async def serve_events(self):
+        await asyncio.gather(*(self.serve_shard(a) for a in range(len(self.readers))))
+
+    async def serve_shard(self, shard):
+        try:
+            while True:
+                for event in await gateway.read_batch(self.readers[shard]):
+                    try:
+                        await self.dispatch_shard(shard, event)
+                    except Exception as e:
+                        print("[ShardedGateway.serve_shard] exception:", e)
+                        if self.enable_traceback:
+                            print(traceback.format_exc())
+                if all(self.worlds):
+                    await self.broadcast_shards()
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            print(f"[ShardedGateway.serve_shard] shard {shard} disconnected:", repr(e))
+
+    async def dispatch_shard(self, shard, event):
+        if event[0] == "world":
+            self.worlds[shard] = event[1:]
+        elif event[0] == "transit":
+            _, type_, records = event
+            for i, uuid_ in enumerate(records["uuid"].tolist()):
+                self.transit[uuid_] = [type_, records[i:i + 1], 2]
+        elif event[0] == "moved":
+            self.routes[event[1]] = event[2]
+        else:
+            if event[0] == "spawned":
+                self.routes[event[2]] = shard
+            elif event[0] == "forget":
+                self.routes.pop(event[1], None)
+            elif event[0] == "stats":
+                self.shard_stats[shard] = event[1]
+            await self.dispatch(event)
+
+    async def broadcast_shards(self):
+        """
+        Broadcasts the worlds of the shards together, once every one of them has sent a newer one
+        """
+
+        self.profiler.start()
+        worlds, self.worlds = self.worlds, [None] * len(self.worlds)
+        self.shard_tanks = [len(a[1]["tank"]) for a in worlds]
+        records = {a: [b[1][a] for b in worlds] for a in physics.DTYPES}
+        if self.transit:
+            # Handed off, but not in the world of the new shard yet
+            published = set(itertools.chain.from_iterable(np.concatenate(a)["uuid"].tolist()
+                                                          for a in records.values()))
+            for uuid_, a in list(self.transit.items()):
+                a[2] -= 1
+                if uuid_ in published or a[2] < 0:
+                    del self.transit[uuid_]
+                else:
+                    records[a[0]].append(a[1])
+        # The oldest tick of them is the tick of the whole world
+        await self.broadcast(min(a[0] for a in worlds), {a: np.concatenate(b) for a, b in records.items()})
+
+    def get_stats(self):
+        return super().get_stats() | {"shards": self.shard_stats}
+
+
+def run_shard(index):
+    count = settings.shards
+    seed = None if settings.random_seed is None else settings.random_seed + index
+    p = ShardProcessing(index, count, settings.simulation_rate, settings.food_amount, settings.map_dim,
+                        settings.network_rate, seed)
+    paths = shard_paths(count)
+    p.net = ShardHub(p, paths[index], {a: b for a, b in enumerate(paths) if a != index})
+    try:
+        asyncio.run(p.net.run())
+    except KeyboardInterrupt:
+        pass
+
+
+def run_gateway(index):
+    """
+    ShardedGateway number index, its metrics are on settings.metrics_port + index
+    """
+
+    gateway_ = ShardedGateway(shard_paths(settings.shards), index, settings.simulation_rate, settings.map_dim,
+                              settings.network_rate)
+    try:
+        asyncio.run(gateway_.run(metrics_port=settings.metrics_port + index))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_shards(count):
+    """
+    Forks the shard processes, before the event loop runs
+    """
+
+    ctx = multiprocessing.get_context("fork")
+    processes = [ctx.Process(target=run_shard, args=(i,), daemon=True, name=f"shard {i}") for i in range(count)]
+    for process in processes:
+        process.start()
+    return processes
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("shard", "gateway"):
+        print("Usage: python shards.py shard|gateway index")
+        sys.exit(1)
+    (run_shard if sys.argv[1] == "shard" else run_gateway)(int(sys.argv[2]))
@@ -0,0 +1,141 @@
+import math
+
+import numpy as np
+
+
+class SpatialHash:
+    """
+    Uniform grid (spatial hash) of circles: {id: [x, y, radius]}.
+    Every circle is stored in all the cells its bounding box touches, so a query only looks at the cells around
+    the queried area. Cells are kept in a dict, so entities slightly outside of the map are fine too.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}  # (cx, cy) -> {id: None}
+        self.entries = {}  # id -> [x, y, radius, cell_range, seq, id]
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, id_):
+        return id_ in self.entries
+
+    def cell_range(self, x, y, radius):
+        cs = self.cell_size
+        return (math.floor((x - radius) / cs), math.floor((y - radius) / cs),
+                math.floor((x + radius) / cs), math.floor((y + radius) / cs))
+
+    def _link(self, id_, cell_range):
+        x1, y1, x2, y2 = cell_range
+        for cx in range(x1, x2 + 1):
+            for cy in range(y1, y2 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is None:
+                    self.cells[(cx, cy)] = cell = {}
+                cell[id_] = None
+
+    def _unlink(self, id_, cell_range):
+        x1, y1, x2, y2 = cell_range
+        for cx in range(x1, x2 + 1):
+            for cy in range(y1, y2 + 1):
+                cell = self.cells[(cx, cy)]
+                del cell[id_]
+                if not cell:
+                    del self.cells[(cx, cy)]
+
+    def insert(self, id_, pos, radius):
+        if id_ in self.entries:
+            self.update(id_, pos, radius)
+            return
+        cell_range = self.cell_range(pos[0], pos[1], radius)
+        self.entries[id_] = [pos[0], pos[1], radius, cell_range, self.seq, id_]
+        self.seq += 1
+        self._link(id_, cell_range)
+
+    def update(self, id_, pos, radius):
+        """
+        Moves already inserted circle. Cells are only touched if the circle crossed a cell border
+        """
+
+        entry = self.entries[id_]
+        entry[0], entry[1], entry[2] = pos[0], pos[1], radius
+        cell_range = self.cell_range(pos[0], pos[1], radius)
+        if cell_range != entry[3]:
+            self._unlink(id_, entry[3])
+            self._link(id_, cell_range)
+            entry[3] = cell_range
+
+    def update_many(self, ids, positions, radii):
+        """
+        update() for a batch of circles, cell ranges are computed in one go
+        :param ids: list of ids
+        :param positions: numpy array (n, 2)
+        :param radii: numpy array (n,)
+        """
+
+        lo = np.floor((positions - radii[:, None]) / self.cell_size).astype(int).tolist()
+        hi = np.floor((positions + radii[:, None]) / self.cell_size).astype(int).tolist()
+        for id_, (x, y), radius, (x1, y1), (x2, y2) in zip(ids, positions.tolist(), radii.tolist(), lo, hi):
+            entry = self.entries[id_]
+            entry[0], entry[1], entry[2] = x, y, radius
+            cell_range = (x1, y1, x2, y2)
+            if cell_range != entry[3]:
+                self._unlink(id_, entry[3])
+                self._link(id_, cell_range)
+                entry[3] = cell_range
+
+    def remove(self, id_):
+        entry = self.entries.pop(id_, None)
+        if entry is not None:
+            self._unlink(id_, entry[3])
+
+    def _candidates(self, x1, y1, x2, y2):
+        cs = self.cell_size
+        cx1, cy1, cx2, cy2 = math.floor(x1 / cs), math.floor(y1 / cs), math.floor(x2 / cs), math.floor(y2 / cs)
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(self.cells):
+            # Huge area (ex. explosion on a small map), iterating over the existing cells is cheaper
+            found = {}
+            for (cx, cy), cell in self.cells.items():
+                if cx1 <= cx <= cx2 and cy1 <= cy <= cy2:
+                    found.update(cell)
+            return found
+
+        found = {}
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is not None:
+                    found.update(cell)
+        return found
+
+    def query(self, pos, radius):
+        """
+        :param pos: [x, y]
+        :param radius: radius of the area
+        :return: ids of the circles intersecting with the area, in insertion order
+        """
+
+        x, y = pos[0], pos[1]
+        ret = []
+        for id_ in self._candidates(x - radius, y - radius, x + radius, y + radius):
+            entry = self.entries[id_]
+            r = radius + entry[2]
+            if (entry[0] - x) ** 2 + (entry[1] - y) ** 2 <= r * r:
+                ret.append(entry)
+        ret.sort(key=lambda e: e[4])
+        return [e[5] for e in ret]
+
+    def query_rect(self, top_left, bottom_right):
+        """
+        :return: ids of the circles which centers lie inside of the rectangle, in insertion order
+        """
+
+        ret = []
+        for id_ in self._candidates(top_left[0], top_left[1], bottom_right[0], bottom_right[1]):
+            entry = self.entries[id_]
+            if top_left[0] < entry[0] < bottom_right[0] and top_left[1] < entry[1] < bottom_right[1]:
+                ret.append(entry)
+        ret.sort(key=lambda e: e[4])
+        return [e[5] for e in ret]
@@ -0,0 +1,160 @@
+"""
+Round-trip checks of the binary protocol and the JSON fallback: python -m pytest
+"""
+
+import asyncio
+import json
+import math
+import os
+
+import pytest
+
+import archetypes
+import processing
+import protocol
+import tools
+
+ANGLE_TOLERANCE = 360 / 65536
+POS_TOLERANCE = 1 / protocol.POS_SCALE
+
+
+def is_close(name, original, decoded):
+    if name in ("rotation", "angle"):
+        dif = abs(original % 360 - decoded) % 360
+        return min(dif, 360 - dif) <= ANGLE_TOLERANCE
+    if name == "pos":
+        return all(abs(a - b) <= POS_TOLERANCE for a, b in zip(original, decoded))
+    if name == "colors":
+        return [list(a) for a in original] == decoded
+    if type(original) == float:
+        return math.isclose(original, decoded, rel_tol=1e-6, abs_tol=1e-6)
+    return original == decoded
+
+
+def check_items(items, decoded):
+    assert list(decoded) == list(items)
+    for uuid_, item in items.items():
+        decoded_item = decoded[uuid_]
+        for name, _ in protocol.FIELDS:
+            if name in item:
+                assert is_close(name, item[name], decoded_item[name]), (name, item[name], decoded_item[name])
+            else:
+                assert name not in decoded_item
+        # Fields not in FIELDS aren't sent
+        assert decoded_item.keys() <= {a for a, _ in protocol.FIELDS}
+
+
+def check_round_trip(message):
+    decoded = protocol.decode(protocol.encode(message))
+    assert decoded["type"] == message["type"]
+    assert decoded.get("tick") == message.get("tick")
+    payload, decoded_payload = message["payload"], decoded["payload"]
+    if message["type"] in ("items", "all_items"):
+        check_items(payload, decoded_payload)
+    elif message["type"] == "delta":
+        check_items(payload["created"], decoded_payload["created"])
+        check_items(payload["changed"], decoded_payload["changed"])
+        assert decoded_payload["removed"] == payload["removed"]
+    elif message["type"] == "force_position":
+        assert is_close("pos", payload, decoded_payload)
+    elif message["type"] == "input":
+        for name, value in payload.items():
+            assert is_close(name, value, decoded_payload[name]), (name, value, decoded_payload[name])
+    else:
+        assert decoded_payload == payload
+
+    # JSON fallback has to give the integer handles back
+    json_payload = protocol.decode_json(json.dumps(message, default=tools.json_default))["payload"]
+    if message["type"] in ("items", "all_items", "delete"):
+        assert list(json_payload) == list(payload)
+    elif message["type"] == "delta":
+        assert list(json_payload["created"]) == list(payload["created"])
+        assert list(json_payload["changed"]) == list(payload["changed"])
+        assert json_payload["removed"] == payload["removed"]
+
+
+async def build_world():
+    p = processing.Processing(60, 0, 4000, seed=0)
+    for i in range(5):
+        await p.spawn_tank(None, f"player {i}")
+    for i in range(20):
+        await p.spawn_food([p.random.uniform(0, 4000), p.random.uniform(0, 4000)], p.random.randint(5, 10), 20, 4,
+                           archetypes.BOMB if i % 10 == 0 else archetypes.FOOD)
+    for tank in list(p.tanks.values()):
+        await p.spawn_projectile([*tank["pos"]], p.random.uniform(-180, 180), tank["bullet_speed"],
+                                 tank["bullet_radius"], tank["bullet_damage"], tank["uuid"])
+    return p
+
+
+@pytest.fixture(scope="module")
+def world():
+    return asyncio.run(build_world()).pack()
+
+
+def test_snapshots(world):
+    uuids = list(world)
+    changed = {a: {"pos": [*world[a]["pos"]], "health": world[a]["health"]} for a in uuids[:10]}
+    check_round_trip({"type": "all_items", "tick": 123456, "payload": world})
+    check_round_trip({"type": "items", "payload": {uuids[0]: world[uuids[0]]}})
+    check_round_trip({"type": "delta", "tick": 123457,
+                      "payload": {"created": {uuids[1]: world[uuids[1]]}, "changed": changed,
+                                  "removed": uuids[2:10]}})
+
+
+def test_shared_records(world):
+    records = [protocol.encode_record(a, b) for a, b in world.items()]
+    assert protocol.encode_snapshot("all_items", 7, records) == \
+        protocol.encode({"type": "all_items", "tick": 7, "payload": world})
+
+
+@pytest.mark.parametrize("message", [
+    {"type": "input", "payload": {"pos": [1234.56, 78.9], "rotation": -93.7, "current_shooting_time": 0.15,
+                                  "shoot": True, "explode": False}},
+    {"type": "input", "payload": {"pos": [-20.03, 4000.0], "rotation": 359.999, "current_shooting_time": 0,
+                                  "shoot": False, "explode": True}},
+    {"type": "delete", "payload": {5: {"type": "tank"}, 1 << 20 | 6: {"type": "projectile"}}},
+    {"type": "force_position", "payload": [1000.25, 20.5]},
+    {"type": "inventory", "payload": {"bombs": 3}},
+])
+def test_messages(message):
+    check_round_trip(message)
+
+
+@pytest.mark.parametrize("pos", [[0, 0], [1000.0625, 20.5], [-10.5, 4000.9375]])
+def test_fixed_point_pos(pos):
+    decoded = protocol.decode(protocol.encode({"type": "force_position", "payload": pos}))["payload"]
+    assert decoded == pos
+
+
+@pytest.mark.parametrize("angle", [0, 90, -90, 180.5, 359.99, 720])
+def test_fixed_point_angle(angle):
+    decoded = protocol.decode(protocol.encode({"type": "items", "payload": {1: {"rotation": angle}}}))
+    assert is_close("rotation", angle, decoded["payload"][1]["rotation"])
+
+
+@pytest.mark.parametrize("public_id", ["", "5e0b9a3c-3f4e-4b8e-9d3c-0a1b2c3d4e5f", "short"])
+def test_public_id(public_id):
+    data = protocol.encode_record(1, {"public_id": public_id})
+    assert len(data) == 8 + protocol.PUBLIC_ID_SIZE
+    message = protocol.decode(protocol.encode_snapshot("all_items", 0, [data]))
+    assert message["payload"] == {1: {"public_id": public_id}}
+
+
+def test_unsent_fields():
+    item = {"type": "tank", "health": 5.0, "last_time": 12.5, "last_damage_time": 3.0}
+    assert protocol.decode(protocol.encode({"type": "items", "payload": {1: item}}))["payload"] == \
+        {1: {"type": "tank", "health": 5.0}}
+    # Nothing to send: no record at all, not an empty one
+    assert protocol.encode_record(2, {"last_time": 12.5}) == b""
+    message = protocol.decode(protocol.encode_snapshot("delta", 3, [], [protocol.encode_record(2, {"last_time": 1})]))
+    assert message["payload"]["changed"] == {}
+    message = protocol.decode(protocol.encode({"type": "delta", "tick": 3, "payload": {
+        "created": {}, "changed": {2: {"last_time": 1}, 3: {"health": 2.0}}, "removed": []}}))
+    assert message["payload"]["changed"] == {3: {"health": 2.0}}
+
+
+def test_client_protocol_is_the_same():
+    client_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(protocol.__file__))), "client",
+                               "protocol.py")
+    with open(protocol.__file__) as server, open(client_path) as client:
+        assert server.read() == client.read()
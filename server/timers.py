@@ -0,0 +1,71 @@
+import heapq
+import itertools
+
+
+class TimerQueue:
+    """
+    Min-heap of the timed entity events (projectile expiry, end of the animations, regen resume, ...), so an entity
+    costs nothing per tick until its event is due.
+    An entity has at most one pending event of every kind: scheduling it again replaces the previous one, replaced and
+    cancelled events are dropped when they come out of the heap
+    """
+
+    def __init__(self):
+        self.heap = []  # [(time, seq, id, kind)]
+        self.pending = {}  # id -> {kind: (time, seq) of the event}
+        self.counter = itertools.count()
+        self.count = 0  # pending events
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, at, id_, kind):
+        seq = next(self.counter)
+        kinds = self.pending.setdefault(id_, {})
+        if kind not in kinds:
+            self.count += 1
+        kinds[kind] = at, seq
+        heapq.heappush(self.heap, (at, seq, id_, kind))
+
+    def cancel(self, id_, kind=None):
+        """
+        :param kind: None -> all the events of the entity
+        """
+
+        if kind is None:
+            self.count -= len(self.pending.pop(id_, ()))
+            return
+        kinds = self.pending.get(id_)
+        if kinds is not None and kind in kinds:
+            del kinds[kind]
+            self.count -= 1
+            if not kinds:
+                del self.pending[id_]
+
+    def is_scheduled(self, id_, kind):
+        return kind in self.pending.get(id_, ())
+
+    def scheduled(self, id_):
+        """
+        :return: {kind: time} of the pending events of the entity
+        """
+
+        return {kind: at for kind, (at, _) in self.pending.get(id_, {}).items()}
+
+    def pop_due(self, t):
+        """
+        :return: [(id, kind)] of the events due by the time t, in the order of their time
+        """
+
+        due = []
+        while self.heap and self.heap[0][0] <= t:
+            at, seq, id_, kind = heapq.heappop(self.heap)
+            kinds = self.pending.get(id_)
+            if kinds is None or kinds.get(kind) != (at, seq):
+                continue
+            del kinds[kind]
+            self.count -= 1
+            if not kinds:
+                del self.pending[id_]
+            due.append((id_, kind))
+        return due
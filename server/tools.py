@@ -1,4 +1,6 @@
-import math
+from collections.abc import Mapping
+
+import numpy as np
 
 
 def collide(point, top_left, bottom_right) -> bool:
@@ -6,7 +8,8 @@ def collide(point, top_left, bottom_right) -> bool:
 
 
 def are_intersecting(c1: tuple, c2: tuple):
-    return math.sqrt((c2[0] - c1[0]) ** 2 + (c2[1] - c1[1]) ** 2) <= c1[2] + c2[2]
+    r = c1[2] + c2[2]
+    return (c2[0] - c1[0]) ** 2 + (c2[1] - c1[1]) ** 2 <= r * r
 
 
 def get_intersecting_circles(circles):
@@ -17,9 +20,153 @@ def get_intersecting_circles(circles):
 
     keys = list(circles.keys())
     ret = {}
-    for i in range(len(keys)):
-        for i2 in range(i + 1, len(circles)):
-            if are_intersecting(circles[keys[i]], circles[keys[i2]]):
-                ret[keys[i]] = ret[keys[i]] + [keys[i2]] if keys[i] in ret else [keys[i2]]
+    for i, i2 in zip(*get_intersecting_pairs(np.array(list(circles.values()), dtype=float).reshape(-1, 3))):
+        ret.setdefault(keys[i], []).append(keys[i2])
+    return ret
+
+
+# Max amount of candidate pairs checked at once by get_intersecting_pairs(), limits temporary arrays size
+pairs_block_size = 1 << 18
+
+
+def get_intersecting_pairs(circles1, circles2=None):
+    """
+    Sort-and-sweep along x axis, exact test with squared distances
+    :param circles1: numpy array (n, 3): [[x1, y1, r1], [x2, y2, r2], ...]
+    :param circles2: numpy array (m, 3); None -> pairs inside of circles1, i < i2
+    :return: (i, i2) numpy index arrays of the intersecting circles1[i] and circles2[i2], sorted by i, then by i2
+    """
+
+    same = circles2 is None
+    if same:
+        circles2 = circles1
+    if len(circles1) == 0 or len(circles2) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    # circles2 sorted by the left edge; for circles1[i] candidates are [lo[i], hi[i]) of the sorted circles2
+    left2 = circles2[:, 0] - circles2[:, 2]
+    order = np.argsort(left2, kind="stable")
+    left2 = left2[order]
+    lo = np.searchsorted(left2, circles1[:, 0] - circles1[:, 2] - 2 * circles2[:, 2].max(), "left")
+    hi = np.searchsorted(left2, circles1[:, 0] + circles1[:, 2], "right")
+    counts = hi - lo
+
+    ret_i, ret_i2 = [], []
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(circles1):
+        # Block of circles1 which candidates fit into pairs_block_size (at least one circle)
+        base = ends[start - 1] if start > 0 else 0
+        stop = max(int(np.searchsorted(ends, base + pairs_block_size, "right")), start + 1)
 
+        block_counts = counts[start:stop]
+        i = np.repeat(np.arange(start, stop), block_counts)
+        offsets = np.arange(len(i)) - np.repeat(np.cumsum(block_counts) - block_counts, block_counts)
+        i2 = order[np.repeat(lo[start:stop], block_counts) + offsets]
+
+        c1, c2 = circles1[i], circles2[i2]
+        r = c1[:, 2] + c2[:, 2]
+        hit = (c1[:, 0] - c2[:, 0]) ** 2 + (c1[:, 1] - c2[:, 1]) ** 2 <= r * r
+        if same:
+            hit &= i < i2
+        ret_i.append(i[hit])
+        ret_i2.append(i2[hit])
+        start = stop
+
+    i, i2 = np.concatenate(ret_i), np.concatenate(ret_i2)
+    order = np.lexsort((i2, i))
+    return i[order], i2[order]
+
+
+def get_times_of_impact(d, v, r):
+    """
+    Earliest time t in [0, 1] when |d + v * t| <= r, vectorized
+    :param d: numpy array (n, 2) of the relative positions at the start of the step
+    :param v: numpy array (n, 2) of the relative movements during the step
+    :param r: numpy array (n,) of the radii sums
+    :return: numpy array (n,) of the times, inf if the circles don't touch during the step
+    """
+
+    a = (v * v).sum(axis=1)
+    b = (d * v).sum(axis=1)
+    c = (d * d).sum(axis=1) - r * r
+    disc = b * b - a * c
+
+    toi = np.full(len(d), np.inf)
+    approaching = (c > 0) & (b < 0) & (disc >= 0) & (a > 0)
+    toi[approaching] = (-b[approaching] - np.sqrt(disc[approaching])) / a[approaching]
+    toi[toi > 1] = np.inf
+    toi[c <= 0] = 0
+    return toi
+
+
+def get_swept_pairs(start1, circles1, start2=None, circles2=None):
+    """
+    Continuous collision detection: circles moving in straight lines from their start positions to the current ones
+    during the step are tested along the whole path, so fast circles can't tunnel through the others
+    :param start1: numpy array (n, 2) of the positions at the start of the step
+    :param circles1: numpy array (n, 3) of the current circles [[x1, y1, r1], ...]
+    :param start2: numpy array (m, 2), None -> circles2 didn't move
+    :param circles2: numpy array (m, 3); None -> pairs inside of circles1, i < i2
+    :return: (i, i2, toi) numpy arrays of the touching pairs and their earliest times of impact (fraction of the step,
+        0 -> intersecting from the start), sorted by i, then by toi
+    """
+
+    same = circles2 is None
+    if same:
+        start2, circles2 = start1, circles1
+    elif start2 is None:
+        start2 = circles2[:, :2]
+
+    # Broad phase: circles around the whole paths
+    def path_circles(start, circles):
+        return np.column_stack(((start + circles[:, :2]) / 2,
+                                circles[:, 2] + np.linalg.norm(circles[:, :2] - start, axis=1) / 2))
+
+    paths1 = path_circles(start1, circles1)
+    i, i2 = get_intersecting_pairs(paths1, None if same else path_circles(start2, circles2))
+
+    d = start1[i] - start2[i2]
+    v = (circles1[i, :2] - start1[i]) - (circles2[i2, :2] - start2[i2])
+    toi = get_times_of_impact(d, v, circles1[i, 2] + circles2[i2, 2])
+    hit = toi <= 1
+    i, i2, toi = i[hit], i2[hit], toi[hit]
+    order = np.lexsort((i2, toi, i))
+    return i[order], i2[order], toi[order]
+
+
+def group_pairs(i, i2):
+    """
+    :return: {i: [i2, ...]} for the pairs returned by get_intersecting_pairs() or get_swept_pairs(), in their order
+    """
+
+    ret = {}
+    for a, b in zip(i.tolist(), i2.tolist()):
+        ret.setdefault(a, []).append(b)
     return ret
+
+
+def json_default(obj):
+    """
+    json.dumps(default=...) hook for the array-backed entities (EntityView, numpy rows and scalars)
+    """
+
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def freeze(value):
+    """
+    Immutable copy of the item field (lists, numpy arrays and dicts become tuples), used to find changed fields
+    """
+
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(freeze(a) for a in value)
+    if isinstance(value, Mapping):
+        return tuple((a, freeze(b)) for a, b in value.items())
+    return value